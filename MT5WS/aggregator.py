@@ -0,0 +1,173 @@
+import numpy as np
+
+# 固定長の時間足の秒数
+TIMEFRAME_SECONDS = {
+    "M1": 60,
+    "M5": 300,
+    "M15": 900,
+    "M30": 1800,
+    "H1": 3600,
+    "H4": 14400,
+    "D1": 86400,
+}
+
+# 週足の起点（MT5 の週足は日曜 0:00 始まり。1970-01-04 が日曜日）
+WEEK_SECONDS = 7 * 86400
+WEEK_ORIGIN = 3 * 86400
+
+# 各バーが属する上位足のバー開始時刻を求める（ベクトル演算）
+# MT5 のバー時刻はブローカーのサーバ時間なので、そのまま区切ればサーバ時間の日・週・月境界になる
+# session_offset（秒）を指定すると、その分ずらした時計で区切る（UTC のデータをサーバ時間で区切る場合など）
+def bucket_start(times, timeframe, session_offset=0):
+    t = np.asarray(times, dtype=np.int64) + session_offset
+    if timeframe in TIMEFRAME_SECONDS:
+        seconds = TIMEFRAME_SECONDS[timeframe]
+        start = t - t % seconds
+    elif timeframe == "W1":
+        start = t - (t - WEEK_ORIGIN) % WEEK_SECONDS
+    elif timeframe == "MN1":
+        start = t.astype("datetime64[s]").astype("datetime64[M]").astype("datetime64[s]").astype(np.int64)
+    else:
+        raise ValueError(f"Invalid timeframe: {timeframe}")
+    return start - session_offset
+
+# 下位足のバー配列から上位足のバー配列を作る
+# 始値は先頭、終値は末尾、高値・安値は最大・最小、出来高は合計、スプレッドは最小（MT5 のバーと同じ扱い）
+def resample(rates, timeframe, session_offset=0):
+    if len(rates) == 0:
+        return rates[:0].copy()
+
+    keys = bucket_start(rates["time"], timeframe, session_offset)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = np.concatenate((starts[1:], [len(rates)])) - 1
+
+    out = np.empty(len(starts), dtype=rates.dtype)
+    out["time"] = keys[starts]
+    out["open"] = rates["open"][starts]
+    out["high"] = np.maximum.reduceat(rates["high"], starts)
+    out["low"] = np.minimum.reduceat(rates["low"], starts)
+    out["close"] = rates["close"][ends]
+    out["tick_volume"] = np.add.reduceat(rates["tick_volume"], starts)
+    out["spread"] = np.minimum.reduceat(rates["spread"], starts)
+    out["real_volume"] = np.add.reduceat(rates["real_volume"], starts)
+    return out
+
+# M1 のバーキャッシュから上位足を組み立てるキャッシュ（BarCache と同じ問い合わせ方ができる）
+# M1 に変化があると、その変化を含む上位足のバー以降だけを組み直す
+# M1 でカバーできない範囲（古い履歴や多すぎる count）は fallback（同じ時間足の BarCache）に任せる
+class DerivedBarCache:
+    def __init__(self, base, timeframe, fallback_factory, session_offset=0):
+        self.base = base
+        self.symbol = base.symbol
+        self.timeframe = timeframe
+        self.session_offset = session_offset
+        self._fallback_factory = fallback_factory
+        self._fallback = None
+        self._bars = None
+        self._pending = None  # 組み直しが必要な M1 の最初の時刻
+        self.listeners = []   # 変更通知先（組み直した最初のバーの時刻を受け取る関数）
+        base.listeners.append(self._on_base_changed)
+        if base.bars is not None:
+            self._pending = int(base.times[0])
+
+    # 有効なバー
+    @property
+    def bars(self):
+        return self._bars
+
+    # 時刻列
+    @property
+    def times(self):
+        return self._bars["time"]
+
+    # 最新のバーの時刻（空なら None）
+    @property
+    def last_time(self):
+        return int(self._bars["time"][-1]) if len(self) else None
+
+    def __len__(self):
+        return 0 if self._bars is None else len(self._bars)
+
+    # M1 側の変更通知
+    def _on_base_changed(self, changed_time):
+        if self._pending is None or changed_time < self._pending:
+            self._pending = changed_time
+
+    # M1 を更新し、変化があった部分の上位足を組み直す
+    # 変化があった最初のバーの時刻を返す（変化なしは None）
+    # 呼び出し元に関係なく、組み直した場合は listeners に通知する
+    def refresh(self, force=False):
+        self.base.refresh(force)
+        if self._pending is None:
+            return None
+        changed = self._pending
+        self._pending = None
+        changed_time = self._rebuild(changed)
+        if changed_time is not None:
+            for listener in self.listeners:
+                listener(changed_time)
+        return changed_time
+
+    # M1 の changed 以降の変化を上位足に反映し、変化した最初のバーの時刻を返す
+    def _rebuild(self, changed):
+        base_bars = self.base.bars
+        base_times = self.base.times
+        if self._bars is None or len(self._bars) == 0 or changed <= base_times[0]:
+            # 全体を組み直す。M1 の先頭が途中から始まる上位足のバーは不完全なので捨てる
+            bars = resample(base_bars, self.timeframe, self.session_offset)
+            if len(bars) > 1 and bars["time"][0] < base_times[0]:
+                bars = bars[1:]
+            self._bars = bars
+            return int(bars["time"][0]) if len(bars) else None
+
+        # 変化した M1 を含む上位足のバー以降だけを組み直す
+        start_time = int(bucket_start([changed], self.timeframe, self.session_offset)[0])
+        keep = int(np.searchsorted(self._bars["time"], start_time, side="left"))
+        base_start = int(np.searchsorted(base_times, start_time, side="left"))
+        tail = resample(base_bars[base_start:], self.timeframe, self.session_offset)
+        if keep + len(tail) == len(self._bars):
+            self._bars[keep:] = tail  # 形成中のバーだけの更新はその場で書き換え
+        else:
+            self._bars = np.concatenate([self._bars[:keep], tail])
+        return start_time
+
+    # 同じ時間足を MT5 から直接取得するキャッシュ（必要になった時に作成）
+    def fallback(self):
+        if self._fallback is None:
+            self._fallback = self._fallback_factory()
+        return self._fallback
+
+    # 最新から count 本を返す
+    def latest(self, count):
+        self.refresh()
+        if count > len(self):
+            return self.fallback().latest(count)
+        return self._bars[-count:] if count > 0 else self._bars[:0]
+
+    # from_time 以降の count 本を返す（二分探索）
+    def since(self, from_time, count):
+        self.refresh()
+        if len(self) == 0 or from_time < self._bars["time"][0]:
+            return self.fallback().since(from_time, count)
+        start = int(np.searchsorted(self._bars["time"], from_time, side="left"))
+        return self._bars[start:start + count]
+
+    # [from_time, to_time] の範囲のバーを返す（二分探索）
+    def range(self, from_time, to_time):
+        self.refresh()
+        if len(self) == 0 or from_time < self._bars["time"][0]:
+            return self.fallback().range(from_time, to_time)
+        times = self._bars["time"]
+        start = int(np.searchsorted(times, from_time, side="left"))
+        end = int(np.searchsorted(times, to_time, side="right"))
+        return self._bars[start:end]
+
+    # [from_time, to_time] の範囲の先頭から最大 limit 本を返す
+    def range_chunk(self, from_time, to_time, limit):
+        self.refresh()
+        if len(self) == 0 or from_time < self._bars["time"][0]:
+            return self.fallback().range_chunk(from_time, to_time, limit)
+        times = self._bars["time"]
+        start = int(np.searchsorted(times, from_time, side="left"))
+        end = int(np.searchsorted(times, to_time, side="right"))
+        return self._bars[start:min(end, start + limit)]
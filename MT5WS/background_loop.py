@@ -0,0 +1,73 @@
+import asyncio
+import queue
+import threading
+
+# 完了した結果を Tk のスレッドで受け取る間隔（ミリ秒）
+DELIVER_INTERVAL_MS = 20
+
+# Tk のメインスレッドとは別スレッドで asyncio のイベントループを動かし続けるクラス
+# 通信（取得・購読）はすべてこのループで行い、Tk のスレッドは待たない
+# 結果は attach() した Tk ウィジェットの after() で Tk のスレッドに戻してからコールバックを呼ぶ
+class BackgroundLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self._done = queue.Queue()  # 完了した (Future, on_done, on_error, key)
+        self._latest = {}           # キー → 最後に投入した Future（Tk のスレッドからのみ触る）
+        self._widget = None
+
+    # スレッド本体（ループを永続実行）
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    # コルーチンをループに投入し concurrent.futures.Future を返す
+    # on_done(結果) / on_error(例外) は完了後に Tk のスレッドで呼ばれる（attach() が必要）
+    # key を指定すると、同じキーで投入済みの未完了の処理をキャンセルし、最後に投入したものの結果だけを渡す
+    def submit(self, coro, on_done=None, on_error=None, key=None):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                previous.cancel()
+            self._latest[key] = future
+        if on_done is not None or on_error is not None or key is not None:
+            future.add_done_callback(lambda f: self._done.put((f, on_done, on_error, key)))
+        return future
+
+    # key で投入した処理が完了待ちか
+    def pending(self, key):
+        return key in self._latest
+
+    # 完了した結果を受け取る Tk ウィジェットを設定し、受け取りを開始
+    def attach(self, widget):
+        self._widget = widget
+        widget.after(DELIVER_INTERVAL_MS, self._deliver)
+
+    # Tk のスレッドで完了した結果のコールバックを呼ぶ（古くなった結果やキャンセルされたものは捨てる）
+    def _deliver(self):
+        while not self._done.empty():
+            future, on_done, on_error, key = self._done.get_nowait()
+            if key is not None:
+                if self._latest.get(key) is not future:
+                    continue
+                del self._latest[key]
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is None:
+                if on_done is not None:
+                    on_done(future.result())
+            elif on_error is not None:
+                on_error(error)
+            else:
+                print(f"[Background] {error!r}")
+        self._widget.after(DELIVER_INTERVAL_MS, self._deliver)
+
+    # 未完了の処理をキャンセルし、ループを停止
+    def stop(self):
+        for future in self._latest.values():
+            future.cancel()
+        self._latest.clear()
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,210 @@
+import time
+import numpy as np
+from datetime import datetime, timezone
+
+# 初回ロード時に MT5 から取得する本数
+INITIAL_BARS = 5000
+
+# 差分更新時に取得する本数（形成中のバー＋直近で確定したバー）
+REFRESH_BARS = 3
+
+# キャッシュに保持する最大本数（超えた分は古い方から捨てる）
+MAX_BARS = 200000
+
+# MT5 への差分問い合わせの最小間隔（秒）。これより短い間隔のリクエストはキャッシュのみで応答
+MIN_REFRESH_INTERVAL = 0.2
+
+# MT5 側に古いバーがなかった後、再び問い合わせるまでの間隔（秒）。MT5 が後から履歴を読み込むことがあるため
+HISTORY_RECHECK_INTERVAL = 60.0
+
+# UNIX秒を MT5 の copy_rates_range に渡す UTC の datetime に変換
+def to_datetime(ts):
+    return datetime.fromtimestamp(int(ts), tz=timezone.utc)
+
+# シンボル×時間足ごとのバーをメモリ上に保持するキャッシュ
+# source には copy_rates_from_pos / copy_rates_range を持つオブジェクト（MetaTrader5 モジュール等）を渡す
+class BarCache:
+    def __init__(self, source, symbol, timeframe, initial_bars=INITIAL_BARS, max_bars=MAX_BARS,
+                 min_refresh_interval=MIN_REFRESH_INTERVAL):
+        self.source = source
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.initial_bars = initial_bars
+        self.max_bars = max_bars
+        self.min_refresh_interval = min_refresh_interval
+        self._buf = None        # 追記用に余裕を持たせた構造化配列
+        self._size = 0          # _buf のうち有効な本数
+        self._last_refresh = 0.0
+        self._history_exhausted = None  # MT5 側にこれ以上古いバーがないと分かった時刻（monotonic。None は未確認）
+        self.listeners = []  # 変更通知先（変化した最初のバーの時刻を受け取る関数）
+
+    # 有効なバーのビュー（コピーなし）
+    @property
+    def bars(self):
+        if self._buf is None:
+            return None
+        return self._buf[:self._size]
+
+    # 時刻列のビュー
+    @property
+    def times(self):
+        return self._buf["time"][:self._size]
+
+    # 最新のバーの時刻（空なら None）
+    @property
+    def last_time(self):
+        return int(self._buf["time"][self._size - 1]) if self._size else None
+
+    def __len__(self):
+        return self._size
+
+    # 最新データとの差分を取り込む
+    # 変更があった最初のバーの時刻を返す（変更なし・間引き時は None）
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if self._buf is None:
+            rates = self.source.copy_rates_from_pos(self.symbol, self.timeframe, 0, self.initial_bars)
+            if rates is None or len(rates) == 0:
+                raise RuntimeError(f"No data found for {self.symbol}")
+            self._reset(rates)
+            self._last_refresh = now
+            return int(rates["time"][0])
+
+        if not force and now - self._last_refresh < self.min_refresh_interval:
+            return None
+
+        rates = self.source.copy_rates_from_pos(self.symbol, self.timeframe, 0, REFRESH_BARS)
+        if rates is None or len(rates) == 0:
+            return None
+        self._last_refresh = now
+
+        # 取得分の先頭がキャッシュ末尾より新しい場合は抜けている区間を補完
+        last_time = int(self.times[-1])
+        if int(rates["time"][0]) > last_time:
+            gap = self.source.copy_rates_range(self.symbol, self.timeframe,
+                                               to_datetime(last_time), to_datetime(int(rates["time"][0])))
+            if gap is not None and len(gap) > 0:
+                gap = gap[gap["time"] < rates["time"][0]]
+                rates = np.concatenate([gap, rates])
+        return self._merge(rates)
+
+    # 最新から count 本を返す（キャッシュが足りなければ取り直す）
+    # max_bars を超える分はキャッシュに入らず毎回取り直すことになるので、max_bars 本までにする
+    def latest(self, count):
+        self.refresh()
+        count = min(count, self.max_bars)
+        if count > self._size and not self._history_exhausted_recently():
+            rates = self.source.copy_rates_from_pos(self.symbol, self.timeframe, 0, count)
+            if rates is not None and len(rates) > self._size:
+                self._reset(rates)
+            if rates is None or len(rates) < count:
+                self._history_exhausted = time.monotonic()
+        return self.bars[-count:] if count > 0 else self.bars[:0]
+
+    # from_time 以降の count 本を返す（二分探索）
+    # キャッシュより古い範囲は copy_rates_range で補う
+    def since(self, from_time, count):
+        self.refresh()
+        times = self.times
+        if from_time >= times[0]:
+            start = int(np.searchsorted(times, from_time, side="left"))
+            return self.bars[start:start + count]
+
+        older = self._fetch_range(from_time, int(times[0]))
+        return np.concatenate([older, self.bars[:max(0, count - len(older))]])[:count]
+
+    # [from_time, to_time] の範囲のバーを返す（二分探索）
+    def range(self, from_time, to_time):
+        self.refresh()
+        times = self.times
+        start = int(np.searchsorted(times, from_time, side="left"))
+        end = int(np.searchsorted(times, to_time, side="right"))
+        if from_time >= times[0]:
+            return self.bars[start:end]
+
+        older = self._fetch_range(from_time, min(to_time + 1, int(times[0])))
+        return np.concatenate([older, self.bars[:end]])
+
+    # [from_time, to_time] の範囲の先頭から最大 limit 本を返す（大きな範囲を分割して取り出す用）
+    # キャッシュより古い部分は、平均のバー間隔から limit 本分程度と見積もった期間ずつ取得する
+    def range_chunk(self, from_time, to_time, limit):
+        self.refresh()
+        times = self.times
+        end = int(np.searchsorted(times, to_time, side="right"))
+        if from_time >= times[0]:
+            start = int(np.searchsorted(times, from_time, side="left"))
+            return self.bars[start:min(end, start + limit)]
+
+        upper = min(to_time + 1, int(times[0]))
+        spacing = max(1, (int(times[-1]) - int(times[0])) // max(1, len(times) - 1))
+        span = spacing * limit
+        while True:
+            window_end = min(upper, from_time + span)
+            older = self._fetch_range(from_time, window_end)
+            if len(older) >= limit or window_end >= upper:
+                break
+            span *= 2  # 休場日などで足りなければ期間を広げる
+        if len(older) >= limit:
+            return older[:limit]
+        return np.concatenate([older, self.bars[:min(end, limit - len(older))]])
+
+    # 古いバーがないと分かってから HISTORY_RECHECK_INTERVAL 秒以内か
+    def _history_exhausted_recently(self):
+        return (self._history_exhausted is not None
+                and time.monotonic() - self._history_exhausted < HISTORY_RECHECK_INTERVAL)
+
+    # キャッシュ範囲外（過去）のデータを MT5 から取得
+    # キャッシュより古いバーが取れた場合は、古いバーがないという記録を消す
+    def _fetch_range(self, from_time, to_time):
+        rates = self.source.copy_rates_range(self.symbol, self.timeframe,
+                                             to_datetime(from_time), to_datetime(to_time))
+        if rates is None or len(rates) == 0:
+            return self.bars[:0]
+        rates = rates[(rates["time"] >= from_time) & (rates["time"] < to_time)]
+        if len(rates):
+            self._history_exhausted = None
+        return rates
+
+    # バッファを作り直す
+    def _reset(self, rates):
+        rates = rates[-self.max_bars:]
+        self._buf = np.empty(max(len(rates) * 2, 64), dtype=rates.dtype)
+        self._buf[:len(rates)] = rates
+        self._size = len(rates)
+        self._notify(int(rates["time"][0]))
+
+    # 変更を通知
+    def _notify(self, changed_time):
+        for listener in self.listeners:
+            listener(changed_time)
+
+    # 取得したバーをキャッシュ末尾にマージする
+    def _merge(self, rates):
+        times = self.times
+        start = int(np.searchsorted(times, rates["time"][0], side="left"))
+        overlap = self._size - start
+
+        # 既存バーと同じ内容の部分は飛ばす
+        same = 0
+        while same < min(overlap, len(rates)) and self._buf[start + same] == rates[same]:
+            same += 1
+        if same == len(rates):
+            return None
+        changed_time = int(rates["time"][same])
+
+        new_size = max(start + len(rates), self._size)
+        if new_size > len(self._buf):
+            # 末尾の追記は容量を倍に広げて償却 O(1)
+            keep = self._buf[:start]
+            self._buf = np.empty(new_size * 2, dtype=self._buf.dtype)
+            self._buf[:start] = keep
+        self._buf[start:start + len(rates)] = rates
+        self._size = new_size
+
+        # 上限を超えたら古い方を詰める
+        if self._size > self.max_bars:
+            drop = self._size - self.max_bars
+            self._buf[:self.max_bars] = self._buf[drop:self._size]
+            self._size = self.max_bars
+        self._notify(changed_time)
+        return changed_time
@@ -0,0 +1,148 @@
+import numpy as np
+from rate_codec import RATE_COLUMNS
+
+# 新しく作る系列の最初の確保本数（足りなくなると倍に広げる）
+INITIAL_CAPACITY = 512
+
+COLUMN_NAMES = tuple(name for name, _ in RATE_COLUMNS)
+
+# 受け取ったバーを {列名: 配列} にする
+# 辞書のリスト（JSON の応答）、列ごとの配列の辞書（バイナリの応答）、構造化配列、BarSeries を受け付ける
+def _to_columns(rates):
+    if isinstance(rates, BarSeries):
+        return {name: rates[name] for name in COLUMN_NAMES}
+    if isinstance(rates, dict):
+        return rates
+    if isinstance(rates, np.ndarray):
+        return {name: rates[name] for name in COLUMN_NAMES}
+    return {name: [r[name] for r in rates] for name in COLUMN_NAMES}
+
+# 1 シンボル×時間足分のバーを列ごとの numpy 配列で持つ系列（時刻順）
+# series["close"] は列の配列（コピーなし）、series[-1] は 1 本分の辞書を返す
+# 追加は確保済みの領域に書き込み、足りない場合だけ倍の大きさに広げる
+# version は内容が変わるたびに増えるので、系列から計算した値（移動平均等）のキャッシュの判定に使える
+# tail() のビューは元の系列への書き込みが見えるため、自分に書き込むまでは元の系列の version を返す
+class BarSeries:
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in RATE_COLUMNS}
+        self._len = 0
+        self._parent = None  # tail() で作ったビューなら、領域を共有している元の系列
+        self._version = 0
+
+    # バーから系列を作る
+    @classmethod
+    def from_rates(cls, rates):
+        columns = _to_columns(rates)
+        series = cls(max(len(columns["time"]), INITIAL_CAPACITY))
+        series._write(0, columns)
+        return series
+
+    def __len__(self):
+        return self._len
+
+    # 列名なら列の配列（コピーなし）、整数なら 1 本分の辞書
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._columns[key][:self._len]
+        if key < 0:
+            key += self._len
+        if not 0 <= key < self._len:
+            raise IndexError("BarSeries index out of range")
+        return {name: self._columns[name][key].item() for name in COLUMN_NAMES}
+
+    # 内容の版（ビューは元の系列と領域を共有している間、元の系列の版）
+    @property
+    def version(self):
+        if self._parent is not None:
+            return self._parent.version
+        return self._version
+
+    # 最新のバーの時刻（空なら None）
+    @property
+    def last_time(self):
+        return int(self._columns["time"][self._len - 1]) if self._len else None
+
+    # 保持している配列のバイト数
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    # 最新から count 本のビュー（元の系列と領域を共有し、書き込む時にだけコピーする）
+    def tail(self, count):
+        start = max(0, self._len - count)
+        view = BarSeries.__new__(BarSeries)
+        view._columns = {name: column[start:self._len] for name, column in self._columns.items()}
+        view._len = self._len - start
+        view._parent = self
+        view._version = 0
+        return view
+
+    # 末尾にバーを追加
+    def append(self, rates):
+        columns = _to_columns(rates)
+        if len(columns["time"]):
+            self._write(self._len, columns)
+
+    # 最新のバーを置き換える（形成中のバーの更新）
+    def replace_last(self, bar):
+        if not self._len:
+            raise IndexError("BarSeries is empty")
+        self._own()
+        for name in COLUMN_NAMES:
+            self._columns[name][self._len - 1] = bar[name]
+        self._version += 1
+
+    # バーをマージする（先頭の時刻以降を置き換える。同一時刻でも内容が更新されている可能性があるため）
+    def merge(self, rates):
+        columns = _to_columns(rates)
+        if not len(columns["time"]):
+            return
+        start = int(np.searchsorted(self["time"], columns["time"][0], side="left"))
+        self._write(start, columns)
+
+    # 最新の count 本だけを残す（新しい領域にコピーするので、tail() のビューは影響を受けない）
+    def trim(self, count):
+        if self._len <= count:
+            return
+        self._detach()
+        capacity = max(count, INITIAL_CAPACITY)
+        start = self._len - count
+        for name, column in self._columns.items():
+            kept = np.empty(capacity, dtype=column.dtype)
+            kept[:count] = column[start:self._len]
+            self._columns[name] = kept
+        self._len = count
+        self._version += 1
+
+    # position 以降を columns で置き換える
+    def _write(self, position, columns):
+        count = len(columns["time"])
+        self._own()
+        self._reserve(position + count)
+        for name in COLUMN_NAMES:
+            self._columns[name][position:position + count] = columns[name]
+        self._len = position + count
+        self._version += 1
+
+    # 共有しているビューなら自分用にコピーする
+    def _own(self):
+        if self._parent is not None:
+            self._columns = {name: column.copy() for name, column in self._columns.items()}
+            self._detach()
+
+    # 元の系列から切り離す（以降は自分の版を数える）
+    def _detach(self):
+        if self._parent is not None:
+            self._version = self._parent.version
+            self._parent = None
+
+    # size 本分の領域を確保（足りなければ倍に広げる）
+    def _reserve(self, size):
+        capacity = len(self._columns["time"])
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, INITIAL_CAPACITY)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._len] = column[:self._len]
+            self._columns[name] = grown
@@ -0,0 +1,79 @@
+import queue
+import sqlite3
+import threading
+from bar_series import BarSeries, COLUMN_NAMES as COLUMNS
+
+# 他の接続が書き込み中だった場合に待つ秒数
+BUSY_TIMEOUT = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bars (
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    open REAL, high REAL, low REAL, close REAL,
+    tick_volume INTEGER, spread INTEGER, real_volume INTEGER,
+    PRIMARY KEY (symbol, timeframe, time)
+) WITHOUT ROWID
+"""
+
+# 取得したバーをシンボル×時間足ごとにディスクに保存する SQLite のストア
+# 起動時や初めて表示するシリーズはここから読み込んで即座に表示し、サーバには最後のバー以降の差分だけを要求する
+# WAL モードなので書き込み中も読み込みは待たされない
+# 書き込みは専用スレッドでまとめて行う（save は待たない）。同じ時刻のバーは上書きする
+class BarStore:
+    def __init__(self, path):
+        self.path = path
+        self._conn = self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+        self._writes = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # 最新から count 本を BarSeries で返す（保存されていなければ空の系列）
+    def load(self, symbol, timeframe, count):
+        rows = self._conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM bars WHERE symbol = ? AND timeframe = ? ORDER BY time DESC LIMIT ?",
+            (symbol, timeframe, count)).fetchall()
+        if not rows:
+            return BarSeries()
+        return BarSeries.from_rates(dict(zip(COLUMNS, zip(*reversed(rows)))))
+
+    # バー（BarSeries）の保存を書き込みスレッドに依頼
+    # 系列は保存前に変わる可能性があるので、行はここで取り出しておく
+    def save(self, symbol, timeframe, series):
+        if len(series):
+            rows = list(zip(*(series[name].tolist() for name in COLUMNS)))
+            self._writes.put((symbol, timeframe, rows))
+
+    # 書き込みスレッド（溜まった依頼を 1 つのトランザクションでまとめて書き込む）
+    def _writer(self):
+        conn = self._connect()
+        insert = (f"INSERT OR REPLACE INTO bars (symbol, timeframe, {', '.join(COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * (len(COLUMNS) + 2))})")
+        while True:
+            batch = [self._writes.get()]
+            while not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            stop = None in batch
+            try:
+                with conn:
+                    for symbol, timeframe, rows in filter(None, batch):
+                        conn.executemany(insert, [(symbol, timeframe) + row for row in rows])
+            except sqlite3.Error as e:
+                print(f"[BarStore] write failed: {e}")
+            if stop:
+                conn.close()
+                return
+
+    # 書き込み待ちを書き終えてから閉じる
+    def close(self):
+        self._writes.put(None)
+        self._thread.join()
+        self._conn.close()
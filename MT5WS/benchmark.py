@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import websockets
+from rate_codec import decode_rates_binary
+
+# 負荷試験で使うシンボルと時間足（main.py の SYMBOL_MAP とホットキー 1〜9 に合わせる）
+SYMBOLS = ["USDJPY", "EURUSD", "EURJPY", "GBPUSD", "GBPJPY", "AUDUSD", "AUDJPY", "GOLD"]
+TIMEFRAMES = ["M1", "M5", "M15", "M30", "H1", "H4", "D1", "W1", "MN1"]
+
+# チャートの初回ロード本数（表示 250 本＋最大移動平均 200 本）
+INITIAL_COUNT = 450
+
+# 操作の比率（初回ロード後の from_time による差分取得・時間足切替・通貨ペア切替）
+OP_WEIGHTS = {"poll": 0.7, "switch_timeframe": 0.2, "switch_symbol": 0.1}
+
+# 集計するパーセンタイル
+PERCENTILES = (50, 95, 99)
+
+# 値のリストを p50/p95/p99・平均・最大にまとめる
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    arr = np.asarray(values, dtype=np.float64)
+    summary = {"count": len(arr), "mean": round(float(arr.mean()), 3), "max": round(float(arr.max()), 3)}
+    for p, v in zip(PERCENTILES, np.percentile(arr, PERCENTILES)):
+        summary[f"p{p}"] = round(float(v), 3)
+    return summary
+
+# チャートクライアントを模した仮想クライアント
+# 初回ロード → from_time による差分取得を中心に、時々時間足や通貨ペアを切り替える
+class VirtualClient:
+    def __init__(self, uri, rng, interval, binary, connect_per_request):
+        self.uri = uri
+        self.rng = rng
+        self.interval = interval
+        self.binary = binary
+        self.connect_per_request = connect_per_request
+        self.symbol = rng.choice(SYMBOLS)
+        self.timeframe = rng.choice(TIMEFRAMES[:6])
+        self.last_time = None
+        self.latencies = {}  # 操作 → レイテンシ（ミリ秒）のリスト
+        self.errors = 0
+        self.bytes_received = 0
+        self._ws = None
+
+    # 1 リクエストを送り、応答までの時間を記録
+    async def request(self, op, payload):
+        if self.binary:
+            payload["format"] = "binary"
+        started = time.perf_counter()
+        try:
+            if self.connect_per_request or self._ws is None:
+                if self._ws is not None:
+                    await self._ws.close()
+                self._ws = await websockets.connect(self.uri, max_size=None)
+            await self._ws.send(json.dumps(payload))
+            response = await self._ws.recv()
+            if self.connect_per_request:
+                await self._ws.close()
+                self._ws = None
+        except (OSError, websockets.ConnectionClosed):
+            self.errors += 1
+            self._ws = None
+            return None
+        elapsed = (time.perf_counter() - started) * 1000
+        self.bytes_received += len(response)
+        self.latencies.setdefault(op, []).append(elapsed)
+        return response
+
+    # 応答から最新バーの時刻を取り出す（次回の from_time 用）
+    def update_last_time(self, response):
+        if response is None:
+            return
+        if isinstance(response, bytes):
+            _, columns = decode_rates_binary(response)
+            if len(columns["time"]):
+                self.last_time = int(columns["time"][-1])
+            return
+        data = json.loads(response)
+        if "error" in data:
+            self.errors += 1
+        elif data.get("data"):
+            self.last_time = data["data"][-1]["time"]
+
+    # 初回ロード（時間足・通貨ペア切替時も同じ）
+    async def initial_load(self, op="initial"):
+        payload = {"symbol": self.symbol, "timeframe": self.timeframe, "count": INITIAL_COUNT}
+        self.update_last_time(await self.request(op, payload))
+
+    # 終了時刻まで操作を繰り返す
+    async def run(self, deadline):
+        await self.initial_load()
+        ops = list(OP_WEIGHTS)
+        weights = list(OP_WEIGHTS.values())
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(self.rng.expovariate(1.0 / self.interval) if self.interval > 0 else 0)
+            op = self.rng.choices(ops, weights)[0]
+            if op == "poll" and self.last_time is not None:
+                payload = {"symbol": self.symbol, "timeframe": self.timeframe, "count": 100,
+                           "from_time": self.last_time}
+                self.update_last_time(await self.request(op, payload))
+            elif op == "switch_symbol":
+                self.symbol = self.rng.choice(SYMBOLS)
+                await self.initial_load(op)
+            else:
+                self.timeframe = self.rng.choice(TIMEFRAMES)
+                await self.initial_load("switch_timeframe")
+        if self._ws is not None:
+            await self._ws.close()
+            self._ws = None
+
+# サーバ側で記録された段階ごとの処理時間を取得
+async def fetch_server_timings(uri, reset=False):
+    async with websockets.connect(uri, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "timings", "reset": reset}))
+        return json.loads(await ws.recv()).get("samples", {})
+
+# 指定ポートが接続を受け付けるまで待つ
+def wait_for_port(host, port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex((host, port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on {host}:{port}")
+
+# MT5 以外のデータソースでサーバを別プロセスとして起動
+# ログ（標準エラー）は一時ファイルに書かせる（パイプだと読まないうちに詰まり、サーバが止まるため）
+def start_server(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.join(here, "mt5_ws_server.py"),
+           "--host", "127.0.0.1", "--port", str(args.port),
+           "--provider", args.provider, "--speed", str(args.speed),
+           "--metrics-port", "0", "--log-level", "WARNING"]
+    if args.data_dir:
+        cmd += ["--data-dir", args.data_dir]
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, cwd=here, stdout=subprocess.DEVNULL, stderr=log)
+    proc.log = log
+    try:
+        wait_for_port("127.0.0.1", args.port, args.startup_timeout)
+    except RuntimeError:
+        proc.kill()
+        proc.wait()
+        log.seek(0)
+        message = log.read().decode(errors="replace")
+        log.close()
+        raise RuntimeError(message)
+    return proc
+
+# 実行中のコミットを取得（結果の比較用。git がなければ None）
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# 負荷試験の実行
+async def run_benchmark(args, uri):
+    rng = random.Random(args.seed)
+    clients = [VirtualClient(uri, random.Random(rng.random()), args.interval, args.binary,
+                             args.connect_per_request) for _ in range(args.clients)]
+
+    # ウォームアップ（キャッシュの初回ロードを計測から外す）
+    if args.warmup:
+        warmup_deadline = time.perf_counter() + args.warmup
+        await asyncio.gather(*(c.run(warmup_deadline) for c in clients))
+        for c in clients:
+            c.latencies.clear()
+            c.errors = 0
+            c.bytes_received = 0
+    await fetch_server_timings(uri, reset=True)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(c.run(started + args.duration) for c in clients))
+    elapsed = time.perf_counter() - started
+    server_samples = await fetch_server_timings(uri)
+
+    by_op = {}
+    for c in clients:
+        for op, values in c.latencies.items():
+            by_op.setdefault(op, []).extend(values)
+    all_latencies = [v for values in by_op.values() for v in values]
+
+    return {
+        "commit": current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": vars(args),
+        "duration_s": round(elapsed, 3),
+        "requests": len(all_latencies),
+        "errors": sum(c.errors for c in clients),
+        "throughput_rps": round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+        "bytes_received": sum(c.bytes_received for c in clients),
+        "latency_ms": {
+            "total": summarize(all_latencies),
+            **{stage: summarize(server_samples.get(stage, [])) for stage in ("parse", "queue", "fetch", "serialize", "send")},
+        },
+        "by_op": {op: summarize(values) for op, values in by_op.items()},
+    }
+
+# コマンドライン引数の解析
+def parse_args():
+    p = argparse.ArgumentParser(description="mt5_ws_server の負荷試験・レイテンシ計測")
+    p.add_argument("--clients", type=int, default=20, help="同時接続クライアント数")
+    p.add_argument("--duration", type=float, default=30.0, help="計測時間（秒）")
+    p.add_argument("--warmup", type=float, default=3.0, help="計測前のウォームアップ時間（秒）")
+    p.add_argument("--interval", type=float, default=0.5, help="クライアントごとの平均操作間隔（秒）")
+    p.add_argument("--binary", action="store_true", help="バイナリ形式で受信する")
+    p.add_argument("--connect-per-request", action="store_true",
+                   help="リクエストごとに接続し直す（現在の MT5WebSocketClient と同じ動作）")
+    p.add_argument("--uri", help="起動済みのサーバに接続する場合の URI（省略時はサーバを起動）")
+    p.add_argument("--port", type=int, default=8876, help="起動するサーバのポート")
+    p.add_argument("--provider", choices=["synthetic", "replay"], default="synthetic")
+    p.add_argument("--data-dir", help="replay で使う CSV のフォルダ")
+    p.add_argument("--speed", type=float, default=60.0, help="データソースの再生速度")
+    p.add_argument("--startup-timeout", type=float, default=30.0)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--output", help="結果の JSON を書き出すファイル")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    proc = None
+    uri = args.uri
+    if uri is None:
+        proc = start_server(args)
+        uri = f"ws://127.0.0.1:{args.port}"
+    try:
+        result = asyncio.run(run_benchmark(args, uri))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+            proc.log.close()
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,22 @@
 import tkinter as tk
 from datetime import datetime, timezone
-import asyncio
 import json
 import os
-from config import moving_average_periods, moving_average_colors, auto_update_interval
+import numpy as np
+from config import live_update_poll_ms
 from utils import get_cropped_screenshot_from_image, take_full_screenshot
+from viewport import Viewport
+from item_pool import ItemPool, POOL_TAG
+from indicators import IndicatorSet
 
 class CandleChart(tk.Canvas):
     LINE_DATA_PATH = "line_data.json" # ラインデータの保存パス
+    SUB_PANE_HEIGHT = 60 # 指標の下の枠 1 つ分の高さ
 
     def __init__(self, master, rates, info_labels, symbol_short, timeframe,
                  chart_x, chart_y, chart_width, chart_height, candle_display_count=250,
-                 format_func=None, update_func=None, symbol_entry=None, **kwargs):
+                 format_func=None, update_func=None, symbol_entry=None, live_update_queue=None,
+                 indicator_set=None, **kwargs):
         super().__init__(master, **kwargs)
         self.master = master
         self.chart_x = chart_x
@@ -19,6 +24,8 @@ class CandleChart(tk.Canvas):
         self.chart_width = chart_width
         self.chart_height = chart_height
         self.rates = rates
+        self._viewport = None      # 座標変換（データか大きさが変わった時に作り直す）
+        self._viewport_key = None
         self.info_labels = info_labels
         self.symbol_short = symbol_short
         self.timeframe = timeframe
@@ -28,15 +35,22 @@ class CandleChart(tk.Canvas):
         self.bg_image = None
         self.dashed_line_id = None
         self.chart_visible = True  # チャートの表示状態
-        self.ma_visible = False    # 移動平均線の表示状態
-        self.ma_lines = []         # 移動平均線の描画ID保持
         self.line_data_cache = {} # 水平線の情報のキャッシュ
         self.diagonal_styles = {} # 斜め線の情報のキャッシュ
         self.format_func = format_func or (lambda v: f"{v:.3f}")
         self.candle_display_count = candle_display_count
         self.divider_visible = False  # 区切り線の表示状態
         self.divider_lines = []       # 区切り線ID保持
-        self.update_func = update_func  # 自動更新関数
+        self.candle_items = []        # 表示中のロウソク足ごとの (上ヒゲ, 下ヒゲ, 実体) の ID（古い順）
+        self.items_created = 0        # 作成したキャンバスのアイテムの累計
+        self.last_update_items = 0    # 直近の購読の更新で作成したアイテムの数
+        self.candle_pool = ItemPool(self, "rectangle", "candle")  # レイヤーごとの使い回すアイテム
+        self.divider_pool = ItemPool(self, "line", "divider")
+        self.hline_pool = ItemPool(self, "line", "hline")
+        self.diagonal_pool = ItemPool(self, "line", "diagonal")
+        self.handle_pool = ItemPool(self, "rectangle", "handle")
+        self.update_func = update_func  # 自動更新関数（購読で届いた更新を反映する）
+        self.live_update_queue = live_update_queue  # 購読スレッドから届いた更新のキュー
 
         # フラグ
         self.hline_editing = False  # ラインの編集中フラグ
@@ -58,32 +72,31 @@ class CandleChart(tk.Canvas):
         self.diagonal_line_ids = []
         self.diagonal_data = []  # (symbol, t1, price1, t2, price2)
 
-        # 移動平均線関連
-        self.ma_periods = moving_average_periods
-        self.ma_colors = moving_average_colors
+        # 指標関連（価格のチャートに重ねるもの（移動平均線を含む）と、下の枠に描くもの）
+        self.indicator_set = indicator_set or IndicatorSet()
+        self.indicator_visible = False  # 起動時は非表示（移動平均線だけだった頃と同じ）
+        self.indicator_pool = ItemPool(self, "line", "indicator")
 
         # マウス操作をバインド
         self.bind("<Motion>", self.on_mouse_move)
         self.bind("<Button-1>", self.on_left_click)
         self.bind("<Button-3>", self.on_right_click)
+        self.bind("<Configure>", lambda event: self.invalidate_viewport())
         self.symbol_entry = symbol_entry
 
-        # 背景画像の初期描画とロウソク足描画
+        # 背景画像の初期描画とロウソク足描画（update_background_image の中でロウソク足も描く）
         self.update_background_image()
-        self.draw_candles()
 
-        # 自動更新の設定（ミリ秒単位）
-        self.auto_update_interval = auto_update_interval * 1000  # 自動更新間隔（ミリ秒）
+        # 購読で届いた更新の反映間隔（ミリ秒単位）
+        self.auto_update_interval = live_update_poll_ms
         if self.auto_update_interval > 0:
             self.schedule_auto_update()
     
-    # 移動平均線の設定
-    def set_moving_average_config(self, periods, colors):
-        self.ma_periods = periods
-        self.ma_colors = colors
-        if self.ma_visible:
-            self.toggle_moving_averages()  # 一旦消して
-            self.toggle_moving_averages()  # 再描画
+    # 指標の設定（{"type": "RSI", "period": 14, "color": "purple"} 等のリスト）
+    def set_indicators(self, specs):
+        self.indicator_set.replace(specs)  # 設定が変わらなかった指標は計算し直さない
+        self.invalidate_viewport()  # 下の枠の数が変わると価格の範囲の高さも変わる
+        self.redraw_chart_items()
 
     # 水平線描画モード切替用メソッド
     def toggle_horizontal_line_mode(self):
@@ -120,22 +133,19 @@ class CandleChart(tk.Canvas):
             if self.diagonal_start is None:
                 price1 = self.y_to_price(event.y)
                 index = self.get_index_from_x(event.x)
-                t1 = self.rates[index]['time']
+                t1 = int(self.rates["time"][index])
                 self.diagonal_start = (t1, price1)
             else:
                 t1, price1 = self.diagonal_start
                 price2 = self.y_to_price(event.y)
                 index = self.get_index_from_x(event.x)
-                t2 = self.rates[index]['time']
+                t2 = int(self.rates["time"][index])
                 x1 = self.get_x_from_time(t1)
                 x2 = self.get_x_from_time(t2)
-                y1 = self.price_to_y(price1)
-                y2 = self.price_to_y(price2)
                 if x1 is not None and x2 is not None:
-                    line_id = self.create_line(x1, y1, x2, y2, fill='black')
-                    self.diagonal_line_ids.append(line_id)
                     symbol = self.symbol_short
                     self.diagonal_data.append((symbol, t1, price1, t2, price2))
+                    self.redraw_diagonal_lines() # 斜め線を描画
                     self.diagonal_mode = False
                 if self.temp_diagonal_id:
                     self.delete(self.temp_diagonal_id)
@@ -147,9 +157,8 @@ class CandleChart(tk.Canvas):
             if symbol not in self.hline_data:
                 self.hline_data[symbol] = []
             self.hline_data[symbol].append(price)
-            line_id = self.create_line(0, y, self.chart_width, y, fill='black', width=1) # 水平線を作成
-            self.hline_ids.append(line_id) # 水平線リストに追加
-            self.hline_styles[(symbol, len(self.hline_ids) - 1)] = {"color": "black", "width": 1} # 属性をリストにキャッシュ
+            self.hline_styles[(symbol, len(self.hline_data[symbol]) - 1)] = {"color": "black", "width": 1} # 属性をリストにキャッシュ
+            self.redraw_horizontal_lines() # 水平線を描画
             self.hline_mode = False
             self.hide_temp_hline()
             self.update_line_data_cache(self.symbol_short) # キャッシュにライン情報を保存
@@ -306,46 +315,56 @@ class CandleChart(tk.Canvas):
         size = 10
         half = size // 2
         positions = [0, self.chart_width // 2, self.chart_width]
+        self.handle_pool.begin()
         for x in positions:
-            handle = self.create_rectangle(x - half, y - half, x + half, y + half, outline="black", width=1)
-            self.hline_handle_ids.append(handle)
+            self.handle_pool.take(x - half, y - half, x + half, y + half, outline="black", width=1)
+        self.handle_pool.finish()
+        self.hline_handle_ids = self.handle_pool.active
     
     # 水平線のハンドルを削除する関数
     def hide_hline_handles(self):
-        for hid in self.hline_handle_ids:
-            self.delete(hid)
-        self.hline_handle_ids.clear()
+        self.handle_pool.hide()
+        self.hline_handle_ids = []
         self.selected_hline_index = None
     
     # 斜め線のハンドルを描画する関数
     def show_diagonal_handles(self, x1, y1, x2, y2):
         size = 10
         half = size // 2
+        self.handle_pool.begin()
         for x, y in [(x1, y1), (x2, y2), ((x1 + x2) // 2, (y1 + y2) // 2)]:
-            handle = self.create_rectangle(x - half, y - half, x + half, y + half, outline="black", width=1)
-            self.hline_handle_ids.append(handle)  # 使い回す
+            self.handle_pool.take(x - half, y - half, x + half, y + half, outline="black", width=1)
+        self.handle_pool.finish()
+        self.hline_handle_ids = self.handle_pool.active  # 使い回す
 
     # 斜め線のハンドルを削除する関数
     def hide_diagonal_handles(self):
-        for hid in self.hline_handle_ids:
-            self.delete(hid)
-        self.hline_handle_ids.clear()
+        self.handle_pool.hide()
+        self.hline_handle_ids = []
 
     # 指定間隔で auto_update をスケジュール実行
     def schedule_auto_update(self):
         self.after(self.auto_update_interval, self.auto_update)
 
-    # update_func が指定されていれば定期的に呼び出して更新
+    # 購読キューに届いた更新を update_func に渡して反映（サーバ側で変化があった時だけ届く）
     def auto_update(self):
-        # 編集ダイアログ or 通貨入力エリア表示中はスキップ
+        # 編集ダイアログ or 通貨入力エリア表示中はスキップ（更新はキューに残す）
         if (hasattr(self, 'symbol_entry') and self.symbol_entry and self.symbol_entry.winfo_ismapped()) or self.hline_editing or self.settings_editing:
             self.schedule_auto_update()
             return
 
         # update_funcが渡されてれば更新が行われる。
-        if self.update_func:
-            # main.pyで渡しているので設定した時間で更新されるようになっている。
-            asyncio.run(self.update_func(self.timeframe))
+        # ティック（時間足 "TICK"）はシンボルごとに最新の 1 件だけをバーの更新の後に反映する
+        if self.update_func and self.live_update_queue is not None:
+            ticks = {}
+            while not self.live_update_queue.empty():
+                symbol, timeframe, data = self.live_update_queue.get_nowait()
+                if timeframe == "TICK":
+                    ticks[symbol] = data
+                else:
+                    self.update_func(symbol, timeframe, data)
+            for symbol, tick in ticks.items():
+                self.update_func(symbol, "TICK", tick)
         self.schedule_auto_update()
     
     # 区切り縦線の表示を切り替える
@@ -354,23 +373,20 @@ class CandleChart(tk.Canvas):
         if self.divider_visible:
             self.draw_time_dividers()
         else:
-            for line_id in self.divider_lines:
-                self.delete(line_id)
-            self.divider_lines.clear()
+            self.divider_pool.hide()
+            self.divider_lines = []
     
     # 区切り縦線の描画
     def draw_time_dividers(self):
-        self.divider_lines.clear()
-        self.delete("divider")
+        self.divider_pool.begin()
 
-        width = int(self['width'])
-        height = int(self['height'])
-        display_rates = self.rates[-self.candle_display_count:]
-        space_per_candle = self.candle_width + self.candle_gap
+        vp = self.viewport
+        times = vp.times.tolist()
+        xs = (vp.index_to_x(np.arange(vp.total - vp.count, vp.total)) + self.candle_width // 2).tolist()
 
         prev_key = None
-        for i, r in enumerate(display_rates):
-            dt = datetime.fromtimestamp(r["time"], tz=timezone.utc)
+        for i, t in enumerate(times):
+            dt = datetime.fromtimestamp(t, tz=timezone.utc)
             key = None
             tf = self.timeframe.upper()
             if tf in ["M1", "M5", "M15", "M30", "H1"]:
@@ -385,10 +401,11 @@ class CandleChart(tk.Canvas):
                 continue  # 表示しない
 
             if key != prev_key and prev_key is not None:
-                x = width - (len(display_rates) - i) * space_per_candle + self.candle_width // 2
-                line_id = self.create_line(x, 0, x, height, fill='black', dash=(3, 2), tags="divider")
-                self.divider_lines.append(line_id)
+                x = xs[i]
+                self.divider_pool.take(x, 0, x, vp.height, fill='black', dash=(3, 2))
             prev_key = key
+        self.divider_pool.finish()
+        self.divider_lines = self.divider_pool.active
 
     # 背景画像を取得・表示
     def update_background_image(self, full_screenshot=None):
@@ -407,45 +424,112 @@ class CandleChart(tk.Canvas):
         )
         self.master.deiconify() # 非表示を解除
 
-        # 既存のすべてをクリアしてから背景＋再描画
-        self.delete("all")  # キャンバス上の全アイテムを削除
-        self.bg_image_id = self.create_image(0, 0, anchor='nw', image=self.bg_image)
+        # 使い回すアイテム以外をクリアしてから背景＋再描画（背景の画像のアイテムも使い回す）
+        self.delete(f"!{POOL_TAG} && !background")
+        if self.bg_image_id is None:
+            self.bg_image_id = self.create_image(0, 0, anchor='nw', image=self.bg_image, tags="background")
+        else:
+            self.itemconfigure(self.bg_image_id, image=self.bg_image)
+        self.tag_lower(self.bg_image_id)
         
         # 選択状態の保持のため水平線も含めて再描画
         self.redraw_only_candles()
         self.redraw_horizontal_lines()
         self.redraw_diagonal_lines()
 
+    # キャンバスのアイテムの作成（create_* はすべてここを通るので、作成数を数える）
+    def _create(self, *args):
+        self.items_created += 1
+        return super()._create(*args)
+
     # ロウソク足を描画
     def draw_candles(self):
-        if not self.chart_visible:  # チャート非表示なら描画しない
-            return
-        width = int(self['width'])
-        space_per_candle = self.candle_width + self.candle_gap
-        display_rates = self.rates[-self.candle_display_count:]
-
-        for i, r in enumerate(display_rates):
-            x = width - (len(display_rates) - i) * space_per_candle
-            open_y = self.price_to_y(r['open'])
-            close_y = self.price_to_y(r['close'])
-            high_y = self.price_to_y(r['high'])
-            low_y = self.price_to_y(r['low'])
-            body_top = min(open_y, close_y)
-            body_bottom = max(open_y, close_y)
-
-            # 上ヒゲ
-            self.create_rectangle(x, high_y, x + self.candle_width, body_top, fill='red', width=0, tags="candle")
-            # 下ヒゲ
-            self.create_rectangle(x, body_bottom, x + self.candle_width, low_y, fill='red', width=0, tags="candle")
-            # 実体
-            self.create_rectangle(x, body_top, x + self.candle_width, body_bottom, fill='green', width=0, tags="candle")
+        pool = self.candle_pool
+        pool.begin()
+        if self.chart_visible:  # チャート非表示なら描画しない
+            for x, high_y, low_y, body_top, body_bottom in self._candle_geometry(0, self.viewport.count):
+                # 上ヒゲ
+                pool.take(x, high_y, x + self.candle_width, body_top, fill='red', width=0)
+                # 下ヒゲ
+                pool.take(x, body_bottom, x + self.candle_width, low_y, fill='red', width=0)
+                # 実体
+                pool.take(x, body_top, x + self.candle_width, body_bottom, fill='green', width=0)
+        pool.finish()
+        items = pool.active
+        self.candle_items = list(zip(items[0::3], items[1::3], items[2::3]))
+
+    # 表示中の start～stop 番目（古い順）のロウソク足の (x, 高値の y, 安値の y, 実体の上端, 実体の下端)
+    def _candle_geometry(self, start, stop):
+        vp = self.viewport
+        display_rates = self.rates.tail(self.candle_display_count)
+        first = vp.total - vp.count
+
+        # 座標をまとめて計算
+        xs = vp.index_to_x(np.arange(first + start, first + stop)).tolist()
+        open_ys = vp.price_to_y(display_rates["open"][start:stop])
+        close_ys = vp.price_to_y(display_rates["close"][start:stop])
+        high_ys = vp.price_to_y(display_rates["high"][start:stop]).tolist()
+        low_ys = vp.price_to_y(display_rates["low"][start:stop]).tolist()
+        body_tops = np.minimum(open_ys, close_ys).tolist()
+        body_bottoms = np.maximum(open_ys, close_ys).tolist()
+        return zip(xs, high_ys, low_ys, body_tops, body_bottoms)
 
     # ロウソク足だけを再描画
     def redraw_only_candles(self):
-        self.delete("candle")
         self.draw_candles()
-        if self.ma_visible:
-            self.draw_moving_averages(moving_average_periods)
+        self.draw_indicators()
+
+    # 購読の更新（形成中のバーの変化・新しいバー）をチャートに反映する
+    # 価格の範囲が変わらなければ、変わったロウソク足のアイテムだけを coords() で動かす
+    # 新しいバーが増えた場合は全体を move() で左にずらし、左端から外れたロウソク足のアイテムを新しいバーに使う
+    # 価格の範囲が変わった場合だけ全体を描き直す（背景のスクリーンショットは取り直さない）
+    def update_live_rates(self, new_rates):
+        created = self.items_created
+        old_vp = self._viewport
+        old_last_time = self.rates.last_time
+        self.rates = new_rates
+        self.indicator_set.update(new_rates)  # 指標は前回の最新のバー以降だけを計算
+        vp = self.viewport
+
+        if (old_vp is None or old_last_time is None or not self.chart_visible or vp.bounds != old_vp.bounds
+                or vp.count != old_vp.count or len(self.candle_items) != vp.count):
+            self.redraw_chart_items()
+        else:
+            # 新しく増えたバーの数（前回の最新のバーより後のもの）
+            shift = vp.count - int(np.searchsorted(vp.times, old_last_time, side="right"))
+            if shift >= vp.count:
+                self.redraw_chart_items()
+            else:
+                if shift:
+                    self.move("candle", -shift * vp.space, 0)
+                    self.candle_pool.rotate(3 * shift)
+                    self.candle_items = self.candle_items[shift:] + self.candle_items[:shift]
+                # 前回の最新のバー（形成中だったもの）以降を置き直す
+                start = vp.count - shift - 1
+                for items, geometry in zip(self.candle_items[start:], self._candle_geometry(start, vp.count)):
+                    self._place_candle(items, *geometry)
+                self.draw_indicators()
+                if shift:
+                    self.redraw_diagonal_lines()
+                    if self.divider_visible:
+                        self.draw_time_dividers()
+        self.last_update_items = self.items_created - created
+
+    # ロウソク足のアイテム (上ヒゲ, 下ヒゲ, 実体) を置き直す
+    def _place_candle(self, items, x, high_y, low_y, body_top, body_bottom):
+        upper, lower, body = items
+        right = x + self.candle_width
+        self.coords(upper, x, high_y, right, body_top)
+        self.coords(lower, x, body_bottom, right, low_y)
+        self.coords(body, x, body_top, right, body_bottom)
+
+    # 背景以外（ロウソク足・指標・水平線・斜め線・区切り線）を描き直す
+    def redraw_chart_items(self):
+        self.redraw_only_candles()
+        self.redraw_horizontal_lines()
+        self.redraw_diagonal_lines()
+        if self.divider_visible:
+            self.draw_time_dividers()
     
     # 水平線の再描画
     def redraw_horizontal_lines(self):
@@ -459,37 +543,29 @@ class CandleChart(tk.Canvas):
             if 0 <= self.selected_hline_index < len(prices):
                 selected_price = prices[self.selected_hline_index]
 
-        # ハンドルのみ削除（選択インデックスは維持）
-        for hid in self.hline_handle_ids:
-            self.delete(hid)
-        self.hline_handle_ids.clear()
-
-        # 既存水平線の削除
-        for line_id in self.hline_ids:
-            self.delete(line_id)
-        self.hline_ids.clear()
-
-        if not prices:
-            self.selected_hline_index = None
-            return
+        # ハンドルのみ隠す（選択インデックスは維持）
+        self.handle_pool.hide()
+        self.hline_handle_ids = []
 
-        # 水平線の再描画＋ハンドル復元
+        # 水平線の再描画＋ハンドル復元（既存の水平線のアイテムを置き直し、余りは隠す）
+        self.hline_pool.begin()
         for i, price in enumerate(prices):
             y = self.price_to_y(price)
             style = self.hline_styles.get((symbol, i), {"color": "black", "width": 1})
-            line_id = self.create_line(0, y, self.chart_width, y, fill=style["color"], width=style["width"])
-            # line_id = self.create_line(0, y, self.chart_width, y, fill='black')
-            self.hline_ids.append(line_id)
+            self.hline_pool.take(0, y, self.chart_width, y, fill=style["color"], width=style["width"])
 
             if selected_price is not None and abs(price - selected_price) < 1e-8:
                 self.selected_hline_index = i
                 self.show_hline_handles(y)
+        self.hline_pool.finish()
+        self.hline_ids = self.hline_pool.active
+
+        if not prices:
+            self.selected_hline_index = None
 
     # 斜め線の再描画（通貨ペア変更や更新時）
     def redraw_diagonal_lines(self):
-        for line_id in self.diagonal_line_ids:
-            self.delete(line_id)
-        self.diagonal_line_ids.clear()
+        self.diagonal_pool.begin()
 
         symbol = self.symbol_short
         for i, (s, t1, price1, t2, price2) in enumerate(self.diagonal_data):
@@ -501,49 +577,73 @@ class CandleChart(tk.Canvas):
             y2 = self.price_to_y(price2)
             if x1 is not None and x2 is not None:
                 style = self.diagonal_styles.get((symbol, i), {"color": "black", "width": 1})
-                line_id = self.create_line(x1, y1, x2, y2, fill=style["color"], width=style["width"])
-                self.diagonal_line_ids.append(line_id)
+                self.diagonal_pool.take(x1, y1, x2, y2, fill=style["color"], width=style["width"])
+        self.diagonal_pool.finish()
+        self.diagonal_line_ids = self.diagonal_pool.active
+
+    # 指標の表示・非表示を切り替える（下の枠の分だけ価格の範囲の高さが変わるので全体を描き直す）
+    def toggle_indicators(self):
+        self.indicator_visible = not self.indicator_visible
+        self.invalidate_viewport()
+        self.redraw_chart_items()
+
+    # 表示中の下の枠に描く指標
+    def sub_pane_indicators(self):
+        return self.indicator_set.sub_pane() if self.indicator_visible else []
+
+    # 指標を描画（価格のチャートに重ねる線と、下の枠ごとの区切り線・水準線・線）
+    def draw_indicators(self):
+        pool = self.indicator_pool
+        pool.begin()
+        if self.indicator_visible and len(self.indicator_set):
+            vp = self.viewport
+            xs = vp.index_to_x(np.arange(len(self.rates))) + self.candle_width // 2
+            width = int(self['width'])
+            pane_top = vp.height
+            first = max(0, vp.total - vp.count - 1)  # 左端の 1 本前から（表示範囲外は描かない）
+            for indicator in self.indicator_set:
+                result = self.indicator_set.get(self.rates, indicator)
+                lines = [result[name] for name in indicator.outputs]
+                if indicator.pane == "main":
+                    for values in lines:
+                        self._take_indicator_line(xs, values, vp.price_to_y, indicator.color, first)
+                    continue
+
+                # 下の枠（上端に区切り線。縦軸は value_range か表示中の値の範囲）
+                top, bottom = pane_top + 2, pane_top + self.SUB_PANE_HEIGHT - 2
+                pool.take(0, pane_top, width, pane_top, fill='gray', width=1, dash=())
+                pane_top += self.SUB_PANE_HEIGHT
+                if indicator.value_range is not None:
+                    low, high = indicator.value_range
+                else:
+                    visible = np.concatenate([values[-vp.count:] for values in lines])
+                    visible = visible[np.isfinite(visible)]
+                    if not len(visible):
+                        continue
+                    low, high = float(visible.min()), float(visible.max())
+                scale = (bottom - top) / ((high - low) or 1)
+                to_y = lambda values, low=low, scale=scale, bottom=bottom: bottom - (values - low) * scale
+                for level in indicator.levels:
+                    y = to_y(level)
+                    pool.take(0, y, width, y, fill='gray', width=1, dash=(2, 2))
+                for values in lines:
+                    self._take_indicator_line(xs, values, to_y, indicator.color, first)
+        pool.finish()
+
+    # 指標の 1 本の線を first 番目以降の折れ線として置く（計算できていない先頭の NaN は除く）
+    def _take_indicator_line(self, xs, values, to_y, color, first):
+        valid = np.flatnonzero(np.isfinite(values[first:]))
+        if len(valid) < 2:
+            return
+        start = first + valid[0]
+        points = np.column_stack((xs[start:], to_y(values[start:]))).ravel().tolist()
+        self.indicator_pool.take(*points, fill=color, width=1, dash=())
 
     # チャートの表示・非表示を切り替える
     def toggle_chart_visibility(self):
         self.chart_visible = not self.chart_visible
         self.redraw_only_candles()
     
-    # 移動平均線の表示・非表示を切り替える
-    def toggle_moving_averages(self):
-        self.ma_visible = not self.ma_visible
-        for line_id in self.ma_lines:
-            self.delete(line_id)
-        self.ma_lines.clear()
-        if self.ma_visible:
-            self.draw_moving_averages(moving_average_periods)
-
-    # 移動平均線を描画
-    def draw_moving_averages(self, periods):
-        import statistics
-        width = int(self['width'])
-        space_per_candle = self.candle_width + self.candle_gap
-        closes = [r['close'] for r in self.rates]
-        periods = periods or self.ma_periods
-
-        # periodごとの移動平均を計算
-        for idx, period in enumerate(self.ma_periods):
-            if len(closes) < period:
-                continue
-            ma_points = []
-            # 移動平均を計算
-            for i in range(period - 1, len(closes)):
-                avg = statistics.mean(closes[i - period + 1:i + 1])
-                x = width - (len(closes) - i) * space_per_candle
-                y = self.price_to_y(avg)
-                ma_points.append((x, y))
-            # 座標に変換
-            for i in range(1, len(ma_points)):
-                x1, y1 = ma_points[i - 1]
-                x2, y2 = ma_points[i]
-                line_id = self.create_line(x1, y1, x2, y2, fill=self.ma_colors[idx], width=1, tags='ma')
-                self.ma_lines.append(line_id)
-
     # マウス移動に応じて情報ラベルを更新
     def on_mouse_move(self, event):
         # 水平線モード中は破線を表示
@@ -566,10 +666,7 @@ class CandleChart(tk.Canvas):
             return
 
         # 通常モードでは情報ラベルを更新
-        x = event.x
-        width = int(self['width'])
-        space_per_candle = self.candle_width + self.candle_gap
-        index = len(self.rates) - (width - x) // space_per_candle - 1
+        index = self.viewport.x_to_index(event.x)
 
         if 0 <= index < len(self.rates):
             r = self.rates[index]
@@ -587,48 +684,48 @@ class CandleChart(tk.Canvas):
             for i, val in enumerate(updated_values):
                 self.info_labels[i].config(text=val)
     
+    # 座標変換（データ・表示本数が変わった時か、invalidate_viewport の後にだけ作り直す）
+    @property
+    def viewport(self):
+        key = (id(self.rates), self.rates.version, len(self.rates), self.candle_display_count)
+        if self._viewport is None or key != self._viewport_key:
+            # 価格の範囲の高さは、指標の下の枠の分を除いたもの
+            height = int(self['height']) - self.SUB_PANE_HEIGHT * len(self.sub_pane_indicators())
+            self._viewport = Viewport(self.rates, int(self['width']), height,
+                                      self.candle_display_count, self.candle_width, self.candle_gap)
+            self._viewport_key = key
+        return self._viewport
+
+    # 座標変換を作り直させる（キャンバスの大きさの変更時など）
+    def invalidate_viewport(self):
+        self._viewport = None
+
     # x座標からIndexを取得する
     def get_index_from_x(self, x):
-        space = self.candle_width + self.candle_gap
-        width = int(self['width'])
-        index = len(self.rates) - (width - x) // space - 1
+        index = self.viewport.x_to_index(x)
         return max(0, min(len(self.rates) - 1, index))
 
     # timeからx座標を取得する
     def get_x_from_time(self, t):
-        space = self.candle_width + self.candle_gap
-        times = [r['time'] for r in self.rates[-self.candle_display_count:]]
-        if not times:
-            return None
-        closest_index = min(range(len(times)), key=lambda i: abs(times[i] - t))
-        i = closest_index
-        return int(self['width']) - (len(times) - i) * space + self.candle_width // 2
+        return self.viewport.time_to_x(t)
 
     # Y座標を価格に変換
     def y_to_price(self, y):
-        height = int(self['height'])
-        min_price, _, price_range = self.get_price_bounds()
-        return min_price + (height - y) / height * price_range
+        return self.viewport.y_to_price(y)
     
-    # 価格からy座標に変換    
+    # 価格からy座標に変換（numpy の配列もまとめて変換できる）
     def price_to_y(self, price):
-        height = int(self['height'])
-        min_price, _, price_range = self.get_price_bounds() 
-        return height - int((price - min_price) / price_range * height)
+        return self.viewport.price_to_y(price)
 
     # チャートの最大値と最小値、レンジを取得する関数
     def get_price_bounds(self):
-        display_rates = self.rates[-self.candle_display_count:]
-        highs = [r['high'] for r in display_rates]
-        lows = [r['low'] for r in display_rates]
-        min_price = min(lows)
-        max_price = max(highs)
-        return min_price, max_price, max_price - min_price or 1
+        return self.viewport.bounds
 
     # 新しいレートデータで更新
     def update_rates(self, new_rates, new_timeframe):
         self.rates = new_rates
         self.timeframe = new_timeframe
+        self.invalidate_viewport()
         self.refresh_chart(update_timeframe=True)
 
     # ダッシュライン表示
@@ -648,20 +745,8 @@ class CandleChart(tk.Canvas):
         # 背景更新
         self.update_background_image()
 
-        # 移動平均線の削除
-        for line_id in self.ma_lines:
-            self.delete(line_id)
-        self.ma_lines.clear()
-
-        # 移動平均線の再描画
-        if self.ma_visible:
-            self.draw_moving_averages(moving_average_periods)
-
         # 区切り線の再描画（timeframe更新時のみ）
         if update_timeframe and self.divider_visible:
-            for line_id in self.divider_lines:
-                self.delete(line_id)
-            self.divider_lines.clear()
             self.draw_time_dividers()
 
         # 水平線・斜め線を再描画
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+import websockets
+
+logger = logging.getLogger("mt5_ws_server.session")
+
+# 要求への応答の送信待ちの上限（超えると受信側の処理が待たされ、それ以上読み込まない）
+SEND_QUEUE_LIMIT = 64
+
+# 接続ごとの送信を受け持つクラス
+# 送信は専用タスクが 1 件ずつ行うため、遅いクライアントがいても他のクライアントへの配信は止まらない
+# 要求への応答は上限付きのキュー、購読の配信（バーの更新・ティック）はキーごとに最新の 1 件だけを保持する
+# 送信が追いつかない間に届いた配信は上書き（まとめ）されるので、クライアントが遅くてもメモリは増えない
+class ClientSession:
+    def __init__(self, websocket, metrics=None, queue_limit=SEND_QUEUE_LIMIT):
+        self.websocket = websocket
+        self.metrics = metrics
+        self._replies = asyncio.Queue(maxsize=queue_limit)
+        self._latest = {}  # キー → (メッセージ, エンコード済み, エンコード関数)
+        self._wake = asyncio.Event()
+        self.pushed = 0     # 配信の件数
+        self.conflated = 0  # 上書きでまとめられた配信の件数
+        self.closed = False
+        self._task = asyncio.create_task(self._sender())
+
+    # 要求への応答を送信待ちに入れる（キューが一杯なら空くまで待つ）
+    # wait=True なら実際に送信し終える（または接続が閉じる）まで待つ
+    async def send(self, response, symbol="", timeframe="", wait=False):
+        if self.closed:
+            return
+        sent = asyncio.get_running_loop().create_future() if wait else None
+        await self._replies.put((response, symbol, timeframe, sent))
+        self._wake.set()
+        if sent is not None and not self.closed:
+            await sent
+
+    # 購読の配信を送信待ちに入れる（待たない）
+    # 同じキーの未送信の配信があれば置き換える。merge を渡すと (未送信, 新規) をまとめたメッセージにする
+    # encoded はエンコード済みの内容（同じ形式の購読者で共有する）。まとめた場合は送信時に encode で作り直す
+    def push(self, key, message, encoded, encode, merge=None):
+        if self.closed:
+            return
+        pending = self._latest.get(key)
+        if pending is not None:
+            self.conflated += 1
+            if merge is not None:
+                message = merge(pending[0], message)
+                encoded = None
+        self._latest[key] = (message, encoded, encode)
+        self.pushed += 1
+        self._wake.set()
+
+    # 送信待ちの件数
+    def backlog(self):
+        return self._replies.qsize() + len(self._latest)
+
+    # 送信タスク（応答を優先し、その後に配信をキーの順に送る）
+    async def _sender(self):
+        try:
+            while True:
+                await self._wake.wait()
+                self._wake.clear()
+                while not self._replies.empty() or self._latest:
+                    sent = None
+                    if not self._replies.empty():
+                        response, symbol, timeframe, sent = self._replies.get_nowait()
+                    else:
+                        key = next(iter(self._latest))
+                        message, response, encode = self._latest.pop(key)
+                        if response is None:
+                            response = encode(message)
+                        symbol, timeframe = message.get("symbol", ""), message.get("timeframe", "")
+                    started = time.perf_counter()
+                    try:
+                        await self.websocket.send(response)
+                    finally:
+                        if sent is not None and not sent.done():
+                            sent.set_result(None)
+                    if self.metrics is not None:
+                        self.metrics.observe("send", (time.perf_counter() - started) * 1000, symbol, timeframe)
+                        self.metrics.count_bytes(len(response), symbol, timeframe)
+        except websockets.ConnectionClosed:
+            pass
+        except Exception:
+            logger.exception("Sender stopped")
+            # 送信できないまま接続を開いておかないよう、サーバ側のエラーとして閉じる
+            await self.websocket.close(code=1011, reason="internal error")
+        finally:
+            # 以降の送信は捨てる（キューが一杯で待っている send も解放する）
+            self.closed = True
+            self._latest.clear()
+            while not self._replies.empty():
+                sent = self._replies.get_nowait()[3]
+                if sent is not None and not sent.done():
+                    sent.set_result(None)
+
+    # 送信タスクの停止
+    def close(self):
+        self._task.cancel()
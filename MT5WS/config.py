@@ -6,16 +6,27 @@ yaml = YAML()
 with open("settings.yaml", "r", encoding="utf-8") as f:
     settings = yaml.load(f)
 
-# 移動平均線で使用する期間のリスト
-moving_average_periods = settings.get("moving_average_periods", [20, 75, 200])
-
-# 移動平均線の色リスト
-moving_average_colors = settings.get("moving_average_colors", ["black", "black", "black"])
-
-# チャート自動更新の間隔（秒単位）デフォルトは60秒
-auto_update_interval = settings.get("auto_update_interval", 60)
+# 購読で受信した更新をチャートへ反映する間隔（ミリ秒単位）デフォルトは100ミリ秒
+live_update_poll_ms = settings.get("live_update_poll_ms", 100)
 
 # MT5 WebSocketサーバの接続先URI（デフォルトはローカルホスト）
 websocket_uri = settings.get("websocket_uri", "ws://localhost:8765")
 
+# 取得したバーを保存するファイル（SQLite）のパス
+bar_store_path = settings.get("bar_store_path", "bar_store.sqlite3")
+
+# キャッシュするシリーズごとの本数の余裕（表示＋指標に必要な本数に加える）と、全シリーズ合計のメモリの上限（MB）
+cache_margin_bars = settings.get("cache_margin_bars", 500)
+cache_memory_mb = settings.get("cache_memory_mb", 64)
 
+# チャートに表示する指標のリスト（例: {"type": "RSI", "period": 14, "color": "purple"}）
+# type は SMA / EMA / Bollinger / RSI / ATR。RSI と ATR はチャートの下の枠に描く
+# 移動平均線も SMA の指標として扱う。旧形式の moving_average_periods / moving_average_colors は SMA に読み替えて先頭に加える
+# （どちらの設定もなければ 20 / 75 / 200 の SMA）
+legacy_ma_periods = settings.get("moving_average_periods", [] if "indicators" in settings else [20, 75, 200])
+legacy_ma_colors = settings.get("moving_average_colors", [])
+indicators = [
+    {"type": "SMA", "period": period,
+     "color": legacy_ma_colors[i] if i < len(legacy_ma_colors) else "black"}
+    for i, period in enumerate(legacy_ma_periods)
+] + list(settings.get("indicators", []))
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from data_providers import RATE_DTYPE
+from shm_ring import ShmRing
+
+# 時刻が step 秒刻みのバーを作る（価格はすべて時刻にして、どのバーか分かるようにする）
+def _make_bars(first, count, step=60):
+    bars = np.zeros(count, dtype=RATE_DTYPE)
+    bars["time"] = first + step * np.arange(count)
+    for name in ("open", "high", "low", "close"):
+        bars[name] = bars["time"]
+    bars["tick_volume"] = 1
+    return bars
+
+# MT5 モジュールの代わり（bars を置き換えると次の取得から見える）
+class FakeSource:
+    def __init__(self, bars):
+        self.bars = bars
+        self.calls = []  # 呼ばれたメソッド名
+
+    def copy_rates_from_pos(self, symbol, timeframe, pos, count):
+        self.calls.append("from_pos")
+        return self.bars[max(0, len(self.bars) - pos - count):len(self.bars) - pos].copy()
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        self.calls.append("range")
+        times = self.bars["time"]
+        return self.bars[(times >= date_from.timestamp()) & (times <= date_to.timestamp())].copy()
+
+@pytest.fixture
+def make_bars():
+    return _make_bars
+
+@pytest.fixture
+def source():
+    return FakeSource(_make_bars(60, 300))
+
+# 容量 8 本のリング（テストの終わりに共有メモリを削除する）
+@pytest.fixture
+def ring():
+    ring = ShmRing.create(8)
+    yield ring
+    ring.close()
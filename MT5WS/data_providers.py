@@ -0,0 +1,334 @@
+import abc
+import os
+import time
+import numpy as np
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from aggregator import TIMEFRAME_SECONDS, resample
+from rate_codec import RATE_COLUMNS
+
+# MT5 の copy_rates_* と同じ構造化配列の型
+RATE_DTYPE = np.dtype(RATE_COLUMNS)
+
+# MT5 の copy_ticks_* と同じティックの構造化配列の型
+TICK_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("bid", "<f8"),
+    ("ask", "<f8"),
+    ("last", "<f8"),
+    ("volume", "<u8"),
+    ("time_msc", "<i8"),
+    ("flags", "<u4"),
+    ("volume_real", "<f8"),
+])
+
+# サーバが扱う時間足
+TIMEFRAMES = ("M1", "M5", "M15", "M30", "H1", "H4", "D1", "W1", "MN1")
+
+# 時間足ごとのおおよその秒数（週足・月足を含む。取得範囲の見積もりに使う）
+APPROX_SECONDS = dict(TIMEFRAME_SECONDS, W1=7 * 86400, MN1=31 * 86400)
+
+# シンボルの小数点桁数の既定値（MT5 以外のデータソース用）
+DEFAULT_DIGITS = {"GOLD": 2, "XAUUSD": 2}
+
+# シンボルから小数点桁数を推定（JPY 絡みは 3 桁、それ以外は 5 桁）
+def guess_digits(symbol):
+    if symbol in DEFAULT_DIGITS:
+        return DEFAULT_DIGITS[symbol]
+    return 3 if "JPY" in symbol else 5
+
+# MetaTrader5 ターミナルからデータを取得するプロバイダ（Windows 専用）
+# 時間足は文字列（"M5" など）で受け取り、MT5 の定数に変換して呼び出す
+class MT5Provider:
+    def __init__(self):
+        import MetaTrader5 as mt5  # Windows 以外では読み込めないため、使う時だけ import
+        self.mt5 = mt5
+        self.timeframes = {tf: getattr(mt5, f"TIMEFRAME_{tf}") for tf in TIMEFRAMES}
+
+    # MT5の初期化を行う
+    def initialize(self):
+        if not self.mt5.initialize():
+            raise RuntimeError("MT5 initialization failed")
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        return self.mt5.copy_rates_from_pos(symbol, self.timeframes[timeframe], start_pos, count)
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        return self.mt5.copy_rates_range(symbol, self.timeframes[timeframe], date_from, date_to)
+
+    def symbol_info(self, symbol):
+        return self.mt5.symbol_info(symbol)
+
+    def symbol_info_tick(self, symbol):
+        return self.mt5.symbol_info_tick(symbol)
+
+    def copy_ticks_from(self, symbol, date_from, count):
+        return self.mt5.copy_ticks_from(symbol, date_from, count, self.mt5.COPY_TICKS_INFO)
+
+# M1 の系列を仮想時計で再生するプロバイダの共通部分
+# 仮想時計は start_time から実時間の speed 倍で進み、その時刻までに始まったバーだけが見える
+# M1 以外の時間足は M1 から組み立てる
+class M1SeriesProvider(abc.ABC):
+    def __init__(self, speed=1.0, session_offset=0):
+        self.speed = speed
+        self.session_offset = session_offset
+        self.start_time = None
+        self._wall_start = None
+        self._series = {}  # symbol → M1 の構造化配列
+
+    # 仮想時計の開始
+    def initialize(self):
+        self._wall_start = time.monotonic()
+
+    # 現在の仮想時刻（UNIX秒）
+    def now(self):
+        if self._wall_start is None:
+            self.initialize()
+        return self.start_time + (time.monotonic() - self._wall_start) * self.speed
+
+    # シンボルの M1 全体を読み込む（サブクラスで実装）
+    @abc.abstractmethod
+    def _load_m1(self, symbol):
+        pass
+
+    # 現在時刻までの M1（形成中のバーを含む）のビュー
+    def _visible_m1(self, symbol):
+        if symbol not in self._series:
+            self._series[symbol] = self._load_m1(symbol)
+        m1 = self._series[symbol]
+        if m1 is None:
+            return None
+        end = int(np.searchsorted(m1["time"], self.now(), side="right"))
+        return m1[:end]
+
+    # 形成中のバーを途中経過の値に書き換える（既定では何もしない）
+    def _patch_forming(self, symbol, forming):
+        pass
+
+    # M1 の [first, end) をコピーして取り出す（末尾が形成中のバーなら途中経過に置き換える）
+    def _window(self, symbol, m1, first, end):
+        window = m1[first:end].copy()
+        if len(window) and end == len(m1):
+            self._patch_forming(symbol, window[-1:])
+        return window
+
+    # 指定時間足に変換
+    def _to_timeframe(self, m1, timeframe):
+        if timeframe == "M1":
+            return m1
+        return resample(m1, timeframe, self.session_offset)
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        if timeframe not in TIMEFRAMES:
+            return None
+        m1 = self._visible_m1(symbol)
+        if m1 is None or len(m1) == 0:
+            return None
+        need = start_pos + count
+        if timeframe == "M1":
+            rates = self._window(symbol, m1, max(0, len(m1) - need), len(m1))
+        else:
+            # 必要な本数が揃うまで遡る範囲を広げて組み立てる
+            span = APPROX_SECONDS[timeframe] * (need + 1) + 4 * 86400
+            while True:
+                first = int(np.searchsorted(m1["time"], m1["time"][-1] - span, side="left"))
+                rates = self._to_timeframe(self._window(symbol, m1, first, len(m1)), timeframe)
+                if len(rates) > need or first == 0:
+                    break
+                span *= 2
+            rates = rates[-need:]
+        if start_pos:
+            rates = rates[:-start_pos]
+        return rates
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        if timeframe not in TIMEFRAMES:
+            return None
+        m1 = self._visible_m1(symbol)
+        if m1 is None:
+            return None
+        t_from = int(date_from.timestamp())
+        t_to = int(date_to.timestamp())
+        # 上位足の最初のバーが欠けないよう、1 本分手前から組み立てる
+        first = int(np.searchsorted(m1["time"], t_from - APPROX_SECONDS[timeframe], side="left"))
+        end = int(np.searchsorted(m1["time"], t_to, side="right"))
+        rates = self._to_timeframe(self._window(symbol, m1, first, end), timeframe)
+        return rates[(rates["time"] >= t_from) & (rates["time"] <= t_to)]
+
+    def symbol_info(self, symbol):
+        return SimpleNamespace(name=symbol, digits=guess_digits(symbol))
+
+    # 最新ティック（形成中の M1 の途中経過の終値を bid、スプレッドを足した値を ask とする）
+    def symbol_info_tick(self, symbol):
+        m1 = self._visible_m1(symbol)
+        if m1 is None or len(m1) == 0:
+            return None
+        forming = self._window(symbol, m1, len(m1) - 1, len(m1))
+        now = self.now()
+        bid = float(forming["close"][0])
+        ask = round(bid + int(forming["spread"][0]) * 10 ** -guess_digits(symbol), guess_digits(symbol))
+        return SimpleNamespace(time=int(now), bid=bid, ask=ask, last=0.0,
+                               volume=int(forming["tick_volume"][0]), time_msc=int(now * 1000),
+                               flags=0, volume_real=0.0)
+
+    # date_from 以降のティック（ティックデータはないので、M1 の終値を 1 本ごとのティックとして返す）
+    def copy_ticks_from(self, symbol, date_from, count):
+        m1 = self._visible_m1(symbol)
+        if m1 is None:
+            return None
+        first = int(np.searchsorted(m1["time"], int(date_from.timestamp()) - 59, side="left"))
+        bars = self._window(symbol, m1, first, min(len(m1), first + count))
+        digits = guess_digits(symbol)
+        ticks = np.zeros(len(bars), dtype=TICK_DTYPE)
+        ticks["time"] = np.minimum(bars["time"] + 59, int(self.now()))
+        ticks["time_msc"] = ticks["time"] * 1000
+        ticks["bid"] = bars["close"]
+        ticks["ask"] = np.round(bars["close"] + bars["spread"] * 10.0 ** -digits, digits)
+        ticks["volume"] = bars["tick_volume"]
+        return ticks[ticks["time"] >= int(date_from.timestamp())]
+
+# ForexTester 形式の CSV（convert_dukascopy_to_forextester6.py の出力）を再生するプロバイダ
+# data_dir 内の "<SYMBOL>.csv" を読み込む。時刻は MT4/MT5 のサーバ時間として扱う
+# start_time を省略した場合は、最も早く始まるシンボルのデータの中間点から再生する
+class ReplayProvider(M1SeriesProvider):
+    def __init__(self, data_dir, speed=1.0, start_time=None, date_format="%Y.%m.%d",
+                 time_format="%H:%M", session_offset=0):
+        super().__init__(speed, session_offset)
+        self.data_dir = data_dir
+        self.date_format = date_format
+        self.time_format = time_format
+        self._requested_start = start_time
+
+    def initialize(self):
+        if not os.path.isdir(self.data_dir):
+            raise RuntimeError(f"Replay data directory not found: {self.data_dir}")
+        if self._requested_start is not None:
+            self.start_time = int(self._requested_start)
+        else:
+            starts = []
+            for name in os.listdir(self.data_dir):
+                if name.lower().endswith(".csv"):
+                    m1 = self._load_m1(os.path.splitext(name)[0].upper())
+                    if m1 is not None and len(m1):
+                        starts.append(int(m1["time"][len(m1) // 2]))
+            if not starts:
+                raise RuntimeError(f"No replay data in {self.data_dir}")
+            self.start_time = min(starts)
+        super().initialize()
+
+    # CSV の日付・時刻列を UNIX 秒に変換
+    def _parse_times(self, dates, times):
+        if self.date_format == "%Y.%m.%d" and self.time_format == "%H:%M":
+            # 既定の書式は numpy の datetime64 で一括変換
+            stamps = np.char.add(np.char.add(np.char.replace(dates, ".", "-"), "T"), times)
+            return stamps.astype("datetime64[s]").astype(np.int64)
+        fmt = f"{self.date_format} {self.time_format}"
+        return np.array([
+            int(datetime.strptime(f"{d} {t}", fmt).replace(tzinfo=timezone.utc).timestamp())
+            for d, t in zip(dates, times)
+        ], dtype=np.int64)
+
+    def _load_m1(self, symbol):
+        if symbol in self._series:
+            return self._series[symbol]
+        path = os.path.join(self.data_dir, f"{symbol}.csv")
+        if not os.path.exists(path):
+            return None
+        raw = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding="utf-8-sig")
+        raw = np.atleast_1d(raw)
+        rates = np.zeros(len(raw), dtype=RATE_DTYPE)
+        rates["time"] = self._parse_times(raw["Date"].astype(str), raw["Time"].astype(str))
+        for src, dst in (("Open", "open"), ("High", "high"), ("Low", "low"), ("Close", "close")):
+            rates[dst] = raw[src]
+        rates["tick_volume"] = raw["Volume"]
+        rates = rates[np.argsort(rates["time"], kind="stable")]
+        self._series[symbol] = rates
+        return rates
+
+# ランダムウォークで M1 を生成するプロバイダ
+# 仮想時計の開始時点より前に history_bars 本の履歴を持ち、時計が進むと続きを生成する
+# 形成中のバーは経過秒数に応じて終値・高値・安値が動く
+class SyntheticProvider(M1SeriesProvider):
+    BLOCK_BARS = 1440  # 追加生成の単位（1 日分）
+
+    def __init__(self, speed=1.0, seed=0, history_bars=200000, start_time=None,
+                 volatility=0.0002, base_prices=None, session_offset=0):
+        super().__init__(speed, session_offset)
+        self.seed = seed
+        self.history_bars = history_bars
+        self.volatility = volatility
+        self.base_prices = base_prices or {}
+        now = int(time.time()) if start_time is None else int(start_time)
+        self.start_time = now - now % 60
+        self._rngs = {}
+
+    # シンボルごとに再現可能な乱数列
+    def _rng(self, symbol):
+        if symbol not in self._rngs:
+            self._rngs[symbol] = np.random.default_rng([self.seed] + [ord(c) for c in symbol])
+        return self._rngs[symbol]
+
+    # 開始価格の既定値（JPY 絡みは 150、GOLD は 2000、それ以外は 1.1）
+    def _base_price(self, symbol):
+        if symbol in self.base_prices:
+            return self.base_prices[symbol]
+        if symbol in DEFAULT_DIGITS:
+            return 2000.0
+        return 150.0 if "JPY" in symbol else 1.1
+
+    # first_time から count 本の M1 を生成（前の終値 last_close から続ける）
+    def _generate(self, symbol, first_time, count, last_close):
+        rng = self._rng(symbol)
+        digits = guess_digits(symbol)
+        steps = rng.normal(0.0, self.volatility, size=(count, 4))
+        closes = last_close * np.exp(np.cumsum(steps[:, 0]))
+        opens = np.concatenate(([last_close], closes[:-1]))
+        wick = np.abs(steps[:, 1:3]) * closes[:, None]
+        rates = np.zeros(count, dtype=RATE_DTYPE)
+        rates["time"] = first_time + np.arange(count, dtype=np.int64) * 60
+        rates["open"] = np.round(opens, digits)
+        rates["close"] = np.round(closes, digits)
+        rates["high"] = np.round(np.maximum(opens, closes) + wick[:, 0], digits)
+        rates["low"] = np.round(np.minimum(opens, closes) - wick[:, 1], digits)
+        rates["tick_volume"] = rng.integers(20, 200, size=count)
+        rates["spread"] = rng.integers(1, 20, size=count)
+        return rates
+
+    def _load_m1(self, symbol):
+        first_time = self.start_time - self.history_bars * 60
+        return self._generate(symbol, first_time, self.history_bars + self.BLOCK_BARS,
+                              self._base_price(symbol))
+
+    # 仮想時刻に合わせて続きを生成する
+    def _visible_m1(self, symbol):
+        if symbol not in self._series:
+            self._series[symbol] = self._load_m1(symbol)
+        now = self.now()
+        m1 = self._series[symbol]
+        while m1["time"][-1] <= now:
+            block = self._generate(symbol, int(m1["time"][-1]) + 60, self.BLOCK_BARS, float(m1["close"][-1]))
+            m1 = self._series[symbol] = np.concatenate([m1, block])
+        return super()._visible_m1(symbol)
+
+    # 形成中のバーは経過秒数に応じて、始値から最終的な値に向かって動かす
+    def _patch_forming(self, symbol, forming):
+        progress = min(1.0, (self.now() - forming["time"][0]) / 60.0)
+        digits = guess_digits(symbol)
+        o = forming["open"][0]
+        close = round(o + (forming["close"][0] - o) * progress, digits)
+        forming["high"] = round(max(o, close, o + (forming["high"][0] - o) * progress), digits)
+        forming["low"] = round(min(o, close, o - (o - forming["low"][0]) * progress), digits)
+        forming["close"] = close
+        forming["tick_volume"] = max(1, int(forming["tick_volume"][0] * progress))
+
+# 名前からプロバイダを作成（"mt5" / "replay" / "synthetic"）
+def create_provider(name, data_dir=None, speed=1.0, seed=0):
+    if name == "mt5":
+        return MT5Provider()
+    if name == "replay":
+        if not data_dir:
+            raise ValueError("--data-dir is required for the replay provider")
+        return ReplayProvider(data_dir, speed=speed)
+    if name == "synthetic":
+        return SyntheticProvider(speed=speed, seed=seed)
+    raise ValueError(f"Unknown provider: {name}")
@@ -0,0 +1,66 @@
+import json
+import numpy as np
+from rate_codec import rates_to_list
+
+# シリーズごとに保持するエンコード済みバーの最大本数
+FRAGMENT_MAX_BARS = 20000
+
+# 1 シリーズ（シンボル×時間足）分のエンコード済みバー
+# rows はエンコードした時点のバー（時刻順）、texts は対応する JSON 文字列
+class _Fragments:
+    def __init__(self, rows, texts):
+        self.rows = rows
+        self.texts = texts
+
+# バー 1 本ごとの JSON 文字列のキャッシュ
+# レスポンスは保持している文字列を連結して作り、内容が変わったバー（形成中のバーなど）だけをエンコードし直す
+# 保持しているバーと新しいバーは配列のまま比較するので、確定・更新の通知を受ける必要はない
+# 保持するのは各シリーズの直近の連続した範囲だけで、それより古い範囲は保持せずにエンコードする
+class FragmentCache:
+    def __init__(self, max_bars=FRAGMENT_MAX_BARS):
+        self.max_bars = max_bars
+        self._series = {}  # (symbol, timeframe) → _Fragments
+        self.reused = 0    # 使い回したバーの本数
+        self.encoded = 0   # エンコードしたバーの本数
+
+    # バーを JSON 文字列のリストに変換（変化のないバーは保持している文字列を使う）
+    def json_texts(self, symbol, timeframe, rates):
+        if len(rates) == 0:
+            return []
+        key = (symbol, timeframe)
+        frag = self._series.get(key)
+        first_time = rates["time"][0]
+        if frag is None:
+            texts = self._encode(rates)
+            self._store(key, rates.copy(), texts)
+            return texts
+        if first_time < frag.rows["time"][0]:
+            return self._encode(rates)  # 保持している範囲より古いバーは保持しない
+
+        # 先頭から一致するバー（時刻も含めて比較）の文字列を使い回す
+        start = int(np.searchsorted(frag.rows["time"], first_time, side="left"))
+        overlap = min(len(rates), len(frag.rows) - start)
+        same = frag.rows[start:start + overlap] == rates[:overlap]
+        matched = overlap if same.all() else int(same.argmin())
+        self.reused += matched
+        texts = frag.texts[start:start + matched]
+        if matched == len(rates):
+            return texts
+
+        # 変化したバー以降をエンコードし、保持している範囲の末尾を置き換える
+        fresh = self._encode(rates[matched:])
+        end = start + matched
+        self._store(key, np.concatenate([frag.rows[:end], rates[matched:]]), frag.texts[:end] + fresh)
+        return texts + fresh
+
+    # バーを 1 本ずつ JSON 文字列にする
+    def _encode(self, rates):
+        self.encoded += len(rates)
+        return [json.dumps(row) for row in rates_to_list(rates)]
+
+    # 保持する範囲を更新（上限を超えた分は古い方から捨てる）
+    def _store(self, key, rows, texts):
+        if len(rows) > self.max_bars:
+            rows = rows[-self.max_bars:]
+            texts = texts[-self.max_bars:]
+        self._series[key] = _Fragments(rows, texts)
@@ -0,0 +1,428 @@
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 指数移動平均の計算でまとめて扱う本数の目安（減衰率の累乗が大きくなりすぎないように区切る）
+_DECAY_EXPONENT_LIMIT = 300.0
+
+# 再帰的な移動平均 y[i] = y[i-1] + alpha * (x[i] - y[i-1])、y[0] = x[0] をまとめて計算
+# 区間ごとに y[k] = d^(k+1) * y0 + alpha * d^k * Σ x[j] / d^j（d = 1 - alpha）とし、ループを使わない
+def _recursive_mean(values, alpha):
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty(len(values))
+    if not len(values):
+        return out
+    decay = 1.0 - alpha
+    out[0] = previous = values[0]
+    if decay <= 0.0:
+        out[:] = values
+        return out
+    block = max(1, int(_DECAY_EXPONENT_LIMIT / -np.log(decay)))
+    for start in range(1, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(len(chunk))
+        out[start:start + len(chunk)] = (decay * powers * previous
+                                         + alpha * powers * np.cumsum(chunk / powers))
+        previous = out[start + len(chunk) - 1]
+    return out
+
+# 単純移動平均（期間に満たない先頭は NaN）
+# 累積和の差から求めるので、期間が長くても本数に比例した計算で済む
+def _rolling_mean(values, period):
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        cumsum = np.concatenate(([0.0], np.cumsum(values)))
+        out[period - 1:] = (cumsum[period:] - cumsum[:-period]) / period
+    return out
+
+# 指標の基本クラス
+# inputs は計算に使う列、outputs は描画する線（compute の結果のうち、それ以外のキーは途中の計算結果）
+# 購読の更新では、state で求めた状態（移動平均の合計や前のバーの値）から step で 1 本ずつ続きを計算する
+# params はパラメータの既定値、param_ranges は取れる値の (最小, 最大, 設定画面の刻み)
+# pane は "main"（価格のチャートに重ねる）か "sub"（チャートの下の枠）
+# value_range は sub の縦軸の範囲（None なら表示中の値の最小～最大）、levels は sub に引く水平線の値
+class Indicator:
+    name = ""
+    inputs = ("close",)
+    outputs = ()
+    pane = "main"
+    params = {}
+    param_ranges = {}
+    value_range = None
+    levels = ()
+
+    def __init__(self, color="black", **params):
+        self.color = color
+        for key, default in self.params.items():
+            value = type(default)(params.get(key, default))
+            low, high, _ = self.param_ranges[key]
+            if not low <= value <= high:
+                raise ValueError(f"{key} must be between {low} and {high}: {value}")
+            setattr(self, key, value)
+
+    # 値が安定するまでに必要な本数（表示より前にこの本数があればよい）
+    @property
+    def lookback(self):
+        return self.period
+
+    # 先頭の何本を NaN にするか（値を計算できない範囲）
+    @property
+    def warmup(self):
+        return self.period - 1
+
+    # 設定ファイルに保存する形
+    def to_spec(self):
+        spec = {"type": self.name, "color": self.color}
+        spec.update({key: getattr(self, key) for key in self.params})
+        return spec
+
+    # 表示名（例: "EMA(50)"）
+    def label(self):
+        return f"{self.name}({', '.join(str(getattr(self, key)) for key in self.params)})"
+
+    # 全体をまとめて計算（columns は inputs の列の配列。戻り値は 名前 → 配列）
+    def compute(self, columns):
+        raise NotImplementedError
+
+    # compute の結果から、先頭から end 本目の手前までを計算し終えた状態を求める
+    def state(self, columns, result, end):
+        raise NotImplementedError
+
+    # i 番目のバーの値を result に書き込み、i 番目までを計算し終えた状態を返す（O(1)）
+    def step(self, columns, result, i, state):
+        raise NotImplementedError
+
+# 単純移動平均
+class SMA(Indicator):
+    name = "SMA"
+    outputs = ("sma",)
+    params = {"period": 20}
+    param_ranges = {"period": (1, 1000, 1)}
+
+    def compute(self, columns):
+        return {"sma": _rolling_mean(columns["close"], self.period)}
+
+    # 状態は直近 period 本の終値の合計
+    def state(self, columns, result, end):
+        return float(columns["close"][max(0, end - self.period):end].sum())
+
+    def step(self, columns, result, i, state):
+        closes = columns["close"]
+        total = state + closes[i] - (closes[i - self.period] if i >= self.period else 0.0)
+        result["sma"][i] = total / self.period if i >= self.warmup else np.nan
+        return total
+
+# 指数移動平均
+class EMA(Indicator):
+    name = "EMA"
+    outputs = ("ema",)
+    params = {"period": 20}
+    param_ranges = {"period": (1, 1000, 1)}
+
+    @property
+    def lookback(self):
+        return self.period * 3
+
+    def compute(self, columns):
+        ema = _recursive_mean(columns["close"], 2.0 / (self.period + 1))
+        ema[:self.warmup] = np.nan
+        return {"ema": ema}
+
+    # 状態は直前のバーの EMA（先頭の NaN にした範囲は計算し直す。None はまだバーがない）
+    def state(self, columns, result, end):
+        if end == 0:
+            return None
+        if end >= self.period:
+            return float(result["ema"][end - 1])
+        return float(_recursive_mean(columns["close"][:end], 2.0 / (self.period + 1))[-1])
+
+    def step(self, columns, result, i, state):
+        close = columns["close"][i]
+        ema = close if state is None else state + 2.0 / (self.period + 1) * (close - state)
+        result["ema"][i] = ema if i >= self.warmup else np.nan
+        return ema
+
+# ボリンジャーバンド（移動平均 ± deviations × 標準偏差）
+class BollingerBands(Indicator):
+    name = "Bollinger"
+    outputs = ("middle", "upper", "lower")
+    params = {"period": 20, "deviations": 2.0}
+    param_ranges = {"period": (2, 500, 1), "deviations": (0.1, 5.0, 0.1)}
+
+    def compute(self, columns):
+        closes = columns["close"]
+        middle = _rolling_mean(closes, self.period)
+        width = np.full(len(closes), np.nan)
+        if len(closes) >= self.period:
+            width[self.period - 1:] = sliding_window_view(closes, self.period).std(axis=1) * self.deviations
+        return {"middle": middle, "upper": middle + width, "lower": middle - width}
+
+    # 状態は (基準値, 直近 period 本の終値と基準値の差の合計, その 2 乗の合計)
+    # 価格の大きさのまま 2 乗を足すと分散の計算で桁落ちするので、基準値との差で持つ
+    def state(self, columns, result, end):
+        closes = columns["close"]
+        window = closes[max(0, end - self.period):end]
+        base = float(closes[max(0, end - 1)]) if len(closes) else 0.0
+        return base, float((window - base).sum()), float(((window - base) ** 2).sum())
+
+    def step(self, columns, result, i, state):
+        closes = columns["close"]
+        base, total, squares = state
+        added = closes[i] - base
+        removed = closes[i - self.period] - base if i >= self.period else 0.0
+        total += added - removed
+        squares += added * added - removed * removed
+        if i >= self.warmup:
+            mean = total / self.period
+            width = math.sqrt(max(squares / self.period - mean * mean, 0.0)) * self.deviations
+            result["middle"][i] = base + mean
+            result["upper"][i] = base + mean + width
+            result["lower"][i] = base + mean - width
+        else:
+            result["middle"][i] = result["upper"][i] = result["lower"][i] = np.nan
+        return base, total, squares
+
+# RSI（ワイルダーの平滑化）
+class RSI(Indicator):
+    name = "RSI"
+    outputs = ("rsi",)
+    pane = "sub"
+    params = {"period": 14}
+    param_ranges = {"period": (2, 200, 1)}
+    value_range = (0.0, 100.0)
+    levels = (30.0, 70.0)
+
+    @property
+    def lookback(self):
+        return self.period * 3
+
+    @property
+    def warmup(self):
+        return self.period
+
+    def compute(self, columns):
+        closes = columns["close"]
+        changes = np.diff(closes, prepend=closes[:1])
+        gain = _recursive_mean(np.maximum(changes, 0.0), 1.0 / self.period)
+        loss = _recursive_mean(np.maximum(-changes, 0.0), 1.0 / self.period)
+        rsi = self._rsi(gain, loss)
+        rsi[:self.warmup] = np.nan
+        return {"rsi": rsi, "gain": gain, "loss": loss}
+
+    # 状態は直前のバーの (平均の上昇幅, 平均の下落幅)（None はまだバーがない）
+    def state(self, columns, result, end):
+        if end == 0:
+            return None
+        return float(result["gain"][end - 1]), float(result["loss"][end - 1])
+
+    def step(self, columns, result, i, state):
+        closes = columns["close"]
+        change = closes[i] - closes[i - 1] if i else 0.0
+        up, down = max(change, 0.0), max(-change, 0.0)
+        if state is None:
+            gain, loss = up, down
+        else:
+            gain = state[0] + (up - state[0]) / self.period
+            loss = state[1] + (down - state[1]) / self.period
+        result["gain"][i] = gain
+        result["loss"][i] = loss
+        if i < self.warmup:
+            result["rsi"][i] = np.nan
+        else:
+            result["rsi"][i] = 100.0 if loss == 0.0 else 100.0 - 100.0 / (1.0 + gain / loss)
+        return gain, loss
+
+    @staticmethod
+    def _rsi(gain, loss):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = 100.0 - 100.0 / (1.0 + gain / loss)
+        return np.where(loss == 0.0, 100.0, rsi)
+
+# ATR（真の値幅のワイルダーの平滑化）
+class ATR(Indicator):
+    name = "ATR"
+    inputs = ("high", "low", "close")
+    outputs = ("atr",)
+    pane = "sub"
+    params = {"period": 14}
+    param_ranges = {"period": (1, 200, 1)}
+
+    @property
+    def lookback(self):
+        return self.period * 3
+
+    @property
+    def warmup(self):
+        return self.period
+
+    def compute(self, columns):
+        atr = _recursive_mean(self._true_range(columns["high"], columns["low"], columns["close"]), 1.0 / self.period)
+        atr[:self.warmup] = np.nan
+        return {"atr": atr}
+
+    # 状態は直前のバーの ATR（先頭の NaN にした範囲は計算し直す。None はまだバーがない）
+    def state(self, columns, result, end):
+        if end == 0:
+            return None
+        if end > self.period:
+            return float(result["atr"][end - 1])
+        true_range = self._true_range(columns["high"][:end], columns["low"][:end], columns["close"][:end])
+        return float(_recursive_mean(true_range, 1.0 / self.period)[-1])
+
+    def step(self, columns, result, i, state):
+        high, low = columns["high"][i], columns["low"][i]
+        previous = columns["close"][i - 1] if i else columns["close"][i]
+        true_range = max(high - low, abs(high - previous), abs(low - previous))
+        atr = true_range if state is None else state + (true_range - state) / self.period
+        result["atr"][i] = atr if i >= self.warmup else np.nan
+        return atr
+
+    @staticmethod
+    def _true_range(high, low, close):
+        previous = np.concatenate((close[:1], close[:-1]))
+        return np.maximum(high - low, np.maximum(np.abs(high - previous), np.abs(low - previous)))
+
+# 設定の "type" → 指標のクラス
+INDICATOR_TYPES = {cls.name: cls for cls in (SMA, EMA, BollingerBands, RSI, ATR)}
+
+# 設定（{"type": "EMA", "period": 50, "color": "orange"} 等）から指標を作る
+def create_indicator(spec):
+    spec = dict(spec)
+    name = spec.pop("type", None)
+    cls = INDICATOR_TYPES.get(name)
+    if cls is None:
+        raise ValueError(f"unknown indicator: {name}")
+    return cls(**spec)
+
+# 1 つの指標の計算結果
+# 値は余裕を持たせた配列に入れ、values はその先頭から系列と同じ本数のビュー
+# 新しいバーは末尾に書き足す（足りなければ容量を倍に広げて償却 O(1)。BarSeries と同じ）
+# state は最新のバーの手前までを計算し終えた状態で、次の更新はここから続きを計算する
+class _Result:
+    def __init__(self, key, values, state):
+        self.key = key
+        self.state = state
+        self.values = values
+        self._buffers = values
+
+    # 先頭の dropped 本を捨てて count 本にする（捨てる場合と容量が足りない場合だけコピー）
+    def resize(self, dropped, count):
+        capacity = len(next(iter(self._buffers.values())))
+        if dropped or count > capacity:
+            if count > capacity:
+                capacity = max(count, capacity * 2)
+            buffers = {}
+            for name, values in self.values.items():
+                kept = np.empty(capacity)
+                kept[:len(values) - dropped] = values[dropped:]
+                buffers[name] = kept
+            self._buffers = buffers
+        self.values = {name: buffer[:count] for name, buffer in self._buffers.items()}
+
+# チャートの指標の計算結果（指標ごとに持ち、系列の version が同じなら計算し直さない）
+# 購読の更新は update() で前回の最新のバー以降だけを計算する
+class IndicatorSet:
+    def __init__(self, indicators=()):
+        self.indicators = list(indicators)
+        self._results = {}  # id(指標) → (系列のキー, 計算結果)
+
+    def __iter__(self):
+        return iter(self.indicators)
+
+    def __len__(self):
+        return len(self.indicators)
+
+    # 下の枠に描く指標
+    def sub_pane(self):
+        return [indicator for indicator in self.indicators if indicator.pane == "sub"]
+
+    # 表示より前に必要な本数
+    def lookback(self):
+        return max((indicator.lookback for indicator in self.indicators), default=0)
+
+    # 指標を入れ替える（設定が変わっていない指標は同じオブジェクトのまま残し、計算し直さない）
+    # 種類やパラメータが正しくない設定は警告を出して飛ばす
+    def replace(self, specs):
+        current = {self._spec_key(indicator.to_spec()): indicator for indicator in self.indicators}
+        indicators = []
+        for spec in specs:
+            indicator = current.pop(self._spec_key(spec), None)
+            if indicator is None:
+                try:
+                    indicator = create_indicator(spec)
+                except (ValueError, TypeError) as e:
+                    print(f"[Indicator] skipped {dict(spec)}: {e}")
+                    continue
+            indicators.append(indicator)
+        for removed in current.values():
+            self._results.pop(id(removed), None)
+        self.indicators = indicators
+
+    # 指標の計算結果（名前 → 系列と同じ長さの配列）
+    def get(self, rates, indicator):
+        key = self._key(rates)
+        cached = self._results.get(id(indicator))
+        if cached is not None and cached.key == key:
+            return cached.values
+        return self._compute(rates, indicator, key).values
+
+    # 購読の更新を反映（計算済みの指標だけ）
+    # 前回の最新のバー（形成中だったバー）以降を、その手前の状態から 1 本ずつ計算する
+    # 系列が置き換わった・古いバーが足された等で前回の最新のバーから続けられない場合は全体を計算する
+    def update(self, rates):
+        key = self._key(rates)
+        for indicator in self.indicators:
+            cached = self._results.get(id(indicator))
+            if cached is None or cached.key == key:
+                continue
+            if not self._advance(rates, indicator, cached, key):
+                self._compute(rates, indicator, key)
+
+    # 全体をまとめて計算
+    def _compute(self, rates, indicator, key):
+        columns = self._columns(rates, indicator)
+        values = indicator.compute(columns)
+        result = _Result(key, values, indicator.state(columns, values, max(0, len(rates) - 1)))
+        self._results[id(indicator)] = result
+        return result
+
+    # 前回の最新のバー以降だけを計算する（それより前のバーは変わっていないこと）
+    # 前回の最新のバーが見つからない場合は False
+    def _advance(self, rates, indicator, cached, key):
+        last_time = cached.key[3]
+        if last_time is None or not len(rates):
+            return False
+        times = rates["time"]
+        position = int(np.searchsorted(times, last_time, side="left"))
+        if position >= len(times) or times[position] != last_time:
+            return False
+        dropped = cached.key[1] - 1 - position  # 先頭から外れた本数
+        if dropped < 0 or (dropped and position < indicator.lookback):
+            return False
+        cached.resize(dropped, len(rates))
+        if dropped:
+            # 全体を計算した場合と同じく、新しい先頭から warmup 本の線は描かない
+            for name in indicator.outputs:
+                cached.values[name][:indicator.warmup] = np.nan
+        columns = self._columns(rates, indicator)
+        state = cached.state
+        for i in range(position, len(rates)):
+            if i == len(rates) - 1:
+                cached.state = state
+            state = indicator.step(columns, cached.values, i, state)
+        cached.key = key
+        return True
+
+    @staticmethod
+    def _columns(rates, indicator):
+        return {name: np.asarray(rates[name], dtype=np.float64) for name in indicator.inputs}
+
+    @staticmethod
+    def _spec_key(spec):
+        return tuple(sorted((key, str(value)) for key, value in spec.items()))
+
+    @staticmethod
+    def _key(rates):
+        if not len(rates):
+            return (rates.version, 0, None, None)
+        return (rates.version, len(rates), int(rates["time"][0]), rates.last_time)
@@ -0,0 +1,63 @@
+# 使い回すアイテムに付けるタグ（背景の描き直しで削除しないアイテムの目印）
+POOL_TAG = "pooled"
+
+# キャンバスのアイテムの置き場（レイヤーごとに 1 つ。ロウソク足・移動平均線・水平線など）
+# 描画のたびに begin() → 必要な数だけ take() → finish() と呼ぶ
+# 作成済みのアイテムは coords / itemconfig で置き直し、余ったアイテムは削除せずに隠す
+# 足りない時だけ新しく作るので、同じ数以下で描き直している間はアイテムが増えない
+class ItemPool:
+    def __init__(self, canvas, kind, tag):
+        self.canvas = canvas
+        self.kind = kind      # "rectangle" / "line" 等（create_<kind> で作る）
+        self.tag = tag
+        self.items = []       # 作成済みのアイテムの ID（使う順）
+        self.used = 0         # 今回の描画で使ったアイテムの数
+        self._options = {}    # ID → 最後に設定したオプション（変わった時だけ itemconfig する）
+        self._hidden = set()  # 隠しているアイテムの ID
+
+    # 今回の描画で使ったアイテムの ID
+    @property
+    def active(self):
+        return self.items[:self.used]
+
+    # 描画の開始
+    def begin(self):
+        self.used = 0
+
+    # アイテムを 1 つ使う（座標とオプションを設定して ID を返す）
+    def take(self, *coords, **options):
+        if self.used < len(self.items):
+            item = self.items[self.used]
+            self.canvas.coords(item, *coords)
+            applied = self._options[item]
+            changed = {name: value for name, value in options.items() if applied.get(name) != value}
+            applied.update(changed)
+            if item in self._hidden:
+                self._hidden.discard(item)
+                changed["state"] = "normal"
+            if changed:
+                self.canvas.itemconfigure(item, **changed)
+        else:
+            create = getattr(self.canvas, "create_" + self.kind)
+            item = create(*coords, tags=(self.tag, POOL_TAG), **options)
+            self.items.append(item)
+            self._options[item] = dict(options)
+        self.used += 1
+        return item
+
+    # 描画の終了（今回使わなかったアイテムを隠す）
+    def finish(self):
+        for item in self.items[self.used:]:
+            if item not in self._hidden:
+                self.canvas.itemconfigure(item, state="hidden")
+                self._hidden.add(item)
+
+    # すべて隠す
+    def hide(self):
+        self.begin()
+        self.finish()
+
+    # 使用中のアイテムの先頭の count 個を後ろに回す（move() でまとめてずらした後、左端から外れた分を次に使う）
+    def rotate(self, count):
+        used = self.items[:self.used]
+        self.items[:self.used] = used[count:] + used[:count]
@@ -1,17 +1,24 @@
-import asyncio
 import tkinter as tk
 import tkinter.font as tkFont
 import tkinter.simpledialog
 import os
+import queue
 import pyautogui
 
+from aggregator import bucket_start
+from background_loop import BackgroundLoop
+from bar_series import BarSeries
+from bar_store import BarStore
 from chart_canvas import CandleChart
-from config import moving_average_periods
+from config import bar_store_path, cache_margin_bars, cache_memory_mb, indicators
 from datetime import datetime, timezone
 from rate_control_canvas import RateControlCanvas
 from event_handlers import bind_drag_events, bind_drag_window_events
+from indicators import INDICATOR_TYPES, IndicatorSet
 from PIL import ImageTk
+from prefetcher import Prefetcher
 from ruamel.yaml import YAML
+from series_cache import SeriesCache
 from ws_client import MT5WebSocketClient
 
 # --- 通貨コード → 正式通貨ペアへのマッピング ---
@@ -33,6 +40,12 @@ DECIMAL_PLACES_MAP = {
     "XU": 2,
 }
 
+# 差分取得で 1 回に要求する本数（これで足りない場合は残りを分割して取得する）
+DELTA_COUNT = 100
+
+# 数字キー 1～9 に割り当てる時間足（短い順）
+TIMEFRAME_KEYS = ["M1", "M5", "M15", "M30", "H1", "H4", "D1", "W1", "MN1"]
+
 def get_format_func(symbol_short):
     digits = DECIMAL_PLACES_MAP.get(symbol_short.upper(), 3) # デフォルト3桁
     return lambda value: f"{value:.{digits}f}"
@@ -43,24 +56,82 @@ def main():
     timeframe = "M5"      # タイムフレーム指定
     candle_count = 250    # ロウソク足の数を指定
 
-    max_ma_period = max(moving_average_periods)  # 最大移動平均期間を取得
-    required_candle_count = candle_count + max_ma_period  # 表示＋移動平均に必要な本数
+    indicator_set = IndicatorSet()
+    indicator_set.replace(indicators)  # 設定ファイルの指標（移動平均線は SMA）
+    required_candle_count = candle_count + indicator_set.lookback()  # 表示＋指標に必要な本数
 
     # WebSocketクライアントを初期化
     client = MT5WebSocketClient()
 
-    # timeframeごとのキャッシュを保持する辞書
-    cached_data = {}
-
-    # 同期的にレートを取得する関数（初期表示用）
-    def fetch_rates_sync(symbol, timeframe, count):
-        return asyncio.run(client.request_rates(symbol, timeframe, count))
-
-    # キャッシュがなければ初回データを取得
-    cache_key = f"{symbol}_{timeframe}"
-    if cache_key not in cached_data:
-        cached_data[cache_key] = fetch_rates_sync(symbol, timeframe, required_candle_count)
-    rates = cached_data[cache_key][-required_candle_count:] # 表示用だけでなく移動平均用の期間も含める
+    # 通信（取得・購読）を行うバックグラウンドループと、購読で受信した更新を Tk スレッドへ渡すキュー
+    io_loop = BackgroundLoop()
+    live_updates = queue.Queue()
+    subscription = [None, None]  # 現在の購読タスク（バー・ティック）
+    subscribed_view = [None]     # 購読中の (シンボル, 時間足)
+
+    # 表示中のシンボル×時間足を購読し直す（前の購読はキャンセル）
+    # ティックも購読し、最後のロウソク足を確定前から動かす（時間足は "TICK" としてキューに入れる）
+    def start_subscription(symbol, timeframe):
+        for task in subscription:
+            if task is not None:
+                task.cancel()
+        subscribed_view[0] = (symbol, timeframe)
+        on_update = lambda s, tf, data: live_updates.put((s, tf, BarSeries.from_rates(data)))
+        on_tick = lambda tick: live_updates.put((tick["symbol"], "TICK", tick))
+        subscription[0] = io_loop.submit(client.subscribe(symbol, timeframe, on_update, binary=True))
+        subscription[1] = io_loop.submit(client.subscribe_ticks(symbol, on_tick))
+
+    # timeframeごとのキャッシュ（BarSeries）
+    # シリーズの本数とメモリの合計に上限があり、捨てられたシリーズは次に使う時にディスクかサーバから読み直す
+    cached_data = SeriesCache(required_candle_count + cache_margin_bars, cache_memory_mb * 1024 * 1024)
+
+    # 取得したバーのディスクへの保存先（起動時・初めて表示するシリーズはここから読み込む）
+    store = BarStore(bar_store_path)
+
+    # レートを BarSeries で取得する get_rates_func（差分取得対応。バイナリ形式で受け取り列のまま格納する）
+    # バックグラウンドのループで実行するため、キャッシュは読むだけにして反映は merge_rates で Tk のスレッドで行う
+    async def get_rates_func(symbol, tf, count):
+        cache_key = f"{symbol}_{tf}" # キャッシュキーを通貨ペア(symbol)とタイムフレーム(tf)で作成
+        cached = cached_data.peek(cache_key)
+        # キャッシュに該当データがない（指標の変更で必要な本数が増えた場合を含む）場合、サーバから新規に取得
+        if not cached or len(cached) < count:
+            return BarSeries.from_rates(await client.request_rates(symbol, tf, count, binary=True))
+        # キャッシュの最新データの時刻以降のデータを取得（最新のバーの確定前からの更新を含める）
+        data = BarSeries.from_rates(await client.request_rates(symbol, tf, count=DELTA_COUNT,
+                                                               from_time=cached.last_time, binary=True))
+        if len(data) >= DELTA_COUNT:
+            # 差分が多い場合（長く起動していなかった等）は残りを分割して取得
+            async for chunk in client.stream_range(symbol, tf, data.last_time, binary=True):
+                data.merge(chunk)
+        return data
+
+    # 取得したレートをキャッシュにマージして返す（Tk のスレッドで呼ぶ）
+    # 取得したデータの先頭時刻以降を置き換える（同一時刻でも内容が更新されている可能性があるため）
+    # マージしたデータはディスクにも保存する
+    def merge_rates(symbol, tf, data):
+        cached = cached_data.merge(f"{symbol}_{tf}", data)
+        store.save(symbol, tf, data)
+        return cached
+
+    # キャッシュのシリーズを返す（なければディスクから読み込む。ディスクにもなければ None）
+    def load_series(symbol, tf):
+        cache_key = f"{symbol}_{tf}"
+        cached = cached_data.get(cache_key)
+        if cached is None:
+            stored = store.load(symbol, tf, required_candle_count)
+            if stored:
+                cached = cached_data.put(cache_key, stored)
+        return cached or None
+
+    # 初回データを読み込む（ディスクにあればそれを表示し、差分はウィンドウの表示後に取得する）
+    # ディスクになければサーバから取得（ウィンドウの表示前なので完了を待つ）
+    initial = load_series(symbol, timeframe)
+    from_store = initial is not None
+    if not from_store:
+        initial = merge_rates(symbol, timeframe,
+                              io_loop.submit(get_rates_func(symbol, timeframe, required_candle_count)).result())
+    rates = initial.tail(required_candle_count) # 表示用だけでなく移動平均用の期間も含める
+    cached_data.pinned = f"{symbol}_{timeframe}"
 
     # メインウィンドウの設定
     root = tk.Tk()
@@ -116,6 +187,10 @@ def main():
     rate_display_label = tk.Label(root, text="", font=font, bg='white', anchor="e")
     rate_display_label.place(x=info_width, y=5, width=rate_display_width)
 
+    # --- 読み込み中の表示（情報エリアの下） ---
+    loading_label = tk.Label(info_frame, text="", anchor="w", font=font, bg='white')
+    loading_label.place(x=5, y=5 + 8 * 14)
+
     root.withdraw()
     root.update()
     root.deiconify()
@@ -130,7 +205,8 @@ def main():
         chart_x=x_pos + info_width + rate_display_width, chart_y=y_pos,
         chart_width=chart_width, chart_height=height, candle_display_count=candle_count,
         width=chart_width, height=height, bg='white', highlightthickness=0,
-        format_func=fmt, symbol_entry=symbol_entry
+        format_func=fmt, symbol_entry=symbol_entry, live_update_queue=live_updates,
+        indicator_set=indicator_set
     )
     chart.place(x=info_width + rate_display_width, y=0)
 
@@ -149,35 +225,85 @@ def main():
     )
     rate_control_canvas.place(x=info_width + rate_display_width + chart_width, y=0)
 
-    # --- 通貨切替処理 ---
-    def switch_symbol(new_short):
+    # 取得結果を Tk のスレッドで受け取る
+    io_loop.attach(root)
+
+    # 次に切り替えそうなシリーズの先読み（表示の読み込みが終わるたびに始め、切り替えの開始でキャンセル）
+    prefetcher = Prefetcher(io_loop, lambda s, tf: get_rates_func(s, tf, required_candle_count), merge_rates,
+                            TIMEFRAME_KEYS)
+
+    # 最後に要求した表示（シンボル, 略称, 時間足）。取得中に続けて切り替えた場合はこちらを基準にする
+    requested = [symbol, symbol_short, timeframe]
+
+    # --- 読み込み中表示の切り替え ---
+    def set_loading(loading):
+        loading_label.config(text="Loading..." if loading else "")
+
+    # --- 表示するシンボル×時間足の切り替え ---
+    # キャッシュ（なければディスク）にあれば先に表示し、差分（なければ全体）の取得はバックグラウンドで行って完了後に反映する
+    # 取得中に再度切り替えた場合は前の取得をキャンセルし、最後に要求したものだけを表示する
+    def load_view(new_symbol, new_symbol_short, new_timeframe):
+        requested[:] = [new_symbol, new_symbol_short, new_timeframe]
+        prefetcher.record(new_symbol, new_timeframe)
+        cached = load_series(new_symbol, new_timeframe)
+        if cached is not None:
+            show_view(new_symbol, new_symbol_short, new_timeframe, cached, subscribe=False)
+
+        def on_loaded(data):
+            set_loading(False)
+            cached = merge_rates(new_symbol, new_timeframe, data)
+            if cached:
+                show_view(new_symbol, new_symbol_short, new_timeframe, cached)
+            prefetcher.loaded(new_symbol, new_timeframe)
+
+        def on_error(error):
+            set_loading(False)
+            print(f"[Load] {new_symbol} {new_timeframe}: {error}")
+
+        set_loading(True)
+        io_loop.submit(get_rates_func(new_symbol, new_timeframe, required_candle_count),
+                       on_loaded, on_error, key="view")
+
+    # --- シンボル×時間足をチャートと情報ラベルに反映 ---
+    # subscribe=False の場合は購読を切り替えない（ディスクから読んだ古いデータの後ろに購読の更新が入らないよう、差分の取得後に購読する）
+    def show_view(new_symbol, new_symbol_short, new_timeframe, cached, subscribe=True):
         nonlocal symbol, symbol_short, rates
-        mapped = SYMBOL_MAP.get(new_short.upper())
-        if not mapped:
-            return
-        symbol = mapped
-        symbol_short = new_short.upper()
-        fmt = get_format_func(symbol_short)
-
-        cache_key = f"{symbol}_{chart.timeframe}"
-        if cache_key not in cached_data:
-            cached_data[cache_key] = fetch_rates_sync(symbol, chart.timeframe, required_candle_count)
-        rates = cached_data[cache_key][-required_candle_count:]
-
-        chart.rates = rates
+        symbol_changed = new_symbol != symbol
+        symbol = new_symbol
+        symbol_short = new_symbol_short
+        rates = cached.tail(required_candle_count)
+        cached_data.pinned = f"{symbol}_{new_timeframe}"  # 表示中のシリーズはキャッシュから捨てない
         chart.symbol_short = symbol_short
-        chart.format_func = fmt
-
-        # --- 古い移動平均線を削除 ---
-        for line_id in chart.ma_lines:
-            chart.delete(line_id)
-        chart.ma_lines.clear()
 
         # ラインの反映
-        chart.apply_line_data_to_chart(symbol)
+        if symbol_changed:
+            chart.apply_line_data_to_chart(symbol)
 
         # チャートのリフレッシュ
-        chart.refresh_chart()
+        show_rates(rates, new_timeframe)
+
+        # 新しい通貨ペア・時間足を購読
+        if subscribe and subscribed_view[0] != (symbol, new_timeframe):
+            start_subscription(symbol, new_timeframe)
+
+    # --- 指標の設定の反映 ---
+    # 必要な本数が増えた場合は、表示中のシリーズを必要な本数まで取得し直す
+    def apply_indicators(specs):
+        nonlocal required_candle_count
+        chart.set_indicators(specs)
+        required = candle_count + indicator_set.lookback()
+        if required <= required_candle_count:
+            return
+        required_candle_count = required
+        cached_data.max_length = required_candle_count + cache_margin_bars
+        load_view(*requested)
+
+    # --- 通貨切替処理 ---
+    def switch_symbol(new_short):
+        mapped = SYMBOL_MAP.get(new_short.upper())
+        if not mapped:
+            return
+        load_view(mapped, new_short.upper(), requested[2])
 
     # マウス操作イベントをバインド
     bind_drag_events(rate_control_canvas, chart, rate_display_label, height, info_width, rate_display_width)
@@ -197,27 +323,6 @@ def main():
     drag_area.bind("<B1-Motion>", on_drag)
     drag_area.bind("<ButtonRelease-1>", on_release)
 
-    # キャッシュに追記する get_rates_func（差分取得対応）
-    async def get_rates_func(symbol, tf, count):
-        cache_key = f"{symbol}_{tf}" # キャッシュキーを通貨ペア(symbol)とタイムフレーム(tf)で作成
-        # キャッシュに該当データがない場合、サーバから新規に取得してキャッシュに格納
-        if cache_key not in cached_data:
-            cached_data[cache_key] = await client.request_rates(symbol, tf, count)
-        else:
-            # キャッシュの最新データの時刻を取得
-            last_time = cached_data[cache_key][-1]["time"]
-            # 最新時刻以降のデータを100件取得（過去の更新を含める可能性も考慮）
-            new_data = await client.request_rates(symbol, tf, count=100, from_time=last_time)
-            if new_data:
-                # 新しいデータの中で、last_time以降のデータのみを抽出（重複防止）
-                updated = [d for d in new_data if d["time"] >= last_time]
-                if updated:
-                     # 既存の最後のデータを新しいデータで置き換え（同一時刻でも内容が更新されている可能性があるため）
-                    cached_data[cache_key][-1] = updated[0]
-                    # 残りの新規データをキャッシュに追加
-                    cached_data[cache_key].extend(updated[1:])
-        return cached_data[cache_key]
-
     # --- EnterとSpaceでの通貨入力・表示切替対応 ---
     def on_key_custom(event):
         if event.keysym == "space":
@@ -235,13 +340,16 @@ def main():
             else:
                 chart.toggle_chart_visibility()
 
-    # --- カスタムキーバインド（元の bind_key_events の内容含む） ---
-    async def update_timeframe(new_timeframe):
+    # --- レートをチャートと情報ラベルに反映 ---
+    # live=True は購読の更新（同じシンボル×時間足）で、チャートは変わったロウソク足だけを描き直す
+    def show_rates(new_rates, new_timeframe, live=False):
         nonlocal fmt
-        new_rates = await get_rates_func(symbol, new_timeframe, required_candle_count)
         fmt = get_format_func(symbol_short)  # 通貨ペアに対応する桁数を再取得   
         chart.format_func = fmt # チャートにも反映
-        chart.update_rates(new_rates, new_timeframe)
+        if live:
+            chart.update_live_rates(new_rates)
+        else:
+            chart.update_rates(new_rates, new_timeframe)
         latest = new_rates[-1]
         dt = datetime.fromtimestamp(latest["time"], tz=timezone.utc)
         time_str = dt.strftime("%Y.%m.%d %H:%M")
@@ -254,10 +362,46 @@ def main():
         ]
         for i, val in enumerate(updated_values):
             info_labels[i].config(text=val)
+
+    # --- カスタムキーバインド（元の bind_key_events の内容含む） ---
+    def update_timeframe(new_timeframe):
+        load_view(requested[0], requested[1], new_timeframe)
         root.focus_force()
-    
-    # ここでchart.update_funcにupdate_timeframeの処理を設定
-    chart.update_func = update_timeframe
+
+    # ティックを表示中の最後のロウソク足に反映（bid を終値とし、高値・安値を広げる）
+    # ティックが次のバーの時刻に入った場合は、バーの購読で新しいバーが届くのを待つ
+    def apply_tick(tick):
+        cached = cached_data.peek(f"{symbol}_{chart.timeframe}")
+        if not cached:
+            return
+        last = cached[-1]
+        if int(bucket_start([tick["time"]], chart.timeframe)[0]) != last["time"]:
+            return
+        bid = tick["bid"]
+        cached.replace_last(dict(last, close=bid, high=max(last["high"], bid), low=min(last["low"], bid)))
+        show_rates(cached.tail(required_candle_count), chart.timeframe, live=True)
+
+    # 購読で届いた更新をキャッシュにマージし、表示中であればチャートに反映
+    def apply_live_update(upd_symbol, upd_timeframe, data):
+        if upd_timeframe == "TICK":
+            if upd_symbol == symbol:
+                apply_tick(data)
+            return
+        if not data or f"{upd_symbol}_{upd_timeframe}" not in cached_data:
+            return
+        # 更新の先頭時刻以降を置き換える（形成中のバーの更新＋新しいバー）
+        cached = merge_rates(upd_symbol, upd_timeframe, data)
+        if upd_symbol == symbol and upd_timeframe == chart.timeframe:
+            show_rates(cached.tail(required_candle_count), upd_timeframe, live=True)
+
+    # ここでchart.update_funcに購読更新の反映処理を設定
+    chart.update_func = apply_live_update
+    if from_store:
+        load_view(symbol, symbol_short, timeframe)  # ディスクから表示した分の差分を取得
+    else:
+        start_subscription(symbol, timeframe)
+        prefetcher.record(symbol, timeframe)
+        prefetcher.loaded(symbol, timeframe)
 
     def bind_custom_keys():
         def on_all_keys(event):
@@ -267,8 +411,8 @@ def main():
                 chart.toggle_horizontal_line_mode()
             elif key == "d":
                 chart.toggle_diagonal_line_mode()
-            elif key == "m":
-                chart.toggle_moving_averages()
+            elif key in ("m", "i"):  # m は移動平均線だけだった頃のキー
+                chart.toggle_indicators()
             elif key == "s":
                 show_settings_dialog()
             elif key == "t":
@@ -286,8 +430,6 @@ def main():
                 # 水平線が選択されている場合
                 if chart.selected_hline_index is not None:
                     idx = chart.selected_hline_index
-                    chart.delete(chart.hline_ids[idx])      # 線削除
-                    del chart.hline_ids[idx]
                     del chart.hline_data[symbol][idx]
                     # スタイルも削除
                     chart.hline_styles = {
@@ -297,13 +439,12 @@ def main():
                     }
                     chart.hide_hline_handles()
                     chart.selected_hline_index = None
+                    chart.redraw_horizontal_lines()  # 線削除
                     chart.update_line_data_cache(symbol)
 
                 # 斜め線が選択されている場合
                 elif chart.selected_diagonal_index is not None:
                     idx = chart.selected_diagonal_index
-                    chart.delete(chart.diagonal_line_ids[idx])  # 線削除
-                    del chart.diagonal_line_ids[idx]
                     del chart.diagonal_data[idx]
                     # スタイルも削除
                     chart.diagonal_styles = {
@@ -313,12 +454,12 @@ def main():
                     }
                     chart.hide_diagonal_handles()
                     chart.selected_diagonal_index = None
+                    chart.redraw_diagonal_lines()  # 線削除
                     chart.update_line_data_cache(symbol)
             elif key in "123456789": # タイムフレームの切り替え
-                timeframes = ["M1", "M5", "M15", "M30", "H1", "H4", "D1", "W1", "MN1"]
                 idx = int(key) - 1
-                if idx < len(timeframes):
-                    asyncio.run(update_timeframe(timeframes[idx]))
+                if idx < len(TIMEFRAME_KEYS):
+                    update_timeframe(TIMEFRAME_KEYS[idx])
             elif key == "Escape": # プログラムの終了
                 on_close()
 
@@ -363,16 +504,16 @@ def main():
         #     b = tk.Button(left_frame, text=name, width=15, anchor="w", command=lambda n=name: show_content(n))
         #     b.pack(fill="x", pady=2)
 
-        # Moving Average（現在の設定を移植）
-        ma_frame = tk.Frame(right_frame)
-        content_frames["Moving Average"] = ma_frame
+        # --- Indicators（追加・削除と、期間等のパラメータ・色の設定。移動平均線も SMA として設定する） ---
+        indicator_frame = tk.Frame(right_frame)
+        content_frames["Indicators"] = indicator_frame
 
         # 他も空で構わない
         content_frames["Horizon Line"] = tk.Frame(right_frame)
         content_frames["Trend Line"] = tk.Frame(right_frame)
 
         # 左メニュー：モダン風ボタンで切替
-        menu_items = ["Moving Average", "Horizon Line", "Trend Line"]
+        menu_items = ["Indicators", "Horizon Line", "Trend Line"]
         selected_menu = tk.StringVar(value=menu_items[0])  # 選択状態の保持
 
         button_refs = {}
@@ -406,7 +547,7 @@ def main():
             btn.pack(fill="x", pady=2)
             button_refs[name] = btn
 
-        update_menu_buttons("Moving Average")  # 初期表示
+        update_menu_buttons("Indicators")  # 初期表示
 
         
         # 左側メニューを Listbox に変更
@@ -443,34 +584,76 @@ def main():
         # menu_listbox.bind("<<ListboxSelect>>", on_menu_select)
         # menu_listbox.selection_set(0)  # 初期選択
 
-        period_vars = [tk.IntVar(value=p) for p in chart.ma_periods]
-        color_vars = [tk.StringVar(value=c) for c in chart.ma_colors]
-        color_buttons = [None] * 3
-
         def choose_color(i, btn, var):
             c = colorchooser.askcolor(title="色を選択", initialcolor=var.get())
             if c[1]:
                 var.set(c[1])
                 btn.config(bg=c[1])
 
-        labels = ["短期", "中期", "長期"]
-        for i in range(3):
-            tk.Label(ma_frame, text=f"{labels[i]}期間:").grid(row=i, column=0, padx=5, pady=5)
-            tk.Spinbox(ma_frame, from_=1, to=500, textvariable=period_vars[i], width=5).grid(row=i, column=1)
-            btn = tk.Button(ma_frame, text="色", bg=color_vars[i].get(), width=6)
-            btn.config(command=lambda i=i, b=btn, v=color_vars[i]: choose_color(i, b, v))
-            btn.grid(row=i, column=2)
-            color_buttons[i] = btn
+        indicator_rows = []  # (種類, {パラメータ名: 変数}, 色の変数)
+        rows_frame = tk.Frame(indicator_frame)
+        rows_frame.pack(fill="x")
+
+        def add_indicator_row(spec):
+            params = INDICATOR_TYPES[spec["type"]].params
+            param_vars = {
+                key: (tk.DoubleVar if isinstance(default, float) else tk.IntVar)(value=spec.get(key, default))
+                for key, default in params.items()
+            }
+            indicator_rows.append((spec["type"], param_vars, tk.StringVar(value=spec.get("color", "black"))))
+
+        def remove_indicator_row(i):
+            del indicator_rows[i]
+            render_indicator_rows()
+
+        def render_indicator_rows():
+            for widget in rows_frame.winfo_children():
+                widget.destroy()
+            for row, (name, param_vars, color_var) in enumerate(indicator_rows):
+                tk.Label(rows_frame, text=name).grid(row=row, column=0, padx=5, pady=2, sticky="w")
+                column = 1
+                for key, var in param_vars.items():
+                    tk.Label(rows_frame, text=f"{key}:").grid(row=row, column=column)
+                    low, high, increment = INDICATOR_TYPES[name].param_ranges[key]
+                    # 小数のパラメータ（Bollinger の deviations）は 0.1 刻みなので小数 1 桁で表示
+                    options = {"format": "%.1f"} if isinstance(var, tk.DoubleVar) else {}
+                    tk.Spinbox(rows_frame, from_=low, to=high, increment=increment, textvariable=var, width=5,
+                               **options).grid(row=row, column=column + 1)
+                    column += 2
+                btn = tk.Button(rows_frame, text="色", bg=color_var.get(), width=6)
+                btn.config(command=lambda i=row, b=btn, v=color_var: choose_color(i, b, v))
+                btn.grid(row=row, column=5)
+                tk.Button(rows_frame, text="削除", command=lambda i=row: remove_indicator_row(i)).grid(row=row, column=6, padx=5)
+
+        for indicator in chart.indicator_set:
+            add_indicator_row(indicator.to_spec())
+        render_indicator_rows()
+
+        # 種類を選んで追加
+        add_frame = tk.Frame(indicator_frame)
+        add_frame.pack(fill="x", pady=5)
+        type_var = tk.StringVar(value=next(iter(INDICATOR_TYPES)))
+        tk.OptionMenu(add_frame, type_var, *INDICATOR_TYPES).pack(side="left", padx=5)
+        tk.Button(add_frame, text="追加",
+                  command=lambda: (add_indicator_row({"type": type_var.get()}), render_indicator_rows())).pack(side="left")
 
         # --- Horizon Line / Trend Line用の空枠（後で実装） ---
         content_frames["Horizon Line"] = tk.Frame(right_frame)
         content_frames["Trend Line"] = tk.Frame(right_frame)
 
         # --- OKボタンと表示処理 ---
+        # 入力された値を範囲内に収める（Spinbox は範囲外の値も直接入力できるため）
+        def clamp_param(name, key, var):
+            low, high, _ = INDICATOR_TYPES[name].param_ranges[key]
+            return min(max(var.get(), low), high)
+
         def apply():
-            new_periods = [v.get() for v in period_vars]
-            new_colors = [v.get() for v in color_vars]
-            chart.set_moving_average_config(new_periods, new_colors)
+            new_indicators = [
+                dict(type=name, color=color_var.get(),
+                     **{key: clamp_param(name, key, var) for key, var in param_vars.items()})
+                for name, param_vars, color_var in indicator_rows
+            ]
+            apply_indicators(new_indicators)
 
             # 保存処理
             yaml = YAML()
@@ -481,8 +664,10 @@ def main():
                     data = yaml.load(f)
             else:
                 data = {}
-            data["moving_average_periods"] = new_periods
-            data["moving_average_colors"] = new_colors
+            # 旧形式の移動平均線の設定は SMA として indicators に含めたので消す
+            data.pop("moving_average_periods", None)
+            data.pop("moving_average_colors", None)
+            data["indicators"] = new_indicators
             with open(path, "w", encoding="utf-8") as f:
                 yaml.dump(data, f)
 
@@ -492,7 +677,7 @@ def main():
         tk.Button(dialog, text="OK", command=apply).pack(pady=5)
 
         # 初期表示
-        show_content("Moving Average")
+        show_content("Indicators")
 
         # ダイアログ位置
         dialog.update_idletasks()
@@ -586,6 +771,16 @@ def main():
     # 終了時の処理
     def on_close():
         chart.save_all_line_data()
+        for task in subscription:
+            if task is not None:
+                task.cancel()
+        try:
+            io_loop.submit(client.close()).result(timeout=1)
+        except Exception:
+            pass
+        io_loop.stop()
+        store.close()
+        print(f"[Cache] {cached_data.stats()}")
         root.destroy()
 
     root.protocol("WM_DELETE_WINDOW", on_close)
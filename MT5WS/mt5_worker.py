@@ -0,0 +1,62 @@
+import asyncio
+import queue
+import threading
+import time
+
+# MetaTrader5 の API は複数スレッドから呼べないため、専用スレッド 1 本で順番に実行するワーカー
+# イベントループ側は call() を await するだけなので、MT5 の呼び出し中も他のクライアントを処理できる
+class MT5Worker:
+    def __init__(self, name="mt5-worker"):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # キューに積まれた処理を順に実行する（ワーカースレッド本体）
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            func, args, kwargs, loop, future, enqueued = item
+            started = time.perf_counter()
+            result, error = None, None
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                error = e
+            finished = time.perf_counter()
+
+            # キュー待ち時間と MT5 呼び出し時間（ミリ秒）
+            timings = {
+                "queue_ms": round((started - enqueued) * 1000, 3),
+                "mt5_ms": round((finished - started) * 1000, 3),
+            }
+            try:
+                loop.call_soon_threadsafe(self._set_result, future, result, error, timings)
+            except RuntimeError:
+                pass  # ループが既に閉じている
+
+    # イベントループ側で Future に結果を設定
+    @staticmethod
+    def _set_result(future, result, error, timings):
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result((result, timings))
+
+    # func(*args, **kwargs) をワーカースレッドで実行し、(結果, 計測時間) を返す
+    async def call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((func, args, kwargs, loop, future, time.perf_counter()))
+        return await future
+
+    # 現在キューで待っている処理の数
+    def pending(self):
+        return self._queue.qsize()
+
+    # ワーカーの停止（キュー内の処理を終えてから止まる）
+    def stop(self):
+        self._queue.put(None)
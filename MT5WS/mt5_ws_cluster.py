@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import time
+from types import SimpleNamespace
+
+import mt5_ws_server
+from data_providers import create_provider
+from shm_ring import ShmRing, RingBarCache
+
+# フェッチャーが購読中のシリーズを MT5 と突き合わせる間隔（秒）
+FETCH_INTERVAL = 0.1
+
+# シリーズごとのリングの本数（M1 は上位足の組み立てに使う本数まで）
+RING_BARS = 20000
+RING_BARS_M1 = mt5_ws_server.M1_BASE_BARS
+
+# フェッチャーへの問い合わせの応答待ち時間（秒）
+RPC_TIMEOUT = 30.0
+
+# フロントエンドから呼び出せるキャッシュ・データ取得元のメソッド
+CACHE_METHODS = ("latest", "since", "range", "range_chunk")
+PROVIDER_METHODS = ("symbol_info", "symbol_info_tick", "copy_ticks_from")
+
+logger = logging.getLogger("mt5_ws_cluster")
+
+# MT5 の名前付きタプル等をプロセス間で受け渡せる形にする
+def _plain(value):
+    if hasattr(value, "_asdict"):
+        return SimpleNamespace(**value._asdict())
+    return value
+
+# MT5 への接続を持つ唯一のプロセス
+# フロントエンドから要求されたシリーズのバーキャッシュを持ち、変化を共有メモリのリングに書き込む
+# リングにない範囲の取得やティックなどは requests キューで受け付け、replies[フロントエンド番号] に返す
+class Fetcher:
+    def __init__(self, args, requests, replies):
+        self.args = args
+        self.requests = requests
+        self.replies = replies
+        self.rings = {}    # (symbol, timeframe) → ShmRing
+        self.pending = {}  # (symbol, timeframe) → 未反映の変化の最初の時刻
+
+    # 変化の記録（同じシリーズの変化は最も古い時刻にまとめる）
+    def _note(self, key, changed_time):
+        if changed_time is not None and (key not in self.pending or changed_time < self.pending[key]):
+            self.pending[key] = changed_time
+
+    # シリーズのリングを用意（なければキャッシュを作成して全体を書き込む）
+    def open(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self.rings:
+            cache = mt5_ws_server.get_bar_cache(symbol, timeframe)
+            ring = ShmRing.create(RING_BARS_M1 if timeframe == "M1" else RING_BARS)
+            ring.publish(cache.bars, int(cache.bars["time"][0]))
+            if hasattr(cache, "listeners"):
+                cache.listeners.append(lambda t, key=key: self._note(key, t))
+            self.rings[key] = ring
+        return self.rings[key].name
+
+    # フロントエンドからの要求を処理
+    def handle(self, request):
+        kind = request[0]
+        if kind == "open":
+            return self.open(*request[1:])
+        if kind == "cache":
+            symbol, timeframe, method, args = request[1:]
+            if method not in CACHE_METHODS:
+                raise ValueError(f"Unsupported method: {method}")
+            cache = mt5_ws_server.get_bar_cache(symbol, timeframe)
+            return getattr(cache, method)(*args).copy()
+        if kind == "provider":
+            method, args = request[1:]
+            if method not in PROVIDER_METHODS:
+                raise ValueError(f"Unsupported method: {method}")
+            return _plain(getattr(mt5_ws_server.provider, method)(*args))
+        raise ValueError(f"Unknown request: {kind}")
+
+    # リングを持つシリーズを MT5 と突き合わせ、変化した部分をリングに書き込む
+    def refresh(self):
+        for key, ring in self.rings.items():
+            cache = mt5_ws_server.get_bar_cache(*key)
+            try:
+                self._note(key, cache.refresh(force=True))
+            except Exception as e:
+                logger.warning("[Fetch] %s %s: %s", key[0], key[1], e)
+        for key, changed_time in self.pending.items():
+            self.rings[key].publish(mt5_ws_server.get_bar_cache(*key).bars, changed_time)
+        self.pending.clear()
+
+    # 要求の受け付けと定期的な突き合わせを繰り返す
+    def run(self):
+        next_refresh = time.monotonic()
+        try:
+            while True:
+                try:
+                    frontend, request_id, request = self.requests.get(
+                        timeout=max(0.0, next_refresh - time.monotonic()))
+                    try:
+                        reply = ("ok", self.handle(request))
+                    except Exception as e:
+                        reply = ("error", str(e))
+                    self.replies[frontend].put((request_id,) + reply)
+                except queue.Empty:
+                    pass
+                if time.monotonic() >= next_refresh:
+                    self.refresh()
+                    next_refresh = time.monotonic() + FETCH_INTERVAL
+        finally:
+            for ring in self.rings.values():
+                ring.close()
+
+# フロントエンド側のデータ取得元
+# バーは共有メモリのリングから直接読み、それ以外はフェッチャーに問い合わせる
+# 呼び出しはフロントエンドのワーカースレッドからのみ行う（応答は順に届く）
+class RingClient:
+    def __init__(self, index, requests, replies):
+        self.index = index
+        self.requests = requests
+        self.replies = replies
+        self._ids = itertools.count()
+
+    # フェッチャーに要求を送り、応答を待つ
+    def call(self, *request):
+        request_id = next(self._ids)
+        self.requests.put((self.index, request_id, request))
+        while True:
+            reply_id, status, value = self.replies.get(timeout=RPC_TIMEOUT)
+            if reply_id != request_id:
+                continue  # タイムアウトした以前の要求への応答は捨てる
+            if status == "error":
+                raise RuntimeError(value)
+            return value
+
+    def initialize(self):
+        pass
+
+    def symbol_info(self, symbol):
+        return self.call("provider", "symbol_info", (symbol,))
+
+    def symbol_info_tick(self, symbol):
+        return self.call("provider", "symbol_info_tick", (symbol,))
+
+    def copy_ticks_from(self, symbol, date_from, count):
+        return self.call("provider", "copy_ticks_from", (symbol, date_from, count))
+
+    # mt5_ws_server.cache_factory として使う（シリーズのリングに接続したキャッシュを返す）
+    def open_cache(self, symbol, timeframe):
+        ring = ShmRing.attach(self.call("open", symbol, timeframe))
+        remote = lambda method, *args: self.call("cache", symbol, timeframe, method, args)
+        return RingBarCache(ring, symbol, timeframe, remote)
+
+# 終了要求（SIGTERM）を SystemExit に変えて、finally の後始末（共有メモリの削除等）を行えるようにする
+def exit_on_sigterm():
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+# フェッチャーのプロセス本体
+def run_fetcher(args, requests, replies):
+    exit_on_sigterm()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    mt5_ws_server.provider = create_provider(args.provider, data_dir=args.data_dir, speed=args.speed,
+                                             seed=args.seed)
+    mt5_ws_server.provider.initialize()
+    try:
+        Fetcher(args, requests, replies).run()
+    except KeyboardInterrupt:
+        pass
+
+# フロントエンドのプロセス本体（mt5_ws_server をリングから読む設定で起動）
+def run_frontend(index, args, requests, replies, reuse_port):
+    client = RingClient(index, requests, replies)
+    mt5_ws_server.cache_factory = client.open_cache
+    if not reuse_port:
+        args.port += index  # 同じポートを共有できない OS ではポートをずらす
+    if args.metrics_port:
+        args.metrics_port += index
+    try:
+        asyncio.run(mt5_ws_server.main(args, data_provider=client, reuse_port=reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+# コマンドライン引数の解析（mt5_ws_server と同じ引数＋フロントエンド数）
+def parse_args():
+    p = argparse.ArgumentParser(description="MT5 WebSocket server (1 fetcher + N front-end processes)")
+    p.add_argument("--frontends", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                   help="WebSocket を処理するプロセス数（既定: CPU 数 - 1）")
+    p.add_argument("--host", default=mt5_ws_server.HOST)
+    p.add_argument("--port", type=int, default=mt5_ws_server.PORT)
+    p.add_argument("--provider", choices=["mt5", "replay", "synthetic"], default="mt5")
+    p.add_argument("--data-dir")
+    p.add_argument("--speed", type=float, default=1.0)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--metrics-host", default=mt5_ws_server.METRICS_HOST)
+    p.add_argument("--metrics-port", type=int, default=mt5_ws_server.METRICS_PORT,
+                   help="1 つ目のフロントエンドの計測値のポート（以降は +1 ずつ。0 で無効）")
+    p.add_argument("--log-level", default="INFO")
+    p.add_argument("--log-sample-rate", type=float, default=mt5_ws_server.LOG_SAMPLE_RATE)
+    return p.parse_args()
+
+# 起動のエントリーポイント
+# フェッチャー 1 プロセスと、同じポートで待ち受けるフロントエンド複数プロセスを起動する
+# 同じポートの共有（SO_REUSEPORT）は Linux 等のみ。Windows ではフロントエンドごとに port, port+1, ... で待ち受ける
+def main():
+    args = parse_args()
+    exit_on_sigterm()
+    reuse_port = hasattr(socket, "SO_REUSEPORT")
+    ctx = multiprocessing.get_context("spawn")
+    requests = ctx.Queue()
+    replies = [ctx.Queue() for _ in range(args.frontends)]
+    processes = [ctx.Process(target=run_fetcher, args=(args, requests, replies), name="fetcher")]
+    for i in range(args.frontends):
+        processes.append(ctx.Process(target=run_frontend, args=(i, args, requests, replies[i], reuse_port),
+                                     name=f"frontend-{i}"))
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+
+if __name__ == "__main__":
+    main()
@@ -1,110 +1,672 @@
+import argparse
 import asyncio
+import base64
 import json
+import logging
+import random
+import time
+import numpy as np
 import websockets
-import MetaTrader5 as mt5
 from datetime import datetime, timezone
+from aggregator import DerivedBarCache, bucket_start
+from bar_cache import BarCache
+from client_session import ClientSession
+from data_providers import TIMEFRAMES, create_provider
+from fragment_cache import FragmentCache
+from mt5_worker import MT5Worker
+from rate_codec import encode_rates_binary, encode_batch_binary, tag_frame
+from response_cache import ResponseCache
+from server_metrics import ServerMetrics, handle_metrics_http
 
 # WebSocket サーバのホストとポート
 HOST = '0.0.0.0'
 PORT = 8765
 
-# 時間足の文字列を MT5 の定数に変換するマップ
-TIMEFRAME_MAP = {
-    "M1": mt5.TIMEFRAME_M1,
-    "M5": mt5.TIMEFRAME_M5,
-    "M15": mt5.TIMEFRAME_M15,
-    "M30": mt5.TIMEFRAME_M30,
-    "H1": mt5.TIMEFRAME_H1,
-    "H4": mt5.TIMEFRAME_H4,
-    "D1": mt5.TIMEFRAME_D1,
-    "W1": mt5.TIMEFRAME_W1,
-    "MN1": mt5.TIMEFRAME_MN1,
-}
-
-# MT5の初期化を行う
-if not mt5.initialize():
-    raise RuntimeError("MT5 initialization failed")
+# 計測値（Prometheus 形式）を返す HTTP のホストとポート（既定ではローカルからのみ）
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9765
+
+# リクエストごとのログ（DEBUG）を出力する割合（全件出すとログだけで遅くなるため抜き取る）
+LOG_SAMPLE_RATE = 0.01
+
+# M1 から組み立てる時間足（M1 でカバーできない範囲は MT5 から直接取得）
+AGGREGATED_TIMEFRAMES = ("M5", "M15", "M30", "H1", "H4", "D1", "W1", "MN1")
+
+# 上位足の元になる M1 の保持本数（約 100 日分。H4 の 450 本程度までをカバー）
+M1_BASE_BARS = 150000
+
+# 上位足の区切りをずらす秒数（MT5 のバー時刻はサーバ時間なので通常は 0）
+SESSION_OFFSET = 0
+
+# データの取得元（MT5 ターミナル / 過去データの再生 / ランダムウォーク）。main() で設定する
+provider = None
+
+# MT5 の API 呼び出しはすべてこの専用スレッドで実行する（イベントループを止めないため）
+mt5_worker = MT5Worker()
+
+# シンボル×時間足ごとのバーキャッシュ（ワーカースレッドからのみ触る）
+bar_caches = {}
+
+# シンボルごとの小数点桁数（価格を整数化して送る場合に使用）
+symbol_digits = {}
+
+# 購読中のシンボル×時間足で、まだ配信していない変化の最初の時刻（(symbol, timeframe) → 時刻）
+# 通常のリクエストの refresh() で取り込まれた変化も、キャッシュの listeners 経由でここに残る（ワーカースレッドからのみ触る）
+pending_changes = {}
+
+# シリアライズ済みレスポンスのキャッシュ（同時リクエストの集約も行う）
+response_cache = ResponseCache()
+
+# バー 1 本ごとの JSON 文字列のキャッシュ（変化のないバーはエンコードし直さない）
+fragment_cache = FragmentCache()
+
+# 段階ごとの処理時間・リクエスト数・送信バイト数などの計測値（"stats" メッセージと /metrics で取り出す）
+metrics = ServerMetrics()
+
+logger = logging.getLogger("mt5_ws_server")
+log_sample_rate = LOG_SAMPLE_RATE
+
+# リクエスト単位のログを抜き取りで出力
+def log_sampled(msg, *args):
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < log_sample_rate:
+        logger.debug(msg, *args)
+
+# データ取得元からバーキャッシュを作成（ワーカースレッドで実行）
+def create_bar_cache(symbol, timeframe_str):
+    if timeframe_str in AGGREGATED_TIMEFRAMES:
+        # 時間足ごとに MT5 へ問い合わせず、M1 のキャッシュから組み立てる
+        base = get_bar_cache(symbol, "M1")
+        return DerivedBarCache(base, timeframe_str, lambda: BarCache(provider, symbol, timeframe_str),
+                               session_offset=SESSION_OFFSET)
+    if timeframe_str == "M1":
+        return BarCache(provider, symbol, timeframe_str, initial_bars=M1_BASE_BARS)
+    return BarCache(provider, symbol, timeframe_str)
+
+# バーキャッシュの作成関数（複数プロセス構成のフロントエンドでは共有メモリのリングを読むものに差し替える）
+cache_factory = create_bar_cache
+
+# バーキャッシュを取得（なければ初回ロードして作成）
+# ワーカースレッドで実行すること
+def get_bar_cache(symbol, timeframe_str):
+    key = (symbol, timeframe_str)
+    cache = bar_caches.get(key)
+    if cache is None:
+        cache = cache_factory(symbol, timeframe_str)
+        cache.refresh()  # 取得できないシンボルは登録しない
+        cache.listeners.append(lambda changed_time: note_change(key, changed_time))
+        # マージのたびに（購読の有無に関係なく）変化したバーを含むシリアライズ済みのレスポンスを破棄
+        # M1 から組み立てる上位足は、組み直しを待たずに M1 が変わった時点で、そのバーを含む上位足のバー以降を破棄する
+        if isinstance(cache, DerivedBarCache):
+            cache.base.listeners.append(lambda changed_time: response_cache.invalidate(
+                symbol, timeframe_str, int(bucket_start([changed_time], timeframe_str, cache.session_offset)[0])))
+        else:
+            cache.listeners.append(lambda changed_time: response_cache.invalidate(symbol, timeframe_str, changed_time))
+        if symbol not in symbol_digits:
+            info = provider.symbol_info(symbol)
+            if info is not None:
+                symbol_digits[symbol] = info.digits
+        bar_caches[key] = cache
+    return cache
+
+# 計測値のラベルにするシンボル・時間足（クライアントの入力のままだと種類が際限なく増えるため）
+# 有効な時間足でキャッシュのあるシンボルだけをそのまま使い、それ以外は "_other" にまとめる
+def metric_labels(symbol, timeframe):
+    if not symbol and not timeframe:
+        return "", ""
+    if timeframe in TIMEFRAMES and (symbol, timeframe) in bar_caches:
+        return symbol, timeframe
+    if not timeframe and symbol in symbol_digits:
+        return symbol, ""  # ティックのリクエスト
+    return "_other", "_other"
+
+# キャッシュからレートを取り出す（ワーカースレッドで実行）
+# バッファはワーカー側で更新されるため、返す配列はコピーにする
+def read_rates(symbol, timeframe_str, count, from_time=None):
+    cache = get_bar_cache(symbol, timeframe_str)
+    if from_time:
+        # from_time は UTC 時間（UNIX秒）として渡される
+        return cache.since(int(from_time), count).copy()
+    # from_time が指定されていない場合は最新から count 件取得
+    return cache.latest(count).copy()
 
 # クライアントからのリクエストに基づいてレートデータを取得する非同期関数
-# from_time が指定された場合、その時刻以降のレートを取得
+# from_time が指定された場合、その時刻以降のレートをキャッシュから二分探索で取得
+# MT5 へのアクセスはワーカースレッドで行い、キュー待ちと MT5 呼び出しの時間を timings に入れて返す
 async def get_rates(symbol, timeframe_str, count, from_time=None):
-    timeframe = TIMEFRAME_MAP.get(timeframe_str.upper())
-    if timeframe is None:
+    if timeframe_str not in TIMEFRAMES:
         return {"error": f"Invalid timeframe: {timeframe_str}"}
 
-    if from_time:
-        try:
-            # from_time はすでに UTC 時間（UNIX秒）として渡されるため、再度の補正を避ける
-            utc_from = datetime.fromtimestamp(int(from_time), tz=timezone.utc)
-             # 最新データから多めに取得し、from_time 以降のインデックスを探す
-            recent_data = mt5.copy_rates_from_pos(symbol, timeframe, 0, 5000)
-            if recent_data is None or len(recent_data) == 0:
-                return {"error": f"No data found for {symbol}"}
-
-            # from_time 以降の最初のバーインデックスを検索
-            start_index = next((i for i, r in enumerate(recent_data) if r['time'] >= int(from_time)), None)
-            if start_index is None:
-                return {"error": "No data available after specified from_time"}
-
-            # そのインデックスからcount件取得（必要なら再取得）
-            rates = recent_data[start_index:start_index + count]
-            # rates = mt5.copy_rates_from(symbol, timeframe, utc_from, count)
-        except Exception as e:
-            return {"error": str(e)}
-    else:
-        # from_time が指定されていない場合は最新から count 件取得
-        rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, count)
-
-    if rates is None:
-        return {"error": f"Failed to get rates for {symbol} with timeframe {timeframe_str}"}
-
-    # numpy 型を通常の Python 型に変換
-    rates_list = []
-    for row in rates:
-        rates_list.append({
-            "time": int(row["time"]),
-            "open": float(row["open"]),
-            "high": float(row["high"]),
-            "low": float(row["low"]),
-            "close": float(row["close"]),
-            "tick_volume": int(row["tick_volume"]),
-            "spread": int(row["spread"]),
-            "real_volume": int(row["real_volume"]),
-        })
+    try:
+        rates, timings = await mt5_worker.call(read_rates, symbol, timeframe_str, count, from_time)
+    except Exception as e:
+        return {"error": str(e)}
 
+    if from_time and len(rates) == 0:
+        return {"error": "No data available after specified from_time"}
+
+    # data には numpy の構造化配列をそのまま入れ、変換は送信形式に合わせて serialize_response で行う
     return {
         "type": "rates",
         "symbol": symbol,
         "timeframe": timeframe_str,
         "count": count,
-        "data": rates_list
+        "timings": timings,
+        "data": rates
     }
 
+# シンボルの小数点桁数を取得（キャッシュ作成時に取得済みの値を使う）
+def get_digits(symbol):
+    digits = symbol_digits.get(symbol)
+    if digits is None:
+        raise ValueError(f"Unknown symbol: {symbol}")
+    return digits
+
+# レスポンスを送信形式に変換する
+# fmt="binary" の場合は列ごとのバイナリフレーム、それ以外は従来どおり JSON 文字列
+# JSON はバーごとの文字列を FragmentCache から取り出して連結する（data は最後のキーとして付ける）
+def serialize_response(data, fmt="json", scaled=False):
+    if "error" in data:
+        return json.dumps(data)
+
+    header = {k: v for k, v in data.items() if k != "data"}
+    if fmt == "binary":
+        digits = get_digits(data["symbol"]) if scaled else None
+        return encode_rates_binary(header, data["data"], digits)
+
+    rows = fragment_cache.json_texts(data["symbol"], data["timeframe"], data["data"])
+    return json.dumps(header)[:-1] + ', "data": [' + ", ".join(rows) + "]}"
+
+# レートのレスポンスを生成（MT5 から取得してシリアライズ）
+# ResponseCache に渡すため (レスポンス, キャッシュしてよいか, 範囲の最後のバーの時刻) を返す
+# from_time 指定で count 本そろっている場合だけ、範囲より後の変化ではレスポンスが変わらないので最後の時刻を返す
+async def build_rates_response(symbol, timeframe, count, from_time, fmt, scaled):
+    data = await get_rates(symbol, timeframe, count, from_time)
+    started = time.perf_counter()
+    response = serialize_response(data, fmt, scaled)
+    labels = metric_labels(symbol, timeframe)
+    metrics.observe("serialize", (time.perf_counter() - started) * 1000, *labels)
+    if "timings" in data:
+        metrics.observe("queue", data["timings"]["queue_ms"], *labels)
+        metrics.observe("fetch", data["timings"]["mt5_ms"], *labels)
+        log_sampled("[Timing] %s %s queue=%sms mt5=%sms",
+                    symbol, timeframe, data["timings"]["queue_ms"], data["timings"]["mt5_ms"])
+    if "error" in data:
+        return response, False, None
+    rates = data["data"]
+    last_time = int(rates["time"][-1]) if from_time and len(rates) >= count else None
+    return response, True, last_time
+
+# リクエスト 1 件分のレスポンスを取得（同じ内容のリクエストは 1 回の取得・シリアライズにまとめる）
+async def get_rates_response(symbol, timeframe, count, from_time, fmt, scaled):
+    key = (symbol, timeframe, count, from_time, fmt, scaled)
+    return await response_cache.get(
+        key, lambda: build_rates_response(symbol, timeframe, count, from_time, fmt, scaled))
+
+# バッチリクエストの処理
+# requests の各エントリ（symbol, timeframe, count, from_time, 任意の id）を並行に取得し、1 フレームで返す
+# 結果のキーは id、なければ "SYMBOL_TIMEFRAME"
+async def handle_batch(request):
+    fmt = request.get("format", "json")
+    scaled = bool(request.get("scaled", False))
+    entries = request.get("requests")
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("Missing 'requests'")
+
+    keys = []
+    tasks = []
+    for entry in entries:
+        symbol = entry.get("symbol")
+        timeframe = entry.get("timeframe")
+        if not symbol or not timeframe:
+            raise ValueError("Missing 'symbol' or 'timeframe' in batch entry")
+        symbol = symbol.upper()
+        timeframe = timeframe.upper()
+        keys.append(str(entry.get("id") or f"{symbol}_{timeframe}"))
+        tasks.append(get_rates_response(symbol, timeframe, int(entry.get("count", 100)),
+                                        entry.get("from_time"), fmt, scaled))
+    responses = await asyncio.gather(*tasks)
+
+    if fmt == "binary":
+        return encode_batch_binary(list(zip(keys, responses)))
+    # シリアライズ済みの JSON をそのまま連結して再エンコードを避ける
+    body = ", ".join(f"{json.dumps(key)}: {response}" for key, response in zip(keys, responses))
+    return '{"type": "batch", "results": {' + body + '}}'
+
+# 範囲リクエストの 1 チャンクの本数（既定値と上限）
+RANGE_CHUNK_BARS = 5000
+MAX_RANGE_CHUNK_BARS = 50000
+
+# 終了時刻の指定がない範囲の最初の取得に使う十分先の時刻
+OPEN_END = 2 ** 62
+
+# 続きを取得するためのトークン（シンボル・時間足・次の開始時刻・終了時刻）を作成
+def encode_cursor(symbol, timeframe, from_time, to_time):
+    raw = f"{symbol}|{timeframe}|{from_time}|{to_time}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+# トークンを (シンボル, 時間足, 開始時刻, 終了時刻) に戻す
+def decode_cursor(cursor):
+    try:
+        symbol, timeframe, from_time, to_time = base64.urlsafe_b64decode(cursor).decode("utf-8").split("|")
+        return symbol, timeframe, int(from_time), int(to_time)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+# 範囲の先頭から最大 limit 本を取り出す（ワーカースレッドで実行）
+# 終了時刻の指定がない場合に使うため、キャッシュの最新バーの時刻も返す
+def read_range_chunk(symbol, timeframe_str, from_time, to_time, limit):
+    cache = get_bar_cache(symbol, timeframe_str)
+    chunk = cache.range_chunk(from_time, to_time, limit).copy()
+    return chunk, cache.last_time
+
+# 範囲リクエスト（from_time〜to_time）をチャンクに分けて順に送る
+# 各チャンクは type="chunk" のレスポンスで、seq・done と、続きを取得するための cursor を持つ
+# 接続が切れた場合は、最後に受け取った cursor を付けて送り直せば続きから再開できる
+# 各チャンクは実際に送信し終えてから次を読み込むので、保持するのは 1 ストリームにつき 1 チャンクだけ
+async def stream_range(session, request):
+    fmt = request.get("format", "json")
+    scaled = bool(request.get("scaled", False))
+    limit = max(1, min(int(request.get("chunk_size", RANGE_CHUNK_BARS)), MAX_RANGE_CHUNK_BARS))
+    if request.get("cursor"):
+        symbol, timeframe, from_time, to_time = decode_cursor(request["cursor"])
+    else:
+        symbol = request.get("symbol")
+        timeframe = request.get("timeframe")
+        if not symbol or not timeframe or not request.get("from_time"):
+            raise ValueError("Missing 'symbol', 'timeframe' or 'from_time'")
+        symbol = symbol.upper()
+        timeframe = timeframe.upper()
+        from_time = int(request["from_time"])
+        to_time = int(request["to_time"]) if request.get("to_time") else None
+    if timeframe not in TIMEFRAMES:
+        raise ValueError(f"Invalid timeframe: {timeframe}")
+
+    seq = 0
+    while True:
+        (chunk, latest), timings = await mt5_worker.call(
+            read_range_chunk, symbol, timeframe, from_time, OPEN_END if to_time is None else to_time, limit)
+        if to_time is None:
+            to_time = latest  # 終了時刻の指定がなければ開始時点の最新バーまで
+        labels = metric_labels(symbol, timeframe)
+        metrics.observe("queue", timings["queue_ms"], *labels)
+        metrics.observe("fetch", timings["mt5_ms"], *labels)
+        done = len(chunk) < limit or int(chunk["time"][-1]) >= to_time
+        next_from = int(chunk["time"][-1]) + 1 if len(chunk) else from_time
+        data = {
+            "type": "chunk",
+            "symbol": symbol,
+            "timeframe": timeframe,
+            "seq": seq,
+            "done": done,
+            "cursor": None if done else encode_cursor(symbol, timeframe, next_from, to_time),
+            "data": chunk,
+        }
+        started = time.perf_counter()
+        response = serialize_response(data, fmt, scaled)
+        metrics.observe("serialize", (time.perf_counter() - started) * 1000, *labels)
+        if request.get("id") is not None:
+            response = tag_response(response, request["id"])
+        await session.send(response, *labels, wait=True)
+        if done or session.closed:
+            return
+        from_time = next_from
+        seq += 1
+
+# 購読の監視間隔（秒）。この間隔で MT5 を確認し、変化があった時だけ配信する
+SUBSCRIPTION_POLL_INTERVAL = 0.25
+
+# ティックの監視間隔（秒）
+TICK_POLL_INTERVAL = 0.05
+
+# 1 回の "ticks" リクエストで返すティック数の上限
+MAX_TICKS = 10000
+
+# ティック関連のメッセージの種類
+TICK_MESSAGES = ("ticks", "subscribe_ticks", "unsubscribe_ticks")
+
+# 購読中のクライアント（(symbol, timeframe) → {ClientSession: (format, scaled)}）
+subscriptions = {}
+
+# ティックを購読中のクライアント（symbol → {ClientSession}）と、最後に配信したティック
+tick_subscriptions = {}
+last_ticks = {}
+
+# 購読の登録
+async def subscribe(session, symbol, timeframe_str, fmt="json", scaled=False):
+    if timeframe_str not in TIMEFRAMES:
+        raise ValueError(f"Invalid timeframe: {timeframe_str}")
+    await mt5_worker.call(get_bar_cache, symbol, timeframe_str)  # 無効なシンボルはここでエラー
+    subscriptions.setdefault((symbol, timeframe_str), {})[session] = (fmt, scaled)
+
+# 購読の解除（セッションの全購読を解除する場合は symbol を省略）
+def unsubscribe(session, symbol=None, timeframe_str=None):
+    for key in list(subscriptions):
+        if symbol is not None and key != (symbol, timeframe_str):
+            continue
+        subscriptions[key].pop(session, None)
+        if not subscriptions[key]:
+            del subscriptions[key]
+
+# ティック購読の登録
+async def subscribe_ticks(session, symbol):
+    tick, _ = await mt5_worker.call(provider.symbol_info_tick, symbol)
+    if tick is None:
+        raise ValueError(f"Unknown symbol: {symbol}")
+    tick_subscriptions.setdefault(symbol, set()).add(session)
+
+# ティック購読の解除（セッションの全購読を解除する場合は symbol を省略）
+def unsubscribe_ticks(session, symbol=None):
+    for key in list(tick_subscriptions):
+        if symbol is not None and key != symbol:
+            continue
+        tick_subscriptions[key].discard(session)
+        if not tick_subscriptions[key]:
+            del tick_subscriptions[key]
+            last_ticks.pop(key, None)
+
+# キャッシュの変更通知（ワーカースレッドで呼ばれる）。購読中なら未配信の変化の最初の時刻を更新する
+def note_change(key, changed_time):
+    if key not in subscriptions:
+        return
+    pending = pending_changes.get(key)
+    if pending is None or changed_time < pending:
+        pending_changes[key] = changed_time
+
+# 購読中のバーの変化を確認し、前回の配信以降に変化した最初のバー以降を返す（ワーカースレッドで実行）
+# 変化は refresh() の戻り値ではなく pending_changes から取り出す（間のリクエストで取り込まれた変化も配信するため）
+def poll_changes(symbol, timeframe_str):
+    key = (symbol, timeframe_str)
+    cache = get_bar_cache(symbol, timeframe_str)
+    cache.refresh(force=True)
+    changed_time = pending_changes.pop(key, None)
+    if changed_time is None:
+        return None
+    return cache.since(changed_time, len(cache)).copy()
+
+# 未送信のバーの更新に新しい更新をまとめる（新しい更新の先頭時刻より前の部分だけを残す）
+def merge_updates(pending, update):
+    data = pending["data"]
+    kept = data[data["time"] < update["data"]["time"][0]] if len(update["data"]) else data
+    merged = dict(update)
+    merged["data"] = np.concatenate([kept, update["data"]])
+    return merged
+
+# 購読中のシンボル×時間足を監視し、最後のバーの変化や新しいバーの発生時のみ配信する
+# 配信は各クライアントの送信待ちに入れるだけなので、遅いクライアントがいても他は待たされない
+async def watch_subscriptions():
+    while True:
+        await asyncio.sleep(SUBSCRIPTION_POLL_INTERVAL)
+        response_cache.purge()
+        for key, subscribers in list(subscriptions.items()):
+            symbol, timeframe_str = key
+            try:
+                changed, _ = await mt5_worker.call(poll_changes, symbol, timeframe_str)
+                if changed is None:
+                    continue
+                # 変化した最初のバー以降を送る（クライアントは同時刻以降を置き換える）
+                update = {
+                    "type": "update",
+                    "symbol": symbol,
+                    "timeframe": timeframe_str,
+                    "data": changed,
+                }
+            except Exception as e:
+                logger.warning("[Subscription] %s %s: %s", symbol, timeframe_str, e)
+                continue
+
+            # 同じ形式の購読者には同じエンコード結果を使い回す
+            encoded = {}
+            for session, options in list(subscribers.items()):
+                if options not in encoded:
+                    encoded[options] = serialize_response(update, *options)
+                session.push(("bars",) + key, update, encoded[options],
+                             lambda message, o=options: serialize_response(message, *o), merge_updates)
+
+# 最新ティックを取得（ワーカースレッドで実行）
+def read_tick(symbol):
+    tick = provider.symbol_info_tick(symbol)
+    if tick is None:
+        return None
+    return {"type": "tick", "symbol": symbol, "time": int(tick.time), "time_msc": int(tick.time_msc),
+            "bid": float(tick.bid), "ask": float(tick.ask), "last": float(tick.last),
+            "volume": int(tick.volume)}
+
+# ティックを購読中のシンボルを監視し、bid/ask が変わった時だけ配信する
+# 送信が追いつかないクライアントには最新のティックだけが届く
+async def watch_ticks():
+    while True:
+        await asyncio.sleep(TICK_POLL_INTERVAL)
+        for symbol, subscribers in list(tick_subscriptions.items()):
+            try:
+                tick, _ = await mt5_worker.call(read_tick, symbol)
+            except Exception as e:
+                logger.warning("[Tick] %s: %s", symbol, e)
+                continue
+            if tick is None:
+                continue
+            state = (tick["time_msc"], tick["bid"], tick["ask"])
+            previous = last_ticks.get(symbol)
+            if previous is not None and previous[1:] == state[1:]:
+                continue
+            last_ticks[symbol] = state
+            encoded = json.dumps(tick)
+            for session in list(subscribers):
+                session.push(("tick", symbol), tick, encoded, json.dumps)
+
+# from_time 以降のティックを取得（ワーカースレッドで実行）
+def read_ticks(symbol, from_time, count):
+    ticks = provider.copy_ticks_from(symbol, datetime.fromtimestamp(int(from_time), tz=timezone.utc), count)
+    if ticks is None:
+        raise ValueError(f"Unknown symbol: {symbol}")
+    return [{"time": int(t["time"]), "time_msc": int(t["time_msc"]), "bid": float(t["bid"]),
+             "ask": float(t["ask"]), "last": float(t["last"]), "volume": int(t["volume"])} for t in ticks]
+
+# ティックのリクエスト（ticks / subscribe_ticks / unsubscribe_ticks）の処理
+async def handle_tick_request(session, msg_type, symbol, request):
+    if msg_type == "subscribe_ticks":
+        await subscribe_ticks(session, symbol)
+        return json.dumps({"type": "subscribed_ticks", "symbol": symbol})
+    if msg_type == "unsubscribe_ticks":
+        unsubscribe_ticks(session, symbol)
+        return json.dumps({"type": "unsubscribed_ticks", "symbol": symbol})
+    from_time = request.get("from_time")
+    if not from_time:
+        raise ValueError("Missing 'from_time'")
+    count = min(int(request.get("count", 1000)), MAX_TICKS)
+    ticks, _ = await mt5_worker.call(read_ticks, symbol, from_time, count)
+    return json.dumps({"type": "ticks", "symbol": symbol, "count": len(ticks), "data": ticks})
+
+# 単一シンボル×時間足のリクエスト（rates / subscribe / unsubscribe）の処理
+async def handle_request(session, msg_type, request):
+    symbol = request.get("symbol")
+    timeframe = request.get("timeframe")
+    count = int(request.get("count", 100))
+    from_time = request.get("from_time")  # オプション: 差分取得用の開始時刻
+    fmt = request.get("format", "json")   # オプション: "json" または "binary"
+    scaled = bool(request.get("scaled", False))  # オプション: 価格を桁数で整数化して送る
+
+    if msg_type in TICK_MESSAGES:
+        if not symbol:
+            raise ValueError("Missing 'symbol'")
+        return await handle_tick_request(session, msg_type, symbol.upper(), request)
+
+    if not symbol or not timeframe:
+        raise ValueError("Missing 'symbol' or 'timeframe'")
+    symbol = symbol.upper()
+    timeframe = timeframe.upper()
+
+    if msg_type == "subscribe":
+        await subscribe(session, symbol, timeframe, fmt, scaled)
+        return json.dumps({"type": "subscribed", "symbol": symbol, "timeframe": timeframe})
+    if msg_type == "unsubscribe":
+        unsubscribe(session, symbol, timeframe)
+        return json.dumps({"type": "unsubscribed", "symbol": symbol, "timeframe": timeframe})
+    return await get_rates_response(symbol, timeframe, count, from_time, fmt, scaled)
+
+# 計測値のラベルにするメッセージの種類（それ以外は "_other" にまとめる）
+MESSAGE_TYPES = ("rates", "batch", "range", "stats", "timings", "subscribe", "unsubscribe") + TICK_MESSAGES
+
+# 1 接続で同時に処理する ID 付きリクエストの上限
+MAX_INFLIGHT_REQUESTS = 32
+
+# リクエストの id をレスポンスに付ける（キャッシュ済みのレスポンスは書き換えず、先頭に足す）
+# JSON は先頭のキーに "id" を追加し、バイナリは ID のヘッダで包む
+def tag_response(response, request_id):
+    if isinstance(response, (bytes, bytearray)):
+        return tag_frame(response, request_id)
+    return '{"id": ' + json.dumps(request_id) + ", " + response[1:]
+
+# リクエスト 1 件の処理（応答の送信まで）
+async def process_request(session, request):
+    symbol = timeframe = msg_type = ""
+    request_id = response = None
+    try:
+        request_id = request.get("id")
+        msg_type = str(request.get("type", "rates"))
+        symbol = str(request.get("symbol") or "").upper()
+        timeframe = str(request.get("timeframe") or "").upper()
+        if msg_type == "range":
+            # チャンクは stream_range の中で送る
+            await stream_range(session, request)
+        elif msg_type == "batch":
+            response = await handle_batch(request)
+        elif msg_type == "stats":
+            response = json.dumps(metrics.snapshot(component_stats()))
+        elif msg_type == "timings":
+            # 記録した段階ごとの処理時間を返す（reset=true で記録を消去）
+            response = json.dumps({"type": "timings",
+                                   "samples": metrics.recent_samples(bool(request.get("reset")))})
+        else:
+            response = await handle_request(session, msg_type, request)
+    except Exception as e:
+        metrics.count_error((msg_type if msg_type in MESSAGE_TYPES else "_other") if msg_type else "invalid")
+        response = json.dumps({"error": str(e)})
+
+    # ラベルは処理の後に決める（初めてのシンボルもキャッシュができていればそのまま数える）
+    labels = metric_labels(symbol, timeframe)
+    metrics.count_request(msg_type if msg_type in MESSAGE_TYPES else "_other", *labels)
+    if response is None:
+        return
+    if request_id is not None:
+        response = tag_response(response, request_id)
+    await session.send(response, *labels)
+
 # WebSocket 接続ごとの処理（メッセージ受信 → レート取得 → 応答送信）
+# type が "subscribe" / "unsubscribe" の場合は購読の登録・解除、"batch" の場合は複数件をまとめて処理
+# "range" の場合は from_time〜to_time をチャンクに分けて送る（cursor で続きから再開）
+# "subscribe_ticks" / "unsubscribe_ticks" はティックの購読、"ticks" は from_time 以降のティックの取得
+# "stats" の場合は計測値の集計、"timings" の場合は段階ごとの処理時間の直近の記録を返す
+# "id" 付きのリクエストは並行に処理し、応答に同じ id を付ける（id なしは従来どおり受信順に 1 件ずつ）
+# 送信は接続ごとの ClientSession が行う
 async def handle_connection(websocket):
-    async for message in websocket:
-        print(f"[Request] {message}")
-        try:
-            request = json.loads(message)
-            symbol = request.get("symbol")
-            timeframe = request.get("timeframe")
-            count = int(request.get("count", 100))
-            from_time = request.get("from_time")  # オプション: 差分取得用の開始時刻
+    metrics.connection_opened()
+    session = ClientSession(websocket, metrics)
+    inflight = asyncio.Semaphore(MAX_INFLIGHT_REQUESTS)
+    tasks = set()
+
+    # 並行処理したリクエストの後始末
+    def finished(task):
+        tasks.discard(task)
+        inflight.release()
 
-            if not symbol or not timeframe:
-                raise ValueError("Missing 'symbol' or 'timeframe'")
+    try:
+        async for message in websocket:
+            log_sampled("[Request] %s", message)
+            try:
+                started = time.perf_counter()
+                request = json.loads(message)
+                if not isinstance(request, dict):
+                    raise ValueError("Request must be a JSON object")
+                metrics.observe("parse", (time.perf_counter() - started) * 1000)
+            except ValueError as e:
+                metrics.count_error("invalid")
+                await session.send(json.dumps({"error": str(e)}))
+                continue
+
+            if request.get("id") is None:
+                await process_request(session, request)
+                continue
+            await inflight.acquire()  # 上限に達したら受信を待たせる
+            task = asyncio.create_task(process_request(session, request))
+            tasks.add(task)
+            task.add_done_callback(finished)
+    finally:
+        for task in list(tasks):
+            task.cancel()
+        metrics.connection_closed()
+        unsubscribe(session)
+        unsubscribe_ticks(session)
+        session.close()
+
+# サーバ内の部品（レスポンスキャッシュ・ワーカー・購読）の状態
+def component_stats():
+    return {
+        "response_cache": {"hits": response_cache.hits, "misses": response_cache.misses,
+                           "coalesced": response_cache.coalesced},
+        "worker_pending": mt5_worker.pending(),
+        "bar_caches": len(bar_caches),
+        "fragments": {"reused": fragment_cache.reused, "encoded": fragment_cache.encoded},
+        "subscriptions": sum(len(s) for s in subscriptions.values()),
+        "tick_subscriptions": sum(len(s) for s in tick_subscriptions.values()),
+    }
 
-            data = await get_rates(symbol.upper(), timeframe.upper(), count, from_time)
-        except Exception as e:
-            data = {"error": str(e)}
+# /metrics で返す Prometheus 形式のテキスト
+def render_metrics():
+    stats = component_stats()
+    return metrics.prometheus_text({
+        "mt5ws_response_cache_hits_total": ("counter", "Responses served from the cache.",
+                                            stats["response_cache"]["hits"]),
+        "mt5ws_response_cache_misses_total": ("counter", "Responses built from the data source.",
+                                              stats["response_cache"]["misses"]),
+        "mt5ws_response_cache_coalesced_total": ("counter", "Requests merged into an in-flight build.",
+                                                 stats["response_cache"]["coalesced"]),
+        "mt5ws_fragments_reused_total": ("counter", "Bars served from cached JSON fragments.",
+                                         stats["fragments"]["reused"]),
+        "mt5ws_fragments_encoded_total": ("counter", "Bars encoded to JSON.", stats["fragments"]["encoded"]),
+        "mt5ws_worker_pending": ("gauge", "Calls waiting for the MT5 worker thread.", stats["worker_pending"]),
+        "mt5ws_bar_caches": ("gauge", "Symbol/timeframe bar caches held in memory.", stats["bar_caches"]),
+        "mt5ws_subscriptions": ("gauge", "Active client subscriptions.", stats["subscriptions"]),
+    })
 
-        await websocket.send(json.dumps(data))
+# コマンドライン引数の解析
+def parse_args():
+    p = argparse.ArgumentParser(description="MT5 WebSocket server")
+    p.add_argument("--host", default=HOST)
+    p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--provider", choices=["mt5", "replay", "synthetic"], default="mt5",
+                   help="データの取得元（既定: mt5）")
+    p.add_argument("--data-dir", help="replay で再生する ForexTester 形式 CSV（<SYMBOL>.csv）のフォルダ")
+    p.add_argument("--speed", type=float, default=1.0, help="replay / synthetic の再生速度（実時間の倍率）")
+    p.add_argument("--seed", type=int, default=0, help="synthetic の乱数シード")
+    p.add_argument("--metrics-host", default=METRICS_HOST)
+    p.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                   help="Prometheus 形式の計測値を返すポート（0 で無効）")
+    p.add_argument("--log-level", default="INFO", help="ログレベル（DEBUG でリクエストごとのログを抜き取り出力）")
+    p.add_argument("--log-sample-rate", type=float, default=LOG_SAMPLE_RATE,
+                   help="リクエストごとのログを出力する割合（0〜1）")
+    return p.parse_args()
 
 # サーバ起動のエントリーポイント
-async def main():
-    print(f"WebSocket server starting on ws://{HOST}:{PORT}")
-    async with websockets.serve(handle_connection, HOST, PORT):
+# data_provider を渡すとそれをデータ取得元にする。reuse_port=True で複数プロセスが同じポートで待ち受ける
+async def main(args, data_provider=None, reuse_port=False):
+    global provider, log_sample_rate
+    # websockets 自体のログは警告以上のみ（接続ごとの INFO が大量に出るため）
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    logger.setLevel(args.log_level.upper())
+    log_sample_rate = args.log_sample_rate
+    provider = data_provider or create_provider(args.provider, data_dir=args.data_dir, speed=args.speed,
+                                                seed=args.seed)
+    await mt5_worker.call(provider.initialize)
+    logger.info("WebSocket server starting on ws://%s:%s (%s)", args.host, args.port, args.provider)
+    if args.metrics_port:
+        await asyncio.start_server(lambda r, w: handle_metrics_http(r, w, render_metrics),
+                                   args.metrics_host, args.metrics_port)
+        logger.info("Metrics available on http://%s:%s/metrics", args.metrics_host, args.metrics_port)
+    watchers = [asyncio.create_task(watch_subscriptions()), asyncio.create_task(watch_ticks())]
+    async with websockets.serve(handle_connection, args.host, args.port, reuse_port=reuse_port):
         await asyncio.Future()  # 永続実行
+    for watcher in watchers:
+        watcher.cancel()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
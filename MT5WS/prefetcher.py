@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import Counter, defaultdict
+
+# 同時に行う先読みの上限
+PREFETCH_CONCURRENCY = 2
+
+# 取得してからこの秒数以内のシリーズは先読みしない
+PREFETCH_FRESH_SECONDS = 30.0
+
+# 先読みの対象にする最近使ったシンボルの数と、切り替え履歴から予測する候補の数
+RECENT_SYMBOLS = 3
+PREDICTIONS = 2
+
+# チャートの表示切り替えの先読み
+# 表示の読み込みが終わるたびに、次に切り替えそうなシリーズ（シンボル×時間足）をバックグラウンドで取得してキャッシュを温める
+#   1. 切り替え履歴から予測（今の表示の次によく切り替えた表示）
+#   2. 同じシンボルの隣の時間足
+#   3. 最近使ったシンボルの同じ時間足
+# 表示の切り替えが始まったら先読みはすべてキャンセルするので、表示のための取得と競合しない
+# 呼び出しはすべて Tk のスレッドから行う（取得結果も io_loop から Tk のスレッドで merge に渡される）
+class Prefetcher:
+    def __init__(self, io_loop, fetch, merge, timeframes, concurrency=PREFETCH_CONCURRENCY,
+                 fresh_seconds=PREFETCH_FRESH_SECONDS):
+        self.io_loop = io_loop
+        self.fetch = fetch            # async fetch(symbol, timeframe) → バー
+        self.merge = merge            # merge(symbol, timeframe, バー)（キャッシュに反映）
+        self.timeframes = timeframes  # 時間足（短い順）
+        self.concurrency = concurrency
+        self.fresh_seconds = fresh_seconds
+        self.recent_symbols = []                 # 最近使ったシンボル（新しい順）
+        self.transitions = defaultdict(Counter)  # 表示 → 次に切り替えた表示の回数
+        self.fetched_at = {}                     # 表示 → 最後に取得した時刻
+        self._last_view = None
+        self._futures = {}  # 先読み中の表示 → Future
+        self._semaphore = None
+        self.prefetched = 0  # 先読みした件数
+        self.hits = 0        # 取得して間もない表示に切り替えた回数
+
+    # 表示の切り替えの開始（先読みをキャンセルし、履歴を記録）
+    def record(self, symbol, timeframe):
+        self.cancel()
+        view = (symbol, timeframe)
+        if view == self._last_view:
+            return
+        if self._last_view is not None:
+            self.transitions[self._last_view][view] += 1
+        if self._is_fresh(view):
+            self.hits += 1
+        self._last_view = view
+        if symbol in self.recent_symbols:
+            self.recent_symbols.remove(symbol)
+        self.recent_symbols.insert(0, symbol)
+
+    # 表示の読み込みの完了（次に切り替えそうなシリーズの先読みを始める）
+    def loaded(self, symbol, timeframe):
+        self.fetched_at[(symbol, timeframe)] = time.monotonic()
+        for view in self.candidates(symbol, timeframe):
+            if view not in self._futures:
+                self._futures[view] = self.io_loop.submit(
+                    self._prefetch(view), lambda data, view=view: self._done(view, data),
+                    lambda error, view=view: self._futures.pop(view, None), key=("prefetch",) + view)
+
+    # 先読みの候補（優先順、重複と取得して間もないものを除く）
+    def candidates(self, symbol, timeframe):
+        current = (symbol, timeframe)
+        views = [view for view, _ in self.transitions[current].most_common(PREDICTIONS)]
+        if timeframe in self.timeframes:
+            i = self.timeframes.index(timeframe)
+            views += [(symbol, tf) for tf in self.timeframes[max(0, i - 1):i + 2]]
+        views += [(s, timeframe) for s in self.recent_symbols[:RECENT_SYMBOLS]]
+        result = []
+        for view in views:
+            if view != current and view not in result and not self._is_fresh(view):
+                result.append(view)
+        return result
+
+    # 先読み中のものをすべてキャンセル
+    def cancel(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
+    def _is_fresh(self, view):
+        fetched = self.fetched_at.get(view)
+        return fetched is not None and time.monotonic() - fetched < self.fresh_seconds
+
+    # io_loop 側：同時実行数を抑えて取得
+    async def _prefetch(self, view):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return await self.fetch(*view)
+
+    # Tk のスレッド側：取得したバーをキャッシュに反映
+    def _done(self, view, data):
+        self._futures.pop(view, None)
+        self.merge(view[0], view[1], data)
+        self.fetched_at[view] = time.monotonic()
+        self.prefetched += 1
@@ -0,0 +1,153 @@
+import json
+import struct
+import numpy as np
+
+# バイナリ形式のフレーム識別子とヘッダ長フィールドの書式
+FRAME_MAGIC = b"MT5R"
+HEADER_STRUCT = struct.Struct("<4sI")
+
+# 列の並びと型（MT5 の copy_rates_* が返す構造化配列に合わせる）
+RATE_COLUMNS = [
+    ("time", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("tick_volume", "<u8"),
+    ("spread", "<i4"),
+    ("real_volume", "<u8"),
+]
+
+# 桁数スケーリングの対象となる価格列
+PRICE_COLUMNS = ("open", "high", "low", "close")
+
+# バッファの境界合わせ（np.frombuffer でアラインされた配列を得るため）
+ALIGNMENT = 8
+
+# numpy の構造化配列を JSON 用の辞書リストに変換
+def rates_to_list(rates):
+    rates_list = []
+    for row in rates:
+        rates_list.append({
+            "time": int(row["time"]),
+            "open": float(row["open"]),
+            "high": float(row["high"]),
+            "low": float(row["low"]),
+            "close": float(row["close"]),
+            "tick_volume": int(row["tick_volume"]),
+            "spread": int(row["spread"]),
+            "real_volume": int(row["real_volume"]),
+        })
+    return rates_list
+
+# 価格列を 10**digits 倍した整数配列に変換（int32 に収まらない場合は int64）
+def scale_prices(values, digits):
+    scaled = np.rint(np.asarray(values, dtype=np.float64) * (10 ** digits))
+    if len(scaled) == 0 or np.abs(scaled).max() < 2 ** 31:
+        return scaled.astype("<i4")
+    return scaled.astype("<i8")
+
+# レート配列を列ごとの連続バッファとして 1 フレームにまとめる
+# header にはシンボル等のメタ情報を渡す。digits を指定すると価格列を整数で送る
+def encode_rates_binary(header, rates, digits=None):
+    columns = []
+    buffers = []
+    offset = 0
+    for name, dtype in RATE_COLUMNS:
+        if digits is not None and name in PRICE_COLUMNS:
+            column = scale_prices(rates[name], digits)
+            scale = digits
+        else:
+            column = np.ascontiguousarray(rates[name], dtype=dtype)
+            scale = None
+        raw = column.tobytes()
+        columns.append({"name": name, "dtype": column.dtype.str, "offset": offset, "scale": scale})
+        buffers.append(raw)
+        pad = (-len(raw)) % ALIGNMENT
+        if pad:
+            buffers.append(b"\x00" * pad)
+        offset += len(raw) + pad
+
+    meta = dict(header)
+    meta["rows"] = len(rates)
+    meta["columns"] = columns
+    meta_bytes = json.dumps(meta).encode("utf-8")
+    meta_bytes += b" " * ((-(HEADER_STRUCT.size + len(meta_bytes))) % ALIGNMENT)
+    return b"".join([HEADER_STRUCT.pack(FRAME_MAGIC, len(meta_bytes)), meta_bytes] + buffers)
+
+# バイナリフレームをヘッダ辞書と列ごとの numpy 配列に戻す
+# keep_scaled=False の場合、整数化された価格列は float64 に戻す
+def decode_rates_binary(frame, keep_scaled=False):
+    magic, header_len = HEADER_STRUCT.unpack_from(frame, 0)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Invalid binary frame")
+    body_start = HEADER_STRUCT.size + header_len
+    header = json.loads(bytes(frame[HEADER_STRUCT.size:body_start]).decode("utf-8"))
+    rows = header["rows"]
+
+    data = {}
+    for col in header["columns"]:
+        values = np.frombuffer(frame, dtype=np.dtype(col["dtype"]), count=rows,
+                               offset=body_start + col["offset"])
+        if col["scale"] is not None and not keep_scaled:
+            values = values / (10 ** col["scale"])
+        data[col["name"]] = values
+    return header, data
+
+# バッチレスポンスのフレーム識別子と各エントリの長さフィールドの書式
+BATCH_MAGIC = b"MT5B"
+BATCH_STRUCT = struct.Struct("<4sI")
+ENTRY_STRUCT = struct.Struct("<II")
+
+# 複数のレスポンス（バイナリフレーム or JSON 文字列）を 1 フレームにまとめる
+# entries は (キー, レスポンス) のリスト
+def encode_batch_binary(entries):
+    parts = [BATCH_STRUCT.pack(BATCH_MAGIC, len(entries))]
+    for key, response in entries:
+        key_bytes = key.encode("utf-8")
+        body = response if isinstance(response, (bytes, bytearray)) else response.encode("utf-8")
+        parts.append(ENTRY_STRUCT.pack(len(key_bytes), len(body)))
+        parts.append(key_bytes)
+        parts.append(body)
+    return b"".join(parts)
+
+# バッチフレームを {キー: レスポンス} に戻す
+# レートのエントリは (ヘッダ, 列の辞書)、それ以外（エラー等）は JSON を辞書にしたものになる
+def decode_batch_binary(frame, keep_scaled=False):
+    magic, count = BATCH_STRUCT.unpack_from(frame, 0)
+    if magic != BATCH_MAGIC:
+        raise ValueError("Invalid batch frame")
+    view = memoryview(frame)
+    pos = BATCH_STRUCT.size
+    results = {}
+    for _ in range(count):
+        key_len, body_len = ENTRY_STRUCT.unpack_from(frame, pos)
+        pos += ENTRY_STRUCT.size
+        key = bytes(view[pos:pos + key_len]).decode("utf-8")
+        pos += key_len
+        body = view[pos:pos + body_len]
+        pos += body_len
+        if bytes(body[:len(FRAME_MAGIC)]) == FRAME_MAGIC:
+            results[key] = decode_rates_binary(body, keep_scaled)
+        else:
+            results[key] = json.loads(bytes(body).decode("utf-8"))
+    return results
+
+# リクエスト ID 付きのバイナリ応答を包むフレームの識別子
+# ID 付きのリクエストへのバイナリ応答は、このヘッダ（ID の JSON）の後ろに元のフレームを続けて送る
+TAGGED_MAGIC = b"MT5I"
+
+# バイナリフレームにリクエスト ID を付ける（元のフレームの境界合わせは保つ）
+def tag_frame(frame, request_id):
+    id_bytes = json.dumps(request_id).encode("utf-8")
+    id_bytes += b" " * ((-(HEADER_STRUCT.size + len(id_bytes))) % ALIGNMENT)
+    return HEADER_STRUCT.pack(TAGGED_MAGIC, len(id_bytes)) + id_bytes + frame
+
+# ID 付きのフレームを (リクエスト ID, 元のフレーム) に分ける（ID なしは (None, frame)）
+def untag_frame(frame):
+    magic, id_len = HEADER_STRUCT.unpack_from(frame, 0)
+    if magic != TAGGED_MAGIC:
+        return None, frame
+    start = HEADER_STRUCT.size
+    request_id = json.loads(bytes(frame[start:start + id_len]).decode("utf-8"))
+    return request_id, memoryview(frame)[start + id_len:]
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from collections import deque
+
+# レスポンスの既定の有効期間（秒）
+RESPONSE_TTL = 1.0
+
+# (symbol, timeframe) ごとに覚えておく破棄の件数（これより前の世代のエントリは破棄済みとみなす）
+INVALIDATION_LOG_SIZE = 64
+
+# シリアライズ済みレスポンスのキャッシュ
+# 同じキーのリクエストが同時に来た場合は 1 回だけ生成し、結果を全員で共有する
+# 生成はキャッシュが持つタスクで行うので、最初に要求したリクエストがキャンセルされても他の待ち手には影響しない
+# キーの先頭 2 要素は (symbol, timeframe) とし、invalidate でその中の変化した範囲を含むエントリを破棄する
+# 破棄は (symbol, timeframe) ごとの世代を進めて変化の時刻を記録するだけなので、どのスレッドから呼んでもよい
+# （それより後の変化を含むエントリは使わず、生成中に範囲が変わったレスポンスも保存しない）
+class ResponseCache:
+    def __init__(self, ttl=RESPONSE_TTL):
+        self.ttl = ttl
+        self._entries = {}      # key → (有効期限, 世代, 範囲の最後のバーの時刻, レスポンス)
+        self._inflight = {}     # (key, 世代) → 生成中のタスク
+        self._generations = {}  # (symbol, timeframe) → 世代
+        self._changes = {}      # (symbol, timeframe) → 直近の破棄の (世代, 変化した最初のバーの時刻)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    # キャッシュ済みならそれを返し、生成中なら完了を待ち、どちらでもなければ build() で生成する
+    # build は (レスポンス, キャッシュしてよいか, 範囲の最後のバーの時刻) を返すコルーチン関数
+    # 時刻が None のレスポンスは最新のバーまでを含むものとして、どの変化でも破棄する
+    async def get(self, key, build):
+        series = key[:2]
+        generation = self._generations.get(series, 0)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, built, last_time, response = entry
+            if expires > time.monotonic() and not self._changed(series, built, generation, last_time):
+                if built != generation:
+                    self._entries[key] = (expires, generation, last_time, response)
+                self.hits += 1
+                return response
+            del self._entries[key]
+
+        inflight_key = (key, generation)
+        task = self._inflight.get(inflight_key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._build(inflight_key, build))
+            task.add_done_callback(self._consume_exception)
+            self._inflight[inflight_key] = task
+        # 待ち手のキャンセルは生成のタスクに伝えない
+        return await asyncio.shield(task)
+
+    # 生成してキャッシュに保存する（キャッシュが持つタスクとして実行）
+    async def _build(self, inflight_key, build):
+        key, generation = inflight_key
+        try:
+            response, cacheable, last_time = await build()
+        finally:
+            del self._inflight[inflight_key]
+
+        # 生成中に範囲が変わった場合は、古いデータから作った可能性があるので保存しない
+        current = self._generations.get(key[:2], 0)
+        if cacheable and not self._changed(key[:2], generation, current, last_time):
+            self._entries[key] = (time.monotonic() + self.ttl, current, last_time, response)
+        return response
+
+    # 世代 built より後、current までの破棄に last_time 以前のバーの変化があったか
+    # （last_time が None なら変化があれば常に True。記録が残っていない場合も True）
+    def _changed(self, series, built, current, last_time):
+        if built == current:
+            return False
+        log = list(self._changes.get(series, ()))
+        if not log or log[0][0] > built + 1:
+            return True
+        if last_time is None:
+            return True
+        return any(built < generation <= current and (changed_time is None or changed_time <= last_time)
+                   for generation, changed_time in log)
+
+    # シンボル×時間足の changed_time 以降が変わったことを記録（バーキャッシュにバーがマージされるたびに呼ぶ）
+    # changed_time が None なら全体が変わったものとする
+    def invalidate(self, symbol, timeframe, changed_time=None):
+        key = (symbol, timeframe)
+        generation = self._generations.get(key, 0) + 1
+        log = self._changes.get(key)
+        if log is None:
+            log = self._changes.setdefault(key, deque(maxlen=INVALIDATION_LOG_SIZE))
+        log.append((generation, changed_time))  # 世代より先に記録する（読む側が記録のない世代を見ないように）
+        self._generations[key] = generation
+
+    # 期限切れ・破棄済みのエントリを掃除（イベントループのスレッドから呼ぶ）
+    def purge(self):
+        now = time.monotonic()
+        for key, (expires, built, last_time, _) in list(self._entries.items()):
+            if expires <= now or self._changed(key[:2], built, self._generations.get(key[:2], 0), last_time):
+                del self._entries[key]
+
+    # 待ち手が全員キャンセルされた生成の例外で警告を出さない
+    @staticmethod
+    def _consume_exception(task):
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+
+# 全シリーズ合計のメモリの上限（バイト）
+CACHE_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# 上限の本数をこの割合まで超えたら切り詰める（追加のたびにコピーしないため）
+TRIM_SLACK = 1.25
+
+# チャートのシリーズ（キー "SYMBOL_TIMEFRAME" → BarSeries）のキャッシュ
+# シリーズは max_length 本まで（古い方から切り詰める）、合計は memory_budget バイトまでに抑える
+# 上限を超えた場合は最も長く使っていないシリーズから捨てる（次に使う時にディスクかサーバから読み直す）
+# get / put / merge は Tk のスレッドから呼ぶ。peek は統計や使用順を変えないので、別スレッドから読んでもよい
+class SeriesCache:
+    def __init__(self, max_length, memory_budget=CACHE_MEMORY_BUDGET):
+        self.max_length = max_length
+        self.memory_budget = memory_budget
+        self._series = OrderedDict()  # キー → BarSeries（使った順）
+        self.pinned = None            # 捨てないシリーズのキー（表示中のもの）
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self._series
+
+    def __len__(self):
+        return len(self._series)
+
+    # 使用順・統計を変えずに参照
+    def peek(self, key):
+        return self._series.get(key)
+
+    # シリーズを取得（なければ None）
+    def get(self, key):
+        series = self._series.get(key)
+        if series is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._series.move_to_end(key)
+        return series
+
+    # シリーズを格納
+    def put(self, key, series):
+        self._series[key] = series
+        self._series.move_to_end(key)
+        self._enforce(key)
+        return series
+
+    # 取得したバーをマージ（なければそのまま格納）してシリーズを返す
+    def merge(self, key, data):
+        series = self._series.get(key)
+        if series is None:
+            return self.put(key, data)
+        series.merge(data)
+        self._series.move_to_end(key)
+        self._enforce(key)
+        return series
+
+    # 合計のメモリ（バイト）
+    def nbytes(self):
+        return sum(series.nbytes for series in self._series.values())
+
+    # 統計
+    def stats(self):
+        return {"series": len(self._series), "bytes": self.nbytes(), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    # 本数とメモリの上限を守る（key と pinned のシリーズは捨てない）
+    def _enforce(self, key):
+        series = self._series[key]
+        if len(series) > self.max_length * TRIM_SLACK:
+            series.trim(self.max_length)
+        total = self.nbytes()
+        for old_key in list(self._series):
+            if total <= self.memory_budget:
+                break
+            if old_key == key or old_key == self.pinned:
+                continue
+            total -= self._series.pop(old_key).nbytes
+            self.evictions += 1
@@ -0,0 +1,185 @@
+import bisect
+import time
+from collections import deque
+
+# ヒストグラムのバケット上限（ミリ秒）
+LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# 直近の生の計測値を保持する件数（"timings" メッセージ・ベンチマーク用）
+RECENT_SAMPLE_LIMIT = 100000
+
+# 固定バケットのヒストグラム（Prometheus の histogram と同じ累積形式で出力できる）
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # バケットから分位点を線形補間で推定
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return round(lower + (upper - lower) * (rank - seen) / c, 3)
+            seen += c
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum, 3),
+            "mean_ms": round(self.sum / self.count, 3) if self.count else None,
+            "p50_ms": self.quantile(0.50),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+        }
+
+# Prometheus のラベル値のエスケープ（\ と " と改行）
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# サーバの計測値（段階ごとの処理時間・リクエスト数・送信バイト数・接続数）
+# 段階（stage）は parse / queue / fetch / serialize / send
+class ServerMetrics:
+    STAGES = ("parse", "queue", "fetch", "serialize", "send")
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}     # (stage, symbol, timeframe) → Histogram
+        self.requests = {}       # (type, symbol, timeframe) → 件数
+        self.errors = {}         # type → 件数
+        self.bytes_sent = {}     # (symbol, timeframe) → バイト数
+        self.connections_total = 0
+        self.connections_active = 0
+        self.recent = {stage: deque(maxlen=RECENT_SAMPLE_LIMIT) for stage in self.STAGES}
+
+    # 処理時間の記録
+    def observe(self, stage, ms, symbol="", timeframe=""):
+        key = (stage, symbol or "", timeframe or "")
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(ms)
+        self.recent[stage].append(ms)
+
+    # リクエスト件数の記録
+    def count_request(self, msg_type, symbol="", timeframe=""):
+        key = (msg_type, symbol or "", timeframe or "")
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    # エラー件数の記録
+    def count_error(self, msg_type):
+        self.errors[msg_type] = self.errors.get(msg_type, 0) + 1
+
+    # 送信バイト数の記録
+    def count_bytes(self, nbytes, symbol="", timeframe=""):
+        key = (symbol or "", timeframe or "")
+        self.bytes_sent[key] = self.bytes_sent.get(key, 0) + nbytes
+
+    def connection_opened(self):
+        self.connections_total += 1
+        self.connections_active += 1
+
+    def connection_closed(self):
+        self.connections_active -= 1
+
+    # 直近の生の計測値を取り出す（reset=True で消去）
+    def recent_samples(self, reset=False):
+        samples = {stage: list(values) for stage, values in self.recent.items()}
+        if reset:
+            for values in self.recent.values():
+                values.clear()
+        return samples
+
+    # "stats" メッセージ用の集計結果
+    def snapshot(self, extra=None):
+        stages = {}
+        for (stage, symbol, timeframe), hist in self.histograms.items():
+            label = f"{symbol}_{timeframe}" if symbol else "_all"
+            stages.setdefault(stage, {})[label] = hist.snapshot()
+        result = {
+            "type": "stats",
+            "uptime_s": round(time.time() - self.started, 1),
+            "connections": {"active": self.connections_active, "total": self.connections_total},
+            "requests": [{"type": t, "symbol": s, "timeframe": tf, "count": c}
+                         for (t, s, tf), c in self.requests.items()],
+            "errors": dict(self.errors),
+            "bytes_sent": [{"symbol": s, "timeframe": tf, "bytes": b}
+                           for (s, tf), b in self.bytes_sent.items()],
+            "stages": stages,
+        }
+        if extra:
+            result.update(extra)
+        return result
+
+    # Prometheus のテキスト形式で出力
+    # extra は 名前 → (種類, 説明, 値)。キャッシュやキューなど他の部品の値を追加する
+    def prometheus_text(self, extra=None):
+        lines = [
+            "# HELP mt5ws_stage_duration_ms Processing time per stage in milliseconds.",
+            "# TYPE mt5ws_stage_duration_ms histogram",
+        ]
+        for (stage, symbol, timeframe), hist in sorted(self.histograms.items()):
+            labels = f'stage="{_escape(stage)}",symbol="{_escape(symbol)}",timeframe="{_escape(timeframe)}"'
+            cumulative = 0
+            for bound, c in zip(hist.buckets, hist.counts):
+                cumulative += c
+                lines.append(f'mt5ws_stage_duration_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'mt5ws_stage_duration_ms_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f"mt5ws_stage_duration_ms_sum{{{labels}}} {hist.sum}")
+            lines.append(f"mt5ws_stage_duration_ms_count{{{labels}}} {hist.count}")
+
+        lines += ["# HELP mt5ws_requests_total Requests received.", "# TYPE mt5ws_requests_total counter"]
+        for (msg_type, symbol, timeframe), c in sorted(self.requests.items()):
+            lines.append(f'mt5ws_requests_total{{type="{_escape(msg_type)}",symbol="{_escape(symbol)}",timeframe="{_escape(timeframe)}"}} {c}')
+
+        lines += ["# HELP mt5ws_errors_total Error responses sent.", "# TYPE mt5ws_errors_total counter"]
+        for msg_type, c in sorted(self.errors.items()):
+            lines.append(f'mt5ws_errors_total{{type="{_escape(msg_type)}"}} {c}')
+
+        lines += ["# HELP mt5ws_bytes_sent_total Bytes sent to clients.", "# TYPE mt5ws_bytes_sent_total counter"]
+        for (symbol, timeframe), b in sorted(self.bytes_sent.items()):
+            lines.append(f'mt5ws_bytes_sent_total{{symbol="{_escape(symbol)}",timeframe="{_escape(timeframe)}"}} {b}')
+
+        lines += [
+            "# HELP mt5ws_connections_active Open WebSocket connections.",
+            "# TYPE mt5ws_connections_active gauge",
+            f"mt5ws_connections_active {self.connections_active}",
+            "# HELP mt5ws_connections_total WebSocket connections accepted.",
+            "# TYPE mt5ws_connections_total counter",
+            f"mt5ws_connections_total {self.connections_total}",
+        ]
+        for name, (kind, help_text, value) in (extra or {}).items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+# Prometheus 形式の計測値を返す最小限の HTTP サーバ（GET /metrics のみ）
+async def handle_metrics_http(reader, writer, render):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # ヘッダは読み捨て
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = render().encode("utf-8")
+            status = "200 OK"
+        else:
+            body = b"Not Found\n"
+            status = "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    finally:
+        writer.close()
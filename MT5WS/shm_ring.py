@@ -0,0 +1,236 @@
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from data_providers import RATE_DTYPE
+
+# ヘッダ（int64 の配列）の各位置
+# SEQ は書き込み中に奇数になるカウンタ（seqlock）。START / END はリング上の論理位置（END は次に書く位置）
+# VERSION は書き込みごとに増え、CHANGES 以降に書き込みごとの変化した最初のバーの時刻を保持する
+SEQ, START, END, CAPACITY, VERSION = range(5)
+CHANGES = 8
+CHANGE_SLOTS = 64
+HEADER_WORDS = CHANGES + CHANGE_SLOTS
+HEADER_BYTES = HEADER_WORDS * 8
+
+# 共有メモリに接続（別プロセスが作成したもの）
+# Python 3.12 以前は接続側も resource_tracker に登録されるが、multiprocessing で起動したプロセスは
+# 作成側と同じ resource_tracker を共有するため、削除は作成側の unlink の 1 回だけになる
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13 以降
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+# 共有メモリ上のバーのリングバッファ（1 シンボル×時間足分）
+# 書き込みは 1 プロセス（フェッチャー）のみ。読み込み側は SEQ が書き込み前後で変わっていなければ採用する
+class ShmRing:
+    def __init__(self, shm, capacity=None, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if capacity is not None:
+            self.header[:] = 0
+            self.header[CAPACITY] = capacity
+        self.capacity = int(self.header[CAPACITY])
+        self.data = np.ndarray((self.capacity,), dtype=RATE_DTYPE, buffer=shm.buf, offset=HEADER_BYTES)
+
+    # 書き込み側：新しいリングを作成
+    @classmethod
+    def create(cls, capacity):
+        size = HEADER_BYTES + capacity * RATE_DTYPE.itemsize
+        return cls(shared_memory.SharedMemory(create=True, size=size), capacity, owner=True)
+
+    # 読み込み側：名前を指定して既存のリングに接続
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # 共有メモリから切り離す（作成したプロセスは削除も行う）
+    def close(self):
+        self.header = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    # 書き込み側：キャッシュのバー（時刻順）のうち changed_time 以降を反映する
+    # リングの先頭より前から変わった場合（キャッシュの作り直し等）は末尾 capacity 本で置き換える
+    def publish(self, bars, changed_time):
+        h = self.header
+        h[SEQ] += 1
+        try:
+            start, end = int(h[START]), int(h[END])
+            if end == start or changed_time <= self.data["time"][start % self.capacity]:
+                start = end = 0
+                new = bars
+            else:
+                end = self._locate(start, end, changed_time, "left")
+                new = bars[int(np.searchsorted(bars["time"], changed_time, side="left")):]
+            new = new[-self.capacity:]
+            self._put(end, new)
+            end += len(new)
+            h[START] = max(start, end - self.capacity)
+            h[END] = end
+            version = int(h[VERSION]) + 1
+            h[CHANGES + version % CHANGE_SLOTS] = changed_time
+            h[VERSION] = version
+        finally:
+            h[SEQ] += 1
+
+    # 論理位置 pos から rows を書き込む（末尾で折り返す）
+    def _put(self, pos, rows):
+        p = pos % self.capacity
+        first = min(len(rows), self.capacity - p)
+        self.data[p:p + first] = rows[:first]
+        if len(rows) > first:
+            self.data[:len(rows) - first] = rows[first:]
+
+    # 論理位置 [i, j) のバーをコピーして取り出す
+    def _take(self, i, j):
+        p = i % self.capacity
+        n = max(0, j - i)
+        if p + n <= self.capacity:
+            return self.data[p:p + n].copy()
+        return np.concatenate([self.data[p:], self.data[:n - (self.capacity - p)]])
+
+    # [start, end) の中で時刻 t の位置を二分探索（折り返した 2 区間をそれぞれ探す）
+    def _locate(self, start, end, t, side):
+        p = start % self.capacity
+        len1 = min(end - start, self.capacity - p)
+        seg1 = self.data["time"][p:p + len1]
+        seg2 = self.data["time"][:end - start - len1]
+        if len(seg2) and (t > seg1[-1] if side == "left" else t >= seg2[0]):
+            return start + len1 + int(np.searchsorted(seg2, t, side=side))
+        return start + int(np.searchsorted(seg1, t, side=side))
+
+    # 読み込み側：書き込みと重ならなかった読み取り結果を返す（重なった場合は読み直す）
+    def _read(self, fn):
+        h = self.header
+        while True:
+            seq = int(h[SEQ])
+            if seq % 2:
+                time.sleep(0)
+                continue
+            try:
+                result = fn(int(h[START]), int(h[END]))
+            except (ValueError, IndexError):
+                if int(h[SEQ]) == seq:
+                    raise
+                continue
+            if int(h[SEQ]) == seq:
+                return result
+
+    def __len__(self):
+        return self._read(lambda start, end: end - start)
+
+    # (VERSION, seen より後の書き込みで変化した最初の時刻) を返す（変化なしは None）
+    # 書き込みを CHANGE_SLOTS 回以上見逃した場合はリングの先頭の時刻を返す
+    def changes_since(self, seen):
+        def read(start, end):
+            version = int(self.header[VERSION])
+            if version == seen or end == start:
+                return version, None
+            if seen < 0 or version - seen >= CHANGE_SLOTS:
+                return version, int(self.data["time"][start % self.capacity])
+            slots = [CHANGES + v % CHANGE_SLOTS for v in range(seen + 1, version + 1)]
+            return version, int(self.header[slots].min())
+        return self._read(read)
+
+    # 先頭（最も古い）バーの時刻（空なら None）
+    def first_time(self):
+        return self._read(lambda start, end: int(self.data["time"][start % self.capacity]) if end > start else None)
+
+    # 最新のバーの時刻（空なら None）
+    def last_time(self):
+        return self._read(lambda start, end: int(self.data["time"][(end - 1) % self.capacity]) if end > start else None)
+
+    # 最新から count 本
+    def latest(self, count):
+        return self._read(lambda start, end: self._take(max(start, end - count), end))
+
+    # from_time 以降の count 本
+    def since(self, from_time, count):
+        def read(start, end):
+            i = self._locate(start, end, from_time, "left")
+            return self._take(i, min(end, i + count))
+        return self._read(read)
+
+    # [from_time, to_time] の範囲の先頭から最大 limit 本（limit=None で全部）
+    def range(self, from_time, to_time, limit=None):
+        def read(start, end):
+            i = self._locate(start, end, from_time, "left")
+            j = self._locate(start, end, to_time, "right")
+            return self._take(i, j if limit is None else min(j, i + limit))
+        return self._read(read)
+
+# 共有メモリのリングを BarCache と同じ問い合わせ方で読むキャッシュ（フロントエンドのプロセス用）
+# リングに入っていない範囲（古い履歴や多すぎる count）は remote(メソッド名, 引数...) でフェッチャーに問い合わせる
+# 読み取りは BarCache と同じく、まずリングの VERSION を確認して変化があれば listeners に通知する
+# （購読のないシリーズでも、レスポンスのキャッシュが有効期限を待たずに破棄されるように）
+# 返すバーは書き込みと重ならないよう _take でコピーしたもの（リングのビューではない）
+class RingBarCache:
+    def __init__(self, ring, symbol, timeframe, remote):
+        self.ring = ring
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.remote = remote
+        self._seen = -1  # 最後に確認した VERSION
+        self._complete = False  # フェッチャー側にもリング以上の履歴がない
+        self.listeners = []  # 変更通知先（変化した最初のバーの時刻を受け取る関数）
+
+    # 時刻列（コピー）
+    @property
+    def times(self):
+        return self.ring.latest(len(self.ring))["time"]
+
+    # 最新のバーの時刻（空なら None。リング全体はコピーしない）
+    @property
+    def last_time(self):
+        return self.ring.last_time()
+
+    def __len__(self):
+        return len(self.ring)
+
+    # 前回の確認以降にフェッチャーが書き込んだ変化の最初の時刻を返す（変化なしは None）
+    # MT5 への問い合わせはフェッチャーが行うので force は使わない
+    def refresh(self, force=False):
+        self._seen, changed = self.ring.changes_since(self._seen)
+        if changed is not None:
+            for listener in self.listeners:
+                listener(changed)
+        return changed
+
+    # リングに入っているか（from_time がリングの先頭以降か）
+    def _covers(self, from_time):
+        first = self.ring.first_time()
+        return first is not None and from_time >= first
+
+    def latest(self, count):
+        self.refresh()
+        if count > len(self.ring) and not self._complete:
+            rates = self.remote("latest", count)
+            if len(rates) < count:
+                self._complete = True
+            return rates
+        return self.ring.latest(count)
+
+    def since(self, from_time, count):
+        self.refresh()
+        if not self._covers(from_time):
+            return self.remote("since", from_time, count)
+        return self.ring.since(from_time, count)
+
+    def range(self, from_time, to_time):
+        self.refresh()
+        if not self._covers(from_time):
+            return self.remote("range", from_time, to_time)
+        return self.ring.range(from_time, to_time)
+
+    def range_chunk(self, from_time, to_time, limit):
+        self.refresh()
+        if not self._covers(from_time):
+            return self.remote("range_chunk", from_time, to_time, limit)
+        return self.ring.range(from_time, to_time, limit)
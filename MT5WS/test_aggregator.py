@@ -0,0 +1,35 @@
+import numpy as np
+from aggregator import DerivedBarCache, bucket_start, resample
+from bar_cache import BarCache
+
+def test_resample_to_m5(make_bars):
+    bars = make_bars(0, 10)
+    bars["tick_volume"] = np.arange(10)
+    out = resample(bars, "M5")
+    assert list(out["time"]) == [0, 300]
+    assert list(out["open"]) == [0, 300]
+    assert list(out["high"]) == [240, 540]
+    assert list(out["close"]) == [240, 540]
+    assert list(out["tick_volume"]) == [10, 35]
+
+def test_bucket_start_week_and_month():
+    # 1970-01-04 は日曜日、1970-02-01 は月初
+    assert bucket_start([3 * 86400 + 100, 10 * 86400], "W1").tolist() == [3 * 86400, 10 * 86400]
+    assert bucket_start([31 * 86400 + 5], "MN1").tolist() == [31 * 86400]
+
+def test_derived_cache_rebuilds_only_the_changed_tail(source, make_bars):
+    base = BarCache(source, "USDJPY", 1, initial_bars=100, min_refresh_interval=0)
+    derived = DerivedBarCache(base, "M5", fallback_factory=None)
+    changes = []
+    derived.listeners.append(changes.append)
+    derived.refresh()
+    # M1 の先頭（12060）から始まる 12000 の M5 は不完全なので含まない
+    assert derived.times[0] == 12300
+    assert np.array_equal(derived.bars, resample(base.bars, "M5")[1:])
+
+    source.bars["close"][-1] = -1.0
+    source.bars = np.concatenate([source.bars, make_bars(18060, 2)])
+    derived.refresh()
+    assert np.array_equal(derived.bars, resample(base.bars, "M5")[1:])
+    assert derived.latest(1)["close"][0] == 18120
+    assert changes == [12300, 18000]
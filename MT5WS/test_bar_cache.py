@@ -0,0 +1,54 @@
+import numpy as np
+from bar_cache import BarCache, REFRESH_BARS
+
+def make_cache(source, initial_bars=100, max_bars=1000):
+    return BarCache(source, "USDJPY", 1, initial_bars=initial_bars, max_bars=max_bars, min_refresh_interval=0)
+
+def test_initial_load(source):
+    cache = make_cache(source)
+    changes = []
+    cache.listeners.append(changes.append)
+    assert list(cache.latest(3)["time"]) == [17880, 17940, 18000]
+    assert len(cache) == 100
+    assert changes == [12060]
+
+def test_forming_bar_update_is_merged(source):
+    cache = make_cache(source)
+    cache.refresh()
+    changes = []
+    cache.listeners.append(changes.append)
+    assert cache.refresh() is None  # 変化なし
+    source.bars["close"][-1] = -1.0
+    assert cache.refresh() == 18000
+    assert cache.latest(1)["close"][0] == -1.0
+    assert len(cache) == 100
+    assert changes == [18000]
+
+def test_appended_bars_fill_the_gap(source, make_bars):
+    cache = make_cache(source)
+    cache.refresh()
+    source.bars = np.concatenate([source.bars, make_bars(18060, REFRESH_BARS + 5)])
+    assert cache.refresh() == 18060
+    assert np.array_equal(cache.bars, source.bars[-len(cache):])
+    assert np.all(np.diff(cache.times) == 60)
+
+def test_latest_is_clamped_to_max_bars(source):
+    cache = make_cache(source, max_bars=150)
+    assert len(cache.latest(1000)) == 150
+    calls = len(source.calls)
+    assert len(cache.latest(1000)) == 150
+    assert source.calls[calls:] == ["from_pos"]  # 差分更新だけで取り直さない
+
+def test_history_exhausted_is_remembered(source):
+    cache = make_cache(source)
+    assert len(cache.latest(1000)) == 300
+    calls = len(source.calls)
+    cache.latest(1000)
+    assert source.calls[calls:] == ["from_pos"]
+
+def test_since_and_range_reach_older_history(source):
+    cache = make_cache(source)
+    assert list(cache.since(6000, 3)["time"]) == [6000, 6060, 6120]
+    assert list(cache.since(12000, 3)["time"]) == [12000, 12060, 12120]  # 取得分とキャッシュの境目
+    assert list(cache.range(11940, 12120)["time"]) == [11940, 12000, 12060, 12120]
+    assert list(cache.range_chunk(600, 18000, 4)["time"]) == [600, 660, 720, 780]
@@ -0,0 +1,45 @@
+import numpy as np
+from bar_series import BarSeries
+
+def test_tail_is_a_view_with_the_parent_version(make_bars):
+    series = BarSeries.from_rates(make_bars(60, 10))
+    view = series.tail(3)
+    assert list(view["time"]) == [480, 540, 600]
+    assert view.version == series.version
+    assert np.shares_memory(view["close"], series["close"])
+
+def test_parent_write_changes_the_view_version(make_bars):
+    series = BarSeries.from_rates(make_bars(60, 10))
+    view = series.tail(3)
+    before = view.version
+    bar = series[-1]
+    bar["close"] = -1.0
+    series.replace_last(bar)
+    # 元の系列の書き込みはビューにも見えるので、ビューの version も変わる
+    assert view["close"][-1] == -1.0
+    assert view.version != before
+    series.merge(make_bars(600, 2))
+    assert view.version == series.version
+
+def test_view_write_copies_and_leaves_the_parent_alone(make_bars):
+    series = BarSeries.from_rates(make_bars(60, 10))
+    view = series.tail(3)
+    parent_version = series.version
+    bar = view[-1]
+    bar["close"] = -1.0
+    view.replace_last(bar)
+    assert series["close"][-1] == 600
+    assert series.version == parent_version
+    assert view.version > parent_version
+    # 切り離した後は元の系列の書き込みの影響を受けない
+    version = view.version
+    series.replace_last(series[-1])
+    assert view.version == version
+    assert view["close"][-1] == -1.0
+
+def test_trim_keeps_existing_views(make_bars):
+    series = BarSeries.from_rates(make_bars(60, 10))
+    view = series.tail(5)
+    series.trim(2)
+    assert list(series["time"]) == [540, 600]
+    assert list(view["time"]) == [360, 420, 480, 540, 600]
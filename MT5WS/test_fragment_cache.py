@@ -0,0 +1,32 @@
+import json
+from fragment_cache import FragmentCache
+from rate_codec import rates_to_list
+
+def expected(rates):
+    return [json.dumps(row) for row in rates_to_list(rates)]
+
+def test_texts_match_plain_encoding(make_bars):
+    cache = FragmentCache()
+    bars = make_bars(60, 10)
+    assert cache.json_texts("USDJPY", "M1", bars) == expected(bars)
+    assert cache.json_texts("USDJPY", "M1", bars[4:]) == expected(bars[4:])
+    assert (cache.encoded, cache.reused) == (10, 6)
+
+def test_changed_and_appended_bars_are_reencoded(make_bars):
+    cache = FragmentCache()
+    bars = make_bars(60, 10)
+    cache.json_texts("USDJPY", "M1", bars)
+    bars = make_bars(60, 12)
+    bars["close"][9] = -1.0  # 形成中だったバーの確定
+    assert cache.json_texts("USDJPY", "M1", bars) == expected(bars)
+    assert (cache.encoded, cache.reused) == (13, 9)
+    assert cache.json_texts("USDJPY", "M1", bars) == expected(bars)
+    assert cache.encoded == 13
+
+def test_older_range_is_not_kept(make_bars):
+    cache = FragmentCache(max_bars=5)
+    bars = make_bars(60, 10)
+    cache.json_texts("USDJPY", "M1", bars)
+    assert cache.json_texts("USDJPY", "M1", bars[:3]) == expected(bars[:3])
+    assert cache.json_texts("USDJPY", "M1", bars[5:]) == expected(bars[5:])
+    assert (cache.encoded, cache.reused) == (13, 5)
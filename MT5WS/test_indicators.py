@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from bar_series import BarSeries
+from indicators import INDICATOR_TYPES, IndicatorSet, create_indicator
+
+SPECS = [{"type": "SMA", "period": 5}, {"type": "EMA", "period": 5},
+         {"type": "Bollinger", "period": 5, "deviations": 2.5}, {"type": "RSI", "period": 5},
+         {"type": "ATR", "period": 5}]
+
+# 価格がランダムに動くバー（高値・安値は始値・終値を含む）
+@pytest.fixture
+def random_bars(make_bars):
+    def make(first, count, seed):
+        bars = make_bars(first, count)
+        rng = np.random.default_rng(seed)
+        bars["close"] = 150.0 + np.cumsum(rng.normal(0, 0.1, count))
+        bars["open"] = bars["close"] + rng.normal(0, 0.05, count)
+        bars["high"] = np.maximum(bars["open"], bars["close"]) + rng.random(count) * 0.1
+        bars["low"] = np.minimum(bars["open"], bars["close"]) - rng.random(count) * 0.1
+        return bars
+    return make
+
+def make_set(series):
+    indicator_set = IndicatorSet([create_indicator(spec) for spec in SPECS])
+    for indicator in indicator_set:
+        indicator_set.get(series, indicator)
+    return indicator_set
+
+# 続きの計算が全体をまとめて計算した結果と一致すること（全体の計算を呼ばないこと）
+def assert_matches_full(indicator_set, series, monkeypatch):
+    for cls in INDICATOR_TYPES.values():
+        monkeypatch.setattr(cls, "compute", lambda self, columns: pytest.fail("full recompute"))
+    indicator_set.update(series)
+    monkeypatch.undo()
+    for indicator in indicator_set:
+        expected = indicator.compute(IndicatorSet._columns(series, indicator))
+        result = indicator_set.get(series, indicator)
+        for name in expected:
+            assert len(result[name]) == len(series)
+            assert np.allclose(result[name], expected[name], equal_nan=True), (indicator.label(), name)
+
+def test_forming_bar_change(random_bars, monkeypatch):
+    series = BarSeries.from_rates(random_bars(60, 50, 1))
+    indicator_set = make_set(series)
+    bar = series[-1]
+    bar["close"] += 1.0
+    bar["high"] += 1.0
+    series.replace_last(bar)
+    assert_matches_full(indicator_set, series, monkeypatch)
+
+def test_new_bars_and_revised_previous_bar(random_bars, monkeypatch):
+    bars = random_bars(60, 60, 2)
+    series = BarSeries.from_rates(bars[:50])
+    indicator_set = make_set(series)
+    for count in (52, 53, 60):
+        series.merge(bars[49:count])  # 形成中だったバーの確定と新しいバー
+        bars = bars.copy()
+        bars["close"][count - 1] -= 0.5
+        assert_matches_full(indicator_set, series, monkeypatch)
+
+def test_appending_grows_the_result_in_place(random_bars):
+    bars = random_bars(60, 600, 3)
+    series = BarSeries.from_rates(bars[:10])
+    indicator_set = make_set(series)
+    for count in range(11, 601):
+        series.append(bars[count - 1:count])
+        indicator_set.update(series)
+    sma = indicator_set.indicators[0]
+    expected = sma.compute(IndicatorSet._columns(series, sma))["sma"]
+    assert np.allclose(indicator_set.get(series, sma)["sma"], expected, equal_nan=True)
+
+def test_short_series_starts_from_the_first_bar(random_bars, monkeypatch):
+    bars = random_bars(60, 8, 4)
+    series = BarSeries.from_rates(bars[:1])
+    indicator_set = make_set(series)
+    for count in range(2, 9):
+        series.append(bars[count - 1:count])
+        assert_matches_full(indicator_set, series, monkeypatch)
+
+def test_trimmed_series_keeps_the_moving_sum(random_bars, monkeypatch):
+    bars = random_bars(60, 60, 5)
+    series = BarSeries.from_rates(bars[:50])
+    indicator_set = IndicatorSet([create_indicator(SPECS[0]), create_indicator(SPECS[2])])
+    for indicator in indicator_set:
+        indicator_set.get(series, indicator)
+    series.append(bars[50:52])
+    series.trim(40)
+    assert_matches_full(indicator_set, series, monkeypatch)
+
+def test_replaced_series_is_computed_again(random_bars):
+    series = BarSeries.from_rates(random_bars(60, 50, 6))
+    indicator_set = make_set(series)
+    other = BarSeries.from_rates(random_bars(6000, 30, 7))
+    indicator_set.update(other)
+    for indicator in indicator_set:
+        expected = indicator.compute(IndicatorSet._columns(other, indicator))
+        for name, values in indicator_set.get(other, indicator).items():
+            assert np.allclose(values, expected[name], equal_nan=True)
+
+def test_parameters_are_checked_against_their_ranges():
+    bands = create_indicator({"type": "Bollinger", "period": 20, "deviations": 2.5})
+    assert bands.deviations == 2.5
+    assert bands.label() == "Bollinger(20, 2.5)"
+    with pytest.raises(ValueError):
+        create_indicator({"type": "SMA", "period": 0})
+    indicator_set = IndicatorSet()
+    indicator_set.replace([{"type": "RSI", "period": 1}, {"type": "RSI", "period": 14}])
+    assert [indicator.label() for indicator in indicator_set] == ["RSI(14)"]
@@ -0,0 +1,50 @@
+import json
+import numpy as np
+from rate_codec import (decode_batch_binary, decode_rates_binary, encode_batch_binary, encode_rates_binary,
+                        rates_to_list, tag_frame, untag_frame)
+
+def test_binary_round_trip(make_bars):
+    bars = make_bars(60, 5)
+    bars["close"] += 0.125
+    header, data = decode_rates_binary(encode_rates_binary({"symbol": "USDJPY"}, bars))
+    assert header["symbol"] == "USDJPY" and header["rows"] == 5
+    for name in bars.dtype.names:
+        assert np.array_equal(data[name], bars[name])
+
+def test_binary_round_trip_with_scaled_prices(make_bars):
+    bars = make_bars(60, 3)
+    bars["close"] = [150.123, 150.456, 150.789]
+    frame = encode_rates_binary({}, bars, digits=3)
+    _, scaled = decode_rates_binary(frame, keep_scaled=True)
+    assert scaled["close"].dtype.kind == "i"
+    assert list(scaled["close"]) == [150123, 150456, 150789]
+    _, data = decode_rates_binary(frame)
+    assert np.allclose(data["close"], bars["close"])
+
+def test_empty_frame(make_bars):
+    header, data = decode_rates_binary(encode_rates_binary({}, make_bars(60, 0), digits=3))
+    assert header["rows"] == 0
+    assert all(len(column) == 0 for column in data.values())
+
+def test_batch_round_trip(make_bars):
+    bars = make_bars(60, 2)
+    frame = encode_batch_binary([("a", encode_rates_binary({"symbol": "A"}, bars)),
+                                 ("b", json.dumps({"error": "Unknown symbol"}))])
+    results = decode_batch_binary(frame)
+    header, data = results["a"]
+    assert header["symbol"] == "A" and list(data["time"]) == [60, 120]
+    assert results["b"] == {"error": "Unknown symbol"}
+
+def test_tagged_frame_keeps_alignment(make_bars):
+    frame = encode_rates_binary({}, make_bars(60, 3))
+    request_id, inner = untag_frame(tag_frame(frame, "req-1"))
+    assert request_id == "req-1"
+    assert bytes(inner) == frame
+    _, data = decode_rates_binary(inner)
+    assert list(data["time"]) == [60, 120, 180]
+    assert untag_frame(frame) == (None, frame)
+
+def test_rates_to_list(make_bars):
+    rows = rates_to_list(make_bars(60, 2))
+    assert rows[1] == {"time": 120, "open": 120.0, "high": 120.0, "low": 120.0, "close": 120.0,
+                       "tick_volume": 1, "spread": 0, "real_volume": 0}
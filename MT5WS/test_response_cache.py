@@ -0,0 +1,95 @@
+import asyncio
+from response_cache import INVALIDATION_LOG_SIZE, ResponseCache
+
+KEY = ("USDJPY", "M5", 100, None, "json", False)
+
+# release が set されるまで待ってからレスポンスを返す build（last_time は範囲の最後のバーの時刻）
+def slow_build(release, calls, last_time=None):
+    async def build():
+        calls.append(1)
+        await release.wait()
+        return "response", True, last_time
+    return build
+
+def test_coalesced_waiter_survives_cancelled_owner():
+    async def run():
+        cache = ResponseCache()
+        release = asyncio.Event()
+        calls = []
+        owner = asyncio.create_task(cache.get(KEY, slow_build(release, calls)))
+        await asyncio.sleep(0)
+        other = asyncio.create_task(cache.get(KEY, slow_build(release, calls)))
+        await asyncio.sleep(0)
+        owner.cancel()  # 最初に要求したクライアントの切断
+        await asyncio.sleep(0)
+        release.set()
+        assert await other == "response"
+        assert owner.cancelled()
+        assert len(calls) == 1
+        assert cache.coalesced == 1
+        # 生成は最後まで行われ、結果はキャッシュに残る
+        assert await cache.get(KEY, slow_build(release, calls)) == "response"
+        assert cache.hits == 1
+    asyncio.run(run())
+
+def test_build_error_is_shared_and_not_cached():
+    async def run():
+        cache = ResponseCache()
+        async def failing():
+            await asyncio.sleep(0)
+            raise RuntimeError("boom")
+        results = await asyncio.gather(cache.get(KEY, failing), cache.get(KEY, failing), return_exceptions=True)
+        assert [str(r) for r in results] == ["boom", "boom"]
+        release = asyncio.Event()
+        release.set()
+        assert await cache.get(KEY, slow_build(release, [])) == "response"
+        assert cache.misses == 2
+    asyncio.run(run())
+
+def test_invalidate_during_build_is_not_cached():
+    async def run():
+        cache = ResponseCache()
+        release = asyncio.Event()
+        calls = []
+        task = asyncio.create_task(cache.get(KEY, slow_build(release, calls)))
+        await asyncio.sleep(0)
+        cache.invalidate("USDJPY", "M5")
+        release.set()
+        assert await task == "response"
+        await cache.get(KEY, slow_build(release, calls))
+        assert len(calls) == 2
+    asyncio.run(run())
+
+def test_invalidate_only_drops_entries_containing_the_change():
+    async def run():
+        cache = ResponseCache()
+        release = asyncio.Event()
+        release.set()
+        calls = []
+        closed = ("USDJPY", "M5", 10, 600, "json", False)  # from_time 指定で 10 本そろった範囲
+        await cache.get(closed, slow_build(release, calls, last_time=3300))
+        await cache.get(KEY, slow_build(release, calls))  # 最新のバーまでを含む範囲
+        cache.invalidate("USDJPY", "M5", 3600)  # 範囲より後の変化
+        await cache.get(closed, slow_build(release, calls, last_time=3300))
+        await cache.get(KEY, slow_build(release, calls))
+        assert len(calls) == 3  # 最新のバーまでを含むレスポンスだけ作り直す
+        cache.invalidate("USDJPY", "M5", 3300)  # 範囲の最後のバーの変化
+        await cache.get(closed, slow_build(release, calls, last_time=3300))
+        assert len(calls) == 4
+        cache.invalidate("EURUSD", "M5", 0)  # 別のシンボル
+        await cache.get(closed, slow_build(release, calls, last_time=3300))
+        assert len(calls) == 4
+    asyncio.run(run())
+
+def test_entries_older_than_the_invalidation_log_are_dropped():
+    async def run():
+        cache = ResponseCache()
+        release = asyncio.Event()
+        release.set()
+        calls = []
+        await cache.get(KEY[:3] + (600,) + KEY[4:], slow_build(release, calls, last_time=3300))
+        for _ in range(INVALIDATION_LOG_SIZE + 1):
+            cache.invalidate("USDJPY", "M5", 10 ** 9)
+        await cache.get(KEY[:3] + (600,) + KEY[4:], slow_build(release, calls, last_time=3300))
+        assert len(calls) == 2
+    asyncio.run(run())
@@ -0,0 +1,70 @@
+from shm_ring import CHANGE_SLOTS, RingBarCache
+
+def test_publish_and_read(ring, make_bars):
+    bars = make_bars(60, 5)
+    ring.publish(bars, 60)
+    assert len(ring) == 5
+    assert ring.first_time() == 60
+    assert ring.last_time() == 300
+    assert list(ring.latest(2)["time"]) == [240, 300]
+    assert list(ring.since(120, 2)["time"]) == [120, 180]
+    assert list(ring.range(120, 240)["time"]) == [120, 180, 240]
+
+def test_publish_updates_forming_bar_and_appends(ring, make_bars):
+    bars = make_bars(60, 5)
+    ring.publish(bars, 60)
+    bars = make_bars(60, 7)
+    bars["close"][4] = -1.0  # 形成中だったバーの確定
+    ring.publish(bars, 300)
+    assert len(ring) == 7
+    assert list(ring.latest(7)["time"]) == list(bars["time"])
+    assert ring.latest(3)["close"][0] == -1.0
+
+def test_wraparound_keeps_last_capacity_bars(ring, make_bars):
+    ring.publish(make_bars(60, 6), 60)
+    bars = make_bars(60, 11)
+    ring.publish(bars, 420)
+    assert len(ring) == 8
+    assert ring.first_time() == int(bars["time"][3])
+    assert ring.last_time() == int(bars["time"][-1])
+    assert list(ring.latest(8)["time"]) == list(bars["time"][3:])
+    assert list(ring.range(0, 10 ** 9)["time"]) == list(bars["time"][3:])
+
+def test_locate_across_wrap(ring, make_bars):
+    ring.publish(make_bars(60, 6), 60)
+    ring.publish(make_bars(60, 11), 420)  # 論理位置 [3, 11)、物理位置は 3..7 と 0..2
+    start, end = 3, 11
+    assert ring._locate(start, end, 240, "left") == 3
+    assert ring._locate(start, end, 480, "left") == 7
+    assert ring._locate(start, end, 540, "left") == 8
+    assert ring._locate(start, end, 540, "right") == 9
+    assert ring._locate(start, end, 10 ** 9, "left") == 11
+    assert ring._locate(start, end, 0, "right") == 3
+
+def test_changes_since(ring, make_bars):
+    assert ring.changes_since(-1) == (0, None)
+    ring.publish(make_bars(60, 5), 60)
+    version, changed = ring.changes_since(-1)
+    assert (version, changed) == (1, 60)
+    assert ring.changes_since(version) == (1, None)
+    ring.publish(make_bars(60, 6), 300)
+    ring.publish(make_bars(60, 6), 360)
+    assert ring.changes_since(version) == (3, 300)  # 見逃した書き込みの最小の時刻
+
+def test_changes_since_after_missing_too_many_writes(ring, make_bars):
+    ring.publish(make_bars(60, 5), 60)
+    for _ in range(CHANGE_SLOTS):
+        ring.publish(make_bars(60, 5), 300)
+    # 記録が残っていない場合はリングの先頭から変わったものとする
+    assert ring.changes_since(1) == (CHANGE_SLOTS + 1, 60)
+
+def test_ring_cache_reads_notify_listeners(ring, make_bars):
+    ring.publish(make_bars(60, 5), 60)
+    cache = RingBarCache(ring, "USDJPY", "M1", remote=None)
+    changes = []
+    cache.listeners.append(changes.append)
+    cache.latest(2)
+    ring.publish(make_bars(60, 6), 300)
+    cache.since(240, 2)
+    cache.latest(2)  # 変化なし
+    assert changes == [60, 300]
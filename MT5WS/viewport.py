@@ -0,0 +1,52 @@
+import numpy as np
+
+# チャートの座標変換（表示中のロウソク足の価格の範囲・キャンバスの大きさ・ロウソク足の間隔）
+# データかキャンバスの大きさが変わった時に 1 回だけ作り、描画と当たり判定はすべてこれを使う
+# 価格・インデックス・時刻の変換は numpy の配列をまとめて渡してもよい
+# インデックスは rates（表示本数より長い場合もある）全体での位置。最新のバーが右端に来る
+class Viewport:
+    def __init__(self, rates, width, height, display_count, candle_width, candle_gap):
+        self.width = width
+        self.height = height
+        self.candle_width = candle_width
+        self.space = candle_width + candle_gap
+        self.total = len(rates)
+        display = rates.tail(display_count)
+        self.count = len(display)
+        self.times = display["time"]
+        if self.count:
+            self.min_price = float(display["low"].min())
+            self.max_price = float(display["high"].max())
+        else:
+            self.min_price = self.max_price = 0.0
+        self.price_range = self.max_price - self.min_price or 1
+
+    # (最小値, 最大値, レンジ)
+    @property
+    def bounds(self):
+        return self.min_price, self.max_price, self.price_range
+
+    # 価格から y 座標
+    def price_to_y(self, price):
+        if isinstance(price, np.ndarray):
+            return self.height - ((price - self.min_price) / self.price_range * self.height).astype(np.int64)
+        return self.height - int((price - self.min_price) / self.price_range * self.height)
+
+    # y 座標から価格
+    def y_to_price(self, y):
+        return self.min_price + (self.height - y) / self.height * self.price_range
+
+    # インデックスからロウソク足の左端の x 座標
+    def index_to_x(self, index):
+        return self.width - (self.total - index) * self.space
+
+    # x 座標からインデックス（範囲外の場合もそのまま返す）
+    def x_to_index(self, x):
+        return self.total - (self.width - x) // self.space - 1
+
+    # 時刻から、最も近い表示中のロウソク足の中央の x 座標（表示するバーがなければ None）
+    def time_to_x(self, t):
+        if not self.count:
+            return None
+        i = int(np.abs(self.times - t).argmin())
+        return self.width - (self.count - i) * self.space + self.candle_width // 2
@@ -1,25 +1,334 @@
 import asyncio
+import itertools
 import json
 import websockets
 from config import websocket_uri
+from rate_codec import decode_rates_binary, decode_batch_binary, untag_frame
+
+# 接続に失敗した場合の再接続の待ち時間（秒）。失敗するたびに倍にし、上限で止める
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 10.0
+CONNECT_ATTEMPTS = 5
+
+# 接続維持の ping の間隔と応答待ち時間（秒）
+KEEPALIVE_INTERVAL = 20.0
+KEEPALIVE_TIMEOUT = 20.0
+
+# 1 リクエストの応答待ち時間（秒）
+REQUEST_TIMEOUT = 30.0
 
 # MT5 WebSocket サーバと通信するクライアントクラス
+# request_rates / request_batch は 1 本の接続を使い回し、リクエストに ID を付けて複数を同時に送る
+# subscribe / subscribe_ticks も同じ接続で購読し、ID のない更新はシンボル×時間足（ティックはシンボル）で振り分ける
+# 接続は最初のリクエスト時に張り、切れた場合は次のリクエストで張り直す
+# stream_range だけは専用の接続を使う（理由は stream_range のコメントを参照）
 class MT5WebSocketClient:
     def __init__(self, uri=websocket_uri):
         # WebSocket サーバのURIを初期化
         self.uri = uri
+        self._ws = None          # 使い回す接続
+        self._loop = None        # 接続を張ったイベントループ
+        self._reader = None      # 応答を受信するタスク
+        self._connecting = None  # 接続処理中の Future（同時に張らないため）
+        self._pending = {}       # リクエスト ID → 応答待ちの Future
+        self._subscribers = {}   # ("bars", シンボル, 時間足) / ("tick", シンボル) → 更新を受け取るキューのリスト
+        self._ids = itertools.count(1)
 
     # 為替レートデータをリクエストし、結果を返す（非同期）
     # from_time を指定すれば差分のみ取得できる
-    async def request_rates(self, symbol: str, timeframe: str, count: int = 100, from_time: int = None):
-        payload = self._build_request(symbol, timeframe, count, from_time)
-        async with websockets.connect(self.uri) as ws:
-            await ws.send(json.dumps(payload))  # リクエスト送信
-            response = await ws.recv()          # 非同期で応答受信
-            return self._handle_response(response)  # 同期関数で処理
+    # binary=True の場合は列ごとの numpy 配列の辞書を返す（scaled=True で価格を整数化して転送）
+    async def request_rates(self, symbol: str, timeframe: str, count: int = 100, from_time: int = None,
+                            binary: bool = False, scaled: bool = False):
+        payload = self._build_request(symbol, timeframe, count, from_time, binary, scaled)
+        response = await self._request(payload)
+        return self._handle_response(response)  # 同期関数で処理
+
+    # 接続を閉じる（応答待ちのリクエストは ConnectionError になる）
+    async def close(self):
+        ws = self._ws if self._loop is asyncio.get_running_loop() else None
+        self._drop_connection(ConnectionError("Client closed"))
+        if ws is not None:
+            await ws.close()
+
+    # ID を付けてリクエストを送り、同じ ID の応答を待つ
+    # 接続が切れて応答が届かなかった場合は、張り直して 1 回だけ送り直す（取得系のリクエストのみのため安全）
+    async def _request(self, payload):
+        for attempt in range(2):
+            ws = await self._connection()
+            request_id = next(self._ids)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = future
+            try:
+                await ws.send(json.dumps(dict(payload, id=request_id)))
+                return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+            except (ConnectionError, websockets.ConnectionClosed):
+                if attempt:
+                    raise
+            finally:
+                self._pending.pop(request_id, None)
+
+    # 使い回す接続を返す（なければ張る）
+    # asyncio.run() を呼ぶたびにイベントループが変わる使い方でも動くよう、別のループで張った接続は捨てる
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._drop_connection(ConnectionError("Event loop changed"))
+            self._loop = loop
+        if self._ws is not None:
+            return self._ws
+        if self._connecting is None:
+            self._connecting = loop.create_task(self._connect())
+        try:
+            return await asyncio.shield(self._connecting)
+        finally:
+            if self._connecting is not None and self._connecting.done():
+                self._connecting = None
+
+    # 接続を張る（失敗した場合は待ち時間を倍にしながら CONNECT_ATTEMPTS 回まで試す）
+    async def _connect(self):
+        delay = RECONNECT_DELAY
+        for attempt in range(CONNECT_ATTEMPTS):
+            try:
+                ws = await websockets.connect(self.uri, max_size=None, ping_interval=KEEPALIVE_INTERVAL,
+                                              ping_timeout=KEEPALIVE_TIMEOUT)
+                break
+            except OSError as e:
+                if attempt == CONNECT_ATTEMPTS - 1:
+                    raise ConnectionError(f"Cannot connect to {self.uri}: {e}")
+                print(f"[Connect] retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        self._ws = ws
+        self._reader = asyncio.get_running_loop().create_task(self._read(ws))
+        return ws
+
+    # 応答を受信し、ID ごとの Future に渡す（ID のないメッセージは購読の更新として振り分ける）
+    async def _read(self, ws):
+        try:
+            async for message in ws:
+                if isinstance(message, (bytes, bytearray)):
+                    request_id, message = untag_frame(message)
+                else:
+                    message = json.loads(message)
+                    request_id = message.get("id")
+                if request_id is None:
+                    self._dispatch(message)
+                    continue
+                future = self._pending.get(request_id)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self._ws is ws:
+                self._drop_connection(ConnectionError("Connection lost"))
+
+    # 接続を手放し、応答待ちのリクエストを error で終わらせる
+    # 購読はこの接続で購読していたものだけに知らせる（接続前に登録した購読は、購読のリクエストの失敗で分かる）
+    def _drop_connection(self, error):
+        if self._reader is not None and self._reader is not asyncio.current_task():
+            self._reader.cancel()
+        connected = self._ws is not None
+        self._ws = self._reader = self._connecting = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        if connected:
+            for queues in self._subscribers.values():
+                for queue in queues:
+                    queue.put_nowait(error)  # 購読側で張り直して購読し直す
+
+    # 複数のシンボル×時間足をまとめてリクエストし、{キー: データ} の辞書を返す
+    # entries は {"symbol", "timeframe", "count", "from_time", "id"(任意)} の辞書、
+    # または (symbol, timeframe, count[, from_time]) のタプルのリスト
+    # キーは id、なければ "SYMBOL_TIMEFRAME"。取得に失敗したエントリの値は RuntimeError になる
+    async def request_batch(self, entries, binary: bool = False, scaled: bool = False):
+        requests = []
+        for entry in entries:
+            if not isinstance(entry, dict):
+                entry = dict(zip(("symbol", "timeframe", "count", "from_time"), entry))
+            req = self._build_request(entry["symbol"], entry["timeframe"], entry.get("count", 100),
+                                      entry.get("from_time"))
+            if entry.get("id"):
+                req["id"] = entry["id"]
+            requests.append(req)
+
+        payload = {"type": "batch", "requests": requests}
+        if binary:
+            payload["format"] = "binary"
+            if scaled:
+                payload["scaled"] = True
+        response = await self._request(payload)
+        return self._handle_batch_response(response)
+
+    # バッチ応答を {キー: データ} に変換
+    def _handle_batch_response(self, raw_response):
+        if isinstance(raw_response, (bytes, bytearray, memoryview)):
+            results = {}
+            for key, value in decode_batch_binary(raw_response).items():
+                if isinstance(value, dict):
+                    results[key] = RuntimeError(f"Server error: {value.get('error')}")
+                else:
+                    results[key] = value[1]  # 列ごとの numpy 配列
+            return results
+
+        data = raw_response if isinstance(raw_response, dict) else json.loads(raw_response)
+        if "error" in data:
+            raise RuntimeError(f"Server error: {data['error']}")
+        results = {}
+        for key, value in data["results"].items():
+            if "error" in value:
+                results[key] = RuntimeError(f"Server error: {value['error']}")
+            else:
+                results[key] = value["data"]
+        return results
+
+    # from_time〜to_time のレートをチャンクごとに返す非同期イテレータ
+    # 大量の履歴（M1 の 20 万本など）を一度に受け取らず、チャンク単位で処理・描画できる
+    # 接続が切れた場合は reconnect_delay 秒後に最後のチャンクの続きから再開する（max_retries 回まで）
+    # 共有の接続は使わない。サーバはチャンクの送信が終わるまで次を読み込まないので、受け取る側が読む速さで流れが止まる
+    # 共有の接続では受信タスクが他の応答のために読み続けるため、処理の遅い利用側の分だけチャンクを溜め込むか、
+    # 受信を止めて同じ接続の他の応答まで待たせることになる
+    # 使い方: async for chunk in client.stream_range("USDJPY", "M1", from_time): ...
+    async def stream_range(self, symbol: str, timeframe: str, from_time: int, to_time: int = None,
+                           chunk_size: int = 5000, binary: bool = False, scaled: bool = False,
+                           max_retries: int = 5, reconnect_delay: float = 1.0):
+        payload = self._build_request(symbol, timeframe, 0, from_time, binary, scaled)
+        payload.update(type="range", chunk_size=chunk_size)
+        if to_time:
+            payload["to_time"] = to_time
+        retries = 0
+        while True:
+            try:
+                async with websockets.connect(self.uri, max_size=None) as ws:
+                    await ws.send(json.dumps(payload))
+                    async for message in ws:
+                        header, data = self._handle_chunk(message)
+                        retries = 0
+                        if header["cursor"]:
+                            payload = {k: v for k, v in payload.items()
+                                       if k in ("format", "scaled", "chunk_size")}
+                            payload.update(type="range", cursor=header["cursor"])
+                        yield data
+                        if header["done"]:
+                            return
+            except (OSError, websockets.ConnectionClosed) as e:
+                retries += 1
+                if retries > max_retries:
+                    raise
+                print(f"[StreamRange] resuming: {e}")
+            await asyncio.sleep(reconnect_delay)
+
+    # チャンクを (ヘッダ, データ) に変換
+    def _handle_chunk(self, raw_message):
+        if isinstance(raw_message, (bytes, bytearray)):
+            return decode_rates_binary(raw_message)
+        message = json.loads(raw_message)
+        if "error" in message:
+            raise RuntimeError(f"Server error: {message['error']}")
+        return message, message["data"]
+
+    # 指定したシンボル×時間足を購読し、サーバから更新が届くたびに on_update(symbol, timeframe, data) を呼ぶ
+    # キャンセルされるまで戻らない。接続が切れた場合は reconnect_delay 秒後に再購読する
+    # サーバは 1 接続につきシンボル×時間足ごとに 1 つの形式で送るので、同じ組を binary の有無を変えて
+    # 同時に購読すると、後から購読した形式で両方に届く
+    async def subscribe(self, symbol: str, timeframe: str, on_update, binary: bool = False,
+                        reconnect_delay: float = 1.0):
+        payload = self._build_request(symbol, timeframe, 0, binary=binary)
+        payload["type"] = "subscribe"
+        key = ("bars", symbol.upper(), timeframe.upper())
+        await self._run_subscription(key, payload, lambda update: on_update(*update), "Subscribe", reconnect_delay)
+
+    # 指定したシンボルのティックを購読し、届くたびに on_tick(tick) を呼ぶ
+    # tick は {"symbol", "time", "time_msc", "bid", "ask", "last", "volume"} の辞書
+    # 受信が追いつかない場合、サーバは最新のティックだけを送る。キャンセルされるまで戻らない
+    async def subscribe_ticks(self, symbol: str, on_tick, reconnect_delay: float = 1.0):
+        payload = {"type": "subscribe_ticks", "symbol": symbol}
+        await self._run_subscription(("tick", symbol.upper()), payload, on_tick, "SubscribeTicks", reconnect_delay)
+
+    # 共有の接続で購読し、key の更新が届くたびに handle を呼ぶ（キャンセルされるまで戻らない）
+    # handle の例外は表示して購読を続ける
+    # 接続が切れた場合は reconnect_delay 秒後に、サーバのエラー応答の場合は待ち時間を倍にしながら購読し直す
+    async def _run_subscription(self, key, payload, handle, tag, reconnect_delay):
+        delay = reconnect_delay
+        while True:
+            wait = reconnect_delay
+            queue = asyncio.Queue()
+            self._subscribers.setdefault(key, []).append(queue)  # 購読の応答より先に届く更新も受け取る
+            try:
+                response = await self._request(payload)
+                if "error" in response:
+                    raise RuntimeError(f"Server error: {response['error']}")
+                while True:
+                    item = await queue.get()
+                    if isinstance(item, Exception):
+                        raise item
+                    try:
+                        handle(item)
+                    except Exception as e:
+                        print(f"[{tag}] callback error: {e!r}")
+                    else:
+                        delay = reconnect_delay
+            except (OSError, ConnectionError, websockets.ConnectionClosed) as e:
+                print(f"[{tag}] reconnecting: {e}")
+            except Exception as e:
+                print(f"[{tag}] error, resubscribing in {delay:.1f}s: {e!r}")
+                wait = delay
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                self._remove_subscriber(key, queue)
+            await asyncio.sleep(wait)
+
+    # 購読のキューを外す。同じ key を購読しているものがなくなった場合はサーバの購読も解除する
+    # 解除は ID なしで送る（サーバは ID なしのリクエストを受信順に処理するので、後に送った購読を追い越さない）
+    def _remove_subscriber(self, key, queue):
+        queues = self._subscribers.get(key, [])
+        if queue in queues:
+            queues.remove(queue)
+        if queues:
+            return
+        self._subscribers.pop(key, None)
+        if self._ws is not None and self._loop is asyncio.get_running_loop():
+            if key[0] == "bars":
+                message = {"type": "unsubscribe", "symbol": key[1], "timeframe": key[2]}
+            else:
+                message = {"type": "unsubscribe_ticks", "symbol": key[1]}
+            self._loop.create_task(self._send_quietly(self._ws, message))
+
+    # 応答を待たずに送る（接続が切れていれば何もしない）
+    @staticmethod
+    async def _send_quietly(ws, message):
+        try:
+            await ws.send(json.dumps(message))
+        except websockets.ConnectionClosed:
+            pass
+
+    # ID のないメッセージを購読中のキューに渡す（購読の更新・ティック以外は読み捨てる）
+    def _dispatch(self, message):
+        if isinstance(message, dict) and message.get("type") == "tick":
+            key, item = ("tick", message.get("symbol")), message
+        else:
+            item = self._handle_update(message)
+            if item is None:
+                return
+            key = ("bars", item[0], item[1])
+        for queue in self._subscribers.get(key, ()):
+            queue.put_nowait(item)
+
+    # 購読の更新を (symbol, timeframe, data) に変換（更新以外は None。受信済みの JSON は辞書で渡される）
+    # バイナリフレームは ID のない応答が購読の更新だけなので、そのまま更新として読む
+    def _handle_update(self, message):
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            header, columns = decode_rates_binary(message)
+            return header["symbol"], header["timeframe"], columns
+        if message.get("type") != "update":
+            return None
+        return message["symbol"], message["timeframe"], message["data"]
 
     # リクエストデータの作成
-    def _build_request(self, symbol: str, timeframe: str, count: int, from_time: int = None):
+    def _build_request(self, symbol: str, timeframe: str, count: int, from_time: int = None,
+                       binary: bool = False, scaled: bool = False):
         req = {
             "symbol": symbol,
             "timeframe": timeframe,
@@ -27,12 +336,20 @@ class MT5WebSocketClient:
         }
         if from_time:
             req["from_time"] = from_time  # 差分取得開始時刻（UNIX秒）
+        if binary:
+            req["format"] = "binary"  # 列ごとのバイナリ形式で受け取る
+            if scaled:
+                req["scaled"] = True  # 価格を桁数で整数化して転送
         return req
 
-    # サーバからの応答を検証・抽出する
-    def _handle_response(self, raw_response: str):
+    # サーバからの応答を検証・抽出する（受信済みの JSON は辞書で渡される）
+    def _handle_response(self, raw_response):
+        # バイナリフレームは列ごとの numpy 配列として返す（エラーは常に JSON で届く）
+        if isinstance(raw_response, (bytes, bytearray, memoryview)):
+            _, columns = decode_rates_binary(raw_response)
+            return columns
         try:
-            data = json.loads(raw_response)
+            data = raw_response if isinstance(raw_response, dict) else json.loads(raw_response)
             if "error" in data:
                 raise RuntimeError(f"Server error: {data['error']}")
             if "data" not in data: